@@ -0,0 +1 @@
+"""Benchmarks for flask_cognitologin hot paths."""
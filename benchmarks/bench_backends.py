@@ -0,0 +1,52 @@
+"""Verifications per second of each ``COGNITO_VERIFIER`` backend
+
+Every backend verifies the same access token, and the same id token
+with its ``at_hash``, with keys parsed once. Run it with::
+
+    python -m benchmarks.bench_backends
+"""
+from flask_cognitologin.verifiers import VERIFIERS
+
+from .common import rate
+from .keys import makeKeys, makeToken, CLIENT_ID
+
+
+def main():
+    private, jwks = makeKeys()
+    access_token = makeToken(private, 'bench-key-1', token_use='access')
+    id_token = makeToken(private, 'bench-key-1', access_token=access_token)
+
+    results = {}
+    for name in sorted(VERIFIERS):
+        try:
+            verifier = VERIFIERS[name]()
+            by_kid = verifier.parseKeys(jwks['keys'])
+        except ImportError as e:
+            print("%-13s skipped: %s" % (name, e))
+            continue
+
+        def access():
+            header = verifier.header(access_token)
+            return verifier.decode(
+                access_token, by_kid[header['kid']], audience=CLIENT_ID)
+
+        def identity():
+            header = verifier.header(id_token)
+            return verifier.decode(
+                id_token, by_kid[header['kid']], audience=CLIENT_ID,
+                access_token=access_token)
+
+        assert access()['token_use'] == 'access'
+        assert identity()['token_use'] == 'id'
+        results[name] = (rate(access), rate(identity))
+
+    base = results.get('jose')
+    print("%-13s %12s %12s %8s" % ('backend', 'access/s', 'id/s', 'speedup'))
+    for name, (access, identity) in results.items():
+        speedup = access / base[0] if base else 1
+        print("%-13s %12.0f %12.0f %7.2fx" % (
+            name, access, identity, speedup))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Tokens per second of a ``_verify`` loop vs ``verifyMany``
+
+The tokens are unique, so neither run is helped by the token cache. Run it
+with::
+
+    python -m benchmarks.bench_batch
+"""
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+from .common import makeApp
+from .keys import makeKeys, makeToken
+
+TOKENS = 2000
+
+
+def measure(fn, tokens):
+    start = time.perf_counter()
+    fn(tokens)
+    return len(tokens) / (time.perf_counter() - start)
+
+
+def main():
+    private, jwks = makeKeys()
+    app, cl = makeApp(jwks, COGNITO_VERIFIER='cryptography')
+
+    def batch():
+        return [
+            makeToken(private, 'bench-key-%d' % (i % 2), token_use='access',
+                      jti='bench-%d-%d' % (time.time_ns(), i))
+            for i in range(TOKENS)]
+
+    def loop(tokens):
+        with app.app_context():
+            for token in tokens:
+                cl._verify(token)
+
+    def many(tokens):
+        for token, claims, error in cl.verifyMany(tokens):
+            assert error is None
+
+    def threads(tokens):
+        with ThreadPoolExecutor(4) as pool:
+            for token, claims, error in cl.verifyMany(tokens, pool=pool):
+                assert error is None
+
+    loop_rate = measure(loop, batch())
+    print("_verify loop:        %10.0f tokens/s" % loop_rate)
+    for name, fn in (('verifyMany', many), ('verifyMany 4 threads', threads)):
+        r = measure(fn, batch())
+        print("%-20s %10.0f tokens/s (%.2fx)" % (
+            name + ':', r, r / loop_rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Import and ``init_app`` time of the extension, with ``-X importtime``
+
+Run it with::
+
+    python -m benchmarks.bench_import
+"""
+import subprocess
+import sys
+
+#: modules that must not be loaded until the extension talks to cognito
+HEAVY_MODULES = (
+    'requests', 'urllib3', 'jose', 'cryptography', 'httpx', 'sqlite3')
+#: microseconds importing the extension may take once flask is loaded
+IMPORT_BUDGET = 50000
+
+_CODE = """
+import flask, sys, time
+before = set(sys.modules)
+import flask_cognitologin
+app = flask.Flask('bench')
+app.config.update(
+    AWS_REGION='bench-region', COGNITO_POOL_ID='bench-pool',
+    COGNITO_DOMAIN='bench-domain', COGNITO_CLIENT_ID='bench-client',
+    COGNITO_CALLBACK_URL='http://127.0.0.1:5000/callback',
+    COGNITO_CLIENT_SECRET='bench-secret')
+start = time.perf_counter()
+flask_cognitologin.CognitoLogin(app)
+print(int((time.perf_counter() - start) * 1e6))
+print(','.join(sorted(set(m.split('.')[0] for m in sys.modules) -
+                      set(m.split('.')[0] for m in before))))
+"""
+
+
+def measure():
+    """Import the extension and build an app in a fresh interpreter
+
+    :returns: the cumulative import time of the package and the
+        ``init_app`` time, in microseconds, and the top level modules
+        loaded by both
+    :rtype: tuple
+    """
+    r = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _CODE],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    import_time = None
+    for line in r.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == 'flask_cognitologin':
+            import_time = int(parts[1])
+    init_time, modules = r.stdout.splitlines()
+    return import_time, int(init_time), set(modules.split(','))
+
+
+def main(runs=5):
+    results = [measure() for _ in range(runs)]
+    import_time = min(r[0] for r in results)
+    init_time = min(r[1] for r in results)
+    heavy = sorted(set(HEAVY_MODULES) & results[0][2])
+    print("import:   %8d us (budget %d us)" % (import_time, IMPORT_BUDGET))
+    print("init_app: %8d us" % init_time)
+    print("heavy modules loaded: %s" % (", ".join(heavy) or "none"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+"""Latency of ``_verify`` with a cold and a warm verified token cache
+
+Run it with::
+
+    python -m benchmarks.bench_token_cache
+"""
+from .common import makeApp, rate
+from .keys import makeKeys, makeToken
+
+
+def main():
+    private, jwks = makeKeys()
+    token = makeToken(private, 'bench-key-0')
+    app, cl = makeApp(jwks)
+
+    with app.app_context():
+        cache = cl.tokenCache
+
+        def cold():
+            cache.clear()
+            return cl._verify(token)
+
+        def warm():
+            return cl._verify(token)
+
+        assert cold() == warm()
+        cold_rate, warm_rate = rate(cold), rate(warm)
+        print("cold cache: %10.1f us/verify" % (1e6 / cold_rate))
+        print("warm cache: %10.1f us/verify" % (1e6 / warm_rate))
+        print("speedup:    %10.1fx" % (warm_rate / cold_rate))
+        print("stats:      %s" % cache.stats())
+
+
+if __name__ == '__main__':
+    main()
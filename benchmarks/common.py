@@ -0,0 +1,40 @@
+"""Helpers shared by the benchmarks."""
+from flask_cognitologin import CognitoLogin
+from flask_cognitologin.jwks import jwks_cache
+import flask
+import time
+
+from .keys import CLIENT_ID, ISSUER
+
+
+def rate(fn, seconds=2.0):
+    """Call ``fn`` for about ``seconds`` and return the calls per second"""
+    count, start = 0, time.perf_counter()
+    while True:
+        fn()
+        count += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return count / elapsed
+
+
+def makeApp(jwks, **config):
+    """Flask app with the extension and the ``jwks`` keys already cached
+
+    :returns: the app and the extension
+    :rtype: tuple
+    """
+    app = flask.Flask(__name__)
+    app.config.update({
+        'SECRET_KEY': 'bench-secret',
+        'AWS_REGION': 'bench-region',
+        'COGNITO_POOL_ID': 'bench-pool',
+        'COGNITO_DOMAIN': 'bench-domain',
+        'COGNITO_CLIENT_ID': CLIENT_ID,
+        'COGNITO_CALLBACK_URL': 'http://127.0.0.1:5000/callback',
+        'COGNITO_CLIENT_SECRET': 'bench-client-secret',
+    })
+    app.config.update(config)
+    jwks_cache.clear()
+    jwks_cache._store(ISSUER, jwks['keys'])
+    return app, CognitoLogin(app)
@@ -0,0 +1,57 @@
+"""RSA keys and cognito like tokens for the benchmarks."""
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+from jose.utils import long_to_base64, calculate_at_hash
+import hashlib
+import time
+
+CLIENT_ID = 'bench-client-id'
+ISSUER = 'https://cognito-idp.bench-region.amazonaws.com/bench-pool'
+
+
+def makeKeys(count=2):
+    """Generate ``count`` RSA keys
+
+    :returns: the private keys, indexed by ``kid``, and the public JWKS
+        document
+    :rtype: tuple
+    """
+    private, public = dict(), []
+    for i in range(count):
+        kid = 'bench-key-%d' % i
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        private[kid] = jwk.construct(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()).decode(), 'RS256')
+        numbers = key.public_key().public_numbers()
+        public.append({
+            'alg': 'RS256', 'kty': 'RSA', 'use': 'sig', 'kid': kid,
+            'e': long_to_base64(numbers.e).decode(),
+            'n': long_to_base64(numbers.n).decode(),
+        })
+    return private, {'keys': public}
+
+
+def makeToken(private, kid, token_use='id', lifetime=3600, access_token=None,
+              **claims):
+    """Sign a cognito like token with the key ``kid``
+
+    An id token for ``access_token`` gets its ``at_hash`` claim.
+    """
+    now = int(time.time())
+    data = {
+        'sub': 'bench-user', 'iss': ISSUER, 'token_use': token_use,
+        'iat': now, 'exp': now + lifetime, 'auth_time': now,
+    }
+    if token_use == 'id':
+        data['aud'] = CLIENT_ID
+    else:
+        data['client_id'] = CLIENT_ID
+        data['scope'] = 'openid'
+    if access_token is not None:
+        data['at_hash'] = calculate_at_hash(access_token, hashlib.sha256)
+    data.update(claims)
+    return jwt.encode(
+        data, private[kid], algorithm='RS256', headers={'kid': kid})
@@ -0,0 +1,93 @@
+"""Work done per login by the old and the new token exchange pipeline
+
+Counts the JSON decodes and measures the peak memory (tracemalloc) and time
+of one ``getIdentity`` with a mocked token endpoint response. Run it with::
+
+    python -m benchmarks.profile_login
+"""
+from flask import session
+import requests
+import tracemalloc
+import json
+import time
+
+from .common import makeApp
+from .keys import makeKeys, makeToken
+
+
+def tokenResponse(body):
+    r = requests.Response()
+    r.status_code = 200
+    r._content = json.dumps(body).encode()
+    return r
+
+
+def oldGetIdentity(cl, r):
+    # getIdentity before the TokenSet pipeline
+    cl._verify(r.json()['access_token'])
+    id_token = cl._verify(
+        r.json()['id_token'], access_token=r.json()['access_token'])
+    ret = dict()
+    ret.update(id_token)
+    ret['refresh_token'] = r.json()['refresh_token']
+    return ret
+
+
+def profile(name, login, cache, rounds=200):
+    decodes = [0]
+    loads = json.loads
+
+    def counting_loads(*args, **kwargs):
+        decodes[0] += 1
+        return loads(*args, **kwargs)
+
+    json.loads = counting_loads
+    try:
+        peak = 0
+        start = time.perf_counter()
+        tracemalloc.start()
+        for _ in range(rounds):
+            cache.clear()
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            login()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.stop()
+        elapsed = time.perf_counter() - start
+    finally:
+        json.loads = loads
+
+    print("%-6s json decodes/login: %5.1f  peak bytes/login: %7d  "
+          "us/login: %7.1f" % (
+              name, decodes[0] / rounds, peak, 1e6 * elapsed / rounds))
+
+
+def main():
+    private, jwks = makeKeys()
+    access = makeToken(private, 'bench-key-0', token_use='access')
+    id_token = makeToken(private, 'bench-key-0', access_token=access)
+    body = {
+        'id_token': id_token, 'access_token': access,
+        'refresh_token': 'bench-refresh-token', 'expires_in': 3600,
+        'token_type': 'Bearer'}
+    app, cl = makeApp(jwks)
+    state = app.extensions['cognitologin']
+    state.http.post = lambda *a, **kw: tokenResponse(body)
+
+    def login():
+        # the state is used once, every callback gets its own
+        session['mycogext_csrf_state'] = 'bench'
+        identity = cl.getIdentity()
+        assert identity is not None
+        return identity
+
+    with app.test_request_context('/callback?state=bench&code=bench'):
+        assert oldGetIdentity(cl, tokenResponse(body)) == login()
+        profile(
+            'before', lambda: oldGetIdentity(cl, state.http.post()),
+            cl.tokenCache)
+        profile('after', login, cl.tokenCache)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Local cognito stand-in issuing real RS256 tokens
+
+Serves the ``/oauth2/token`` endpoint (``authorization_code`` and
+``refresh_token`` grants) and the user pool JWKS, the issuer is the server
+URL itself.
+"""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+import threading
+import json
+import os
+
+from .keys import makeKeys, makeToken
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def _reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.endswith('/.well-known/jwks.json'):
+            self._reply(200, self.server.stub.jwks)
+        else:
+            self._reply(404, {'error': 'not_found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode())
+        grant = form.get('grant_type', [None])[0]
+        if self.path != '/oauth2/token' or grant not in (
+                'authorization_code', 'refresh_token'):
+            self._reply(400, {'error': 'invalid_request'})
+            return
+        self._reply(200, self.server.stub.issue(grant == 'authorization_code'))
+
+    def log_message(self, *args):
+        pass
+
+
+class CognitoStub(object):
+    """Run the stub in a background thread::
+
+        with CognitoStub() as stub:
+            app.config['COGNITO_DOMAIN'] = stub.url
+            app.config['COGNITO_ISSUER'] = stub.url
+    """
+
+    def __init__(self, lifetime=3600):
+        self.lifetime = lifetime
+        self.private, self.jwks = makeKeys()
+        self.kid = self.jwks['keys'][0]['kid']
+        self._server = None
+        self._thread = None
+        self.url = None
+
+    def token(self, token_use='id', **claims):
+        """Sign a token of this user pool"""
+        claims.setdefault('iss', self.url)
+        claims.setdefault('jti', os.urandom(8).hex())
+        return makeToken(
+            self.private, self.kid, token_use=token_use,
+            lifetime=self.lifetime, **claims)
+
+    def issue(self, with_refresh_token):
+        """Build a token endpoint response"""
+        access = self.token('access')
+        data = {
+            'access_token': access,
+            'id_token': self.token('id', access_token=access),
+            'expires_in': self.lifetime, 'token_type': 'Bearer'}
+        if with_refresh_token:
+            data['refresh_token'] = os.urandom(16).hex()
+        return data
+
+    def start(self):
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.stub = self
+        self.url = 'http://127.0.0.1:%d' % self._server.server_address[1]
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, args=(0.05,))
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,201 @@
+"""Benchmark suite of the login, refresh and verify hot paths
+
+Runs every scenario against a local :class:`~benchmarks.stub.CognitoStub`
+with one thread and with ``--threads`` threads, and saves the results as
+JSON. With ``--baseline`` the run fails if a scenario throughput dropped
+more than ``--tolerance`` from the baseline::
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --baseline results.json --tolerance 0.2
+"""
+from flask_cognitologin import CognitoLogin, __version__
+from flask_cognitologin.jwks import jwks_cache
+from flask import session
+import argparse
+import platform
+import threading
+import flask
+import json
+import time
+import sys
+
+from .keys import CLIENT_ID
+from .stub import CognitoStub
+
+
+def makeApp(stub, **config):
+    app = flask.Flask(__name__)
+    app.config.update({
+        'SECRET_KEY': 'bench-secret',
+        'AWS_REGION': 'bench-region',
+        'COGNITO_POOL_ID': 'bench-pool',
+        'COGNITO_DOMAIN': stub.url,
+        'COGNITO_ISSUER': stub.url,
+        'COGNITO_CLIENT_ID': CLIENT_ID,
+        'COGNITO_CALLBACK_URL': 'http://127.0.0.1:5000/callback',
+        'COGNITO_CLIENT_SECRET': 'bench-client-secret',
+        'COGNITO_JWKS_PRELOAD': True,
+    })
+    app.config.update(config)
+    return app, CognitoLogin(app)
+
+
+def scenarios(stub):
+    """Return ``{name: (app, setup)}``
+
+    ``setup()`` runs inside a request context of ``app`` in each benchmark
+    thread and returns the function to measure.
+    """
+    # without caches every call does the full work
+    app, cl = makeApp(
+        stub, COGNITO_TOKEN_CACHE_SIZE=0, COGNITO_REFRESH_CACHE_TTL=0)
+    cached_app, cached_cl = makeApp(stub)
+
+    def signIn():
+        return cl.getSignInUrl
+
+    def getIdentity():
+        def login():
+            # the state is used once, every callback gets its own
+            session['mycogext_csrf_state'] = 'bench'
+            if cl.getIdentity() is None:
+                raise RuntimeError("getIdentity failed")
+        return login
+
+    def checkValid():
+        identity = {
+            'exp': int(time.time()) + 3600, 'refresh_token': 'bench'}
+        return lambda: cl.checkIdentity(identity)
+
+    def checkExpired():
+        identity = {'exp': 0, 'refresh_token': 'bench'}
+        return lambda: cl.checkIdentity(identity)
+
+    def verify():
+        token = stub.token('access')
+        return lambda: cl._verify(token)
+
+    def verifyCached():
+        token = stub.token('access')
+        return lambda: cached_cl._verify(token)
+
+    return {
+        'getSignInUrl': (app, signIn),
+        'getIdentity': (app, getIdentity),
+        'checkIdentity_valid': (app, checkValid),
+        'checkIdentity_expired': (app, checkExpired),
+        '_verify': (app, verify),
+        '_verify_cached': (cached_app, verifyCached),
+    }
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def measure(app, setup, threads, duration):
+    latencies = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker():
+        mine = []
+        with app.test_request_context('/callback?state=bench&code=bench'):
+            fn = setup()
+            fn()  # warm up
+            barrier.wait()
+            end = time.perf_counter() + duration
+            while True:
+                start = time.perf_counter()
+                fn()
+                now = time.perf_counter()
+                mine.append(now - start)
+                if now >= end:
+                    break
+        with lock:
+            latencies.extend(mine)
+
+    start = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    [t.start() for t in pool]
+    [t.join() for t in pool]
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'threads': threads,
+        'ops': len(latencies),
+        'ops_per_sec': len(latencies) / elapsed,
+        'p50_ms': 1000 * percentile(latencies, 0.50),
+        'p99_ms': 1000 * percentile(latencies, 0.99),
+    }
+
+
+def run(threads=8, duration=2.0, only=None):
+    results = {}
+    jwks_cache.clear()
+    with CognitoStub() as stub:
+        for name, (app, setup) in scenarios(stub).items():
+            if only and name not in only:
+                continue
+            for n in sorted(set([1, threads])):
+                key = '%s@%d' % (name, n)
+                results[key] = measure(app, setup, n, duration)
+                r = results[key]
+                print("%-28s %10.0f op/s  p50 %8.3f ms  p99 %8.3f ms" % (
+                    key, r['ops_per_sec'], r['p50_ms'], r['p99_ms']))
+    return {
+        'meta': {
+            'version': __version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'threads': threads,
+            'duration': duration,
+            'timestamp': int(time.time()),
+        },
+        'results': results,
+    }
+
+
+def regressions(results, baseline, tolerance):
+    """Return the scenarios slower than ``baseline`` by more than
+    ``tolerance`` (a fraction of the baseline throughput)"""
+    slower = []
+    for key, base in baseline['results'].items():
+        current = results['results'].get(key)
+        if current is None:
+            continue
+        if current['ops_per_sec'] < base['ops_per_sec'] * (1 - tolerance):
+            slower.append((key, base['ops_per_sec'], current['ops_per_sec']))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=2.0,
+                        help='seconds for each scenario')
+    parser.add_argument('--only', action='append',
+                        help='run only this scenario, can be repeated')
+    parser.add_argument('--output', help='save the results in this file')
+    parser.add_argument('--baseline', help='results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    results = run(args.threads, args.duration, args.only)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        slower = regressions(results, baseline, args.tolerance)
+        for key, before, after in slower:
+            print("REGRESSION %s: %.0f -> %.0f op/s" % (key, before, after))
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""Asyncio support, needs httpx::
+
+    pip install flask_cognitologin[async]
+"""
+from .transport import DEFAULT_POOL_SIZE, DEFAULT_CONNECT_TIMEOUT
+from .transport import DEFAULT_READ_TIMEOUT, DEFAULT_RETRIES
+from .breaker import CircuitOpenError
+from urllib.parse import urlsplit
+import asyncio
+import weakref
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+
+if httpx is not None:
+    class AsyncCircuitOpenError(CircuitOpenError, httpx.ConnectError):
+        """The circuit of the host is open, see
+        :class:`~flask_cognitologin.breaker.CircuitBreaker`"""
+
+
+class AsyncCognitoClient(object):
+    """Pooled keep-alive asyncio HTTP client
+
+    An :class:`httpx.AsyncClient` can only be used in the event loop where
+    it was created, so one client is kept for each running loop. With an
+    ASGI server there is a single loop and a single pool of connections.
+
+    Only connection errors are retried, like in
+    :class:`~flask_cognitologin.transport.CognitoClient`. Requests are
+    reported to ``metrics`` and go through ``breaker`` if they are set,
+    with an open circuit :class:`AsyncCircuitOpenError` is raised.
+    """
+
+    metrics = None
+    breaker = None
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT,
+                 retries=DEFAULT_RETRIES):
+        if httpx is None:
+            raise RuntimeError(
+                "httpx is needed for asyncio support, install "
+                "flask_cognitologin[async]")
+        self.pool_size = pool_size
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.retries = retries
+        self._clients = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def fromConfig(cls, config):
+        """Build a client from the ``COGNITO_HTTP_*`` keys of ``config``"""
+        return cls(
+            pool_size=config.get(
+                'COGNITO_HTTP_POOL_SIZE', DEFAULT_POOL_SIZE),
+            connect_timeout=config.get(
+                'COGNITO_HTTP_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT),
+            read_timeout=config.get(
+                'COGNITO_HTTP_READ_TIMEOUT', DEFAULT_READ_TIMEOUT),
+            retries=config.get('COGNITO_HTTP_RETRIES', DEFAULT_RETRIES))
+
+    @property
+    def client(self):
+        """The :class:`httpx.AsyncClient` of the running event loop"""
+        loop = asyncio.get_event_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size),
+                transport=httpx.AsyncHTTPTransport(retries=self.retries))
+            self._clients[loop] = client
+        return client
+
+    async def get(self, url, **kwargs):
+        return await self._send(self.client.get, url, kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self._send(self.client.post, url, kwargs)
+
+    async def _send(self, send, url, kwargs):
+        breaker = self.breaker
+        if breaker is None:
+            return await self._measure(send, url, kwargs)
+
+        host = urlsplit(url).netloc
+        if not breaker.allow(host):
+            raise AsyncCircuitOpenError("Circuit open for %s" % host)
+        try:
+            r = await self._measure(send, url, kwargs)
+        except Exception:
+            breaker.failure(host)
+            raise
+        if r.status_code >= 500:
+            breaker.failure(host)
+        else:
+            breaker.success(host)
+        return r
+
+    async def _measure(self, send, url, kwargs):
+        metrics = self.metrics
+        start = metrics.start() if metrics is not None else None
+        if start is None:
+            return await send(url, **kwargs)
+
+        path = urlsplit(url).path
+        try:
+            r = await send(url, **kwargs)
+        except httpx.HTTPError as e:
+            metrics.observe('http_request', start, path=path, outcome='error')
+            metrics.count('upstream_error', path=path, error=type(e).__name__)
+            raise
+        if r.is_success:
+            metrics.observe('http_request', start, path=path, outcome='ok')
+        else:
+            error = 'http_%d' % r.status_code
+            metrics.observe('http_request', start, path=path, outcome=error)
+            metrics.count('upstream_error', path=path, error=error)
+        return r
+
+    async def aclose(self):
+        """Close the client of the running event loop"""
+        client = self._clients.pop(asyncio.get_event_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+class AsyncSingleFlight(object):
+    """Coalesce concurrent coroutines for the same key into one
+
+    Like :class:`~flask_cognitologin.cache.SingleFlight` for the tasks of
+    an event loop, nothing is kept once the call is done.
+    """
+
+    def __init__(self):
+        self._calls = weakref.WeakKeyDictionary()
+
+    async def do(self, key, fn, *args, **kwargs):
+        """Return ``await fn(*args, **kwargs)``, sharing the call"""
+        loop = asyncio.get_event_loop()
+        calls = self._calls.setdefault(loop, {})
+        future = calls.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = calls[key] = loop.create_future()
+        try:
+            result = await fn(*args, **kwargs)
+        except Exception as e:
+            future.set_exception(e)
+            # the leader raises it, don't warn if nobody else waited
+            future.exception()
+            raise
+        except BaseException:
+            # cancelled, so are the waiters
+            future.cancel()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del calls[key]
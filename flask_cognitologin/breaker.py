@@ -0,0 +1,95 @@
+"""Circuit breaker for the cognito endpoints."""
+import threading
+import time
+
+#: consecutive failures opening the circuit of a host
+DEFAULT_THRESHOLD = 5
+#: seconds an open circuit fails fast before a request is let through
+DEFAULT_RESET_TIMEOUT = 30
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(Exception):
+    """A request was not sent because the circuit of its host is open"""
+
+
+class _Circuit(object):
+    __slots__ = ('state', 'failures', 'opened_at')
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+
+
+class CircuitBreaker(object):
+    """Fail fast while a host keeps failing
+
+    After ``threshold`` consecutive failures (connection errors, timeouts
+    or ``5xx`` responses) the circuit of the host opens and
+    :meth:`allow` refuses the requests. Once ``reset_timeout`` seconds
+    passed one request is let through, the circuit closes if it succeeds
+    and opens again if it fails. A ``threshold`` of ``0`` disables it.
+
+    State changes are reported to ``metrics``, a
+    :class:`~flask_cognitologin.metrics.Metrics`, if given.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD,
+                 reset_timeout=DEFAULT_RESET_TIMEOUT, metrics=None):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.metrics = metrics
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def allow(self, host):
+        """Return ``True`` if a request to ``host`` can be sent"""
+        circuit = self._circuits.get(host)
+        if circuit is None or circuit.state == CLOSED:
+            return True
+        with self._lock:
+            if circuit.state == OPEN and \
+                    time.monotonic() - circuit.opened_at >= self.reset_timeout:
+                # let this one request through
+                self._change(host, circuit, HALF_OPEN)
+                return True
+            return circuit.state == CLOSED
+
+    def success(self, host):
+        circuit = self._circuits.get(host)
+        if circuit is None:
+            return
+        with self._lock:
+            circuit.failures = 0
+            if circuit.state != CLOSED:
+                self._change(host, circuit, CLOSED)
+
+    def failure(self, host):
+        if self.threshold <= 0:
+            return
+        with self._lock:
+            circuit = self._circuits.get(host)
+            if circuit is None:
+                circuit = self._circuits[host] = _Circuit()
+            circuit.failures += 1
+            if circuit.state == HALF_OPEN or (
+                    circuit.state == CLOSED and
+                    circuit.failures >= self.threshold):
+                circuit.opened_at = time.monotonic()
+                self._change(host, circuit, OPEN)
+
+    def states(self):
+        """Return the state of the circuit of each host that failed
+
+        :rtype: dict
+        """
+        return {host: c.state for host, c in self._circuits.items()}
+
+    def _change(self, host, circuit, state):
+        circuit.state = state
+        if self.metrics is not None:
+            self.metrics.count('circuit', host=host, state=state)
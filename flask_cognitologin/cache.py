@@ -0,0 +1,295 @@
+"""Caching helpers shared by the extension."""
+from collections import OrderedDict
+import threading
+import hashlib
+import time
+
+#: verified tokens kept by :class:`TokenCache`
+DEFAULT_TOKEN_CACHE_SIZE = 1024
+#: users kept by :class:`UserInfoCache`
+DEFAULT_USERINFO_CACHE_SIZE = 1024
+#: seconds a userInfo response is used before it is fetched again
+DEFAULT_USERINFO_TTL = 300
+
+
+class _Call(object):
+    __slots__ = ('event', 'result', 'error', 'expires')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.expires = None
+
+
+class SingleFlight(object):
+    """Coalesce concurrent calls for the same key into one
+
+    The first caller for a key runs the function, the callers arriving while
+    it runs wait for it and get the same result. A successful result (not
+    ``None``) is kept ``ttl`` seconds, so callers arriving right after reuse
+    it too.
+    """
+
+    def __init__(self, ttl=0):
+        self.ttl = ttl
+        self._calls = OrderedDict()
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """Return ``fn(*args, **kwargs)``, sharing the call with others
+
+        :param key: hashable key identifying the call
+        :raises: whatever ``fn`` raises, in all the waiting callers
+        """
+        with self._lock:
+            self._prune()
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+        else:
+            try:
+                call.result = fn(*args, **kwargs)
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    if call.error is None and call.result is not None and \
+                            self.ttl > 0:
+                        call.expires = time.monotonic() + self.ttl
+                        self._calls.move_to_end(key)
+                    else:
+                        del self._calls[key]
+                call.event.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def put(self, key, result):
+        """Keep ``result`` for ``key`` as if it was returned by a call"""
+        if result is None or self.ttl <= 0:
+            return
+        call = _Call()
+        call.result = result
+        call.expires = time.monotonic() + self.ttl
+        call.event.set()
+        with self._lock:
+            if key in self._calls and not self._calls[key].event.is_set():
+                # don't hide a running call from its waiters
+                return
+            self._calls[key] = call
+            self._calls.move_to_end(key)
+
+    def peek(self, key):
+        """Return the kept result for ``key``, ``None`` if there is none"""
+        call = self._calls.get(key)
+        if call is not None and call.expires is not None and \
+                call.expires > time.monotonic():
+            return call.result
+        return None
+
+    def doInBackground(self, key, fn, *args, **kwargs):
+        """Like :meth:`do` but in a daemon thread, errors are ignored
+
+        Nothing is done if a call for ``key`` is running or its result is
+        kept, :meth:`peek` returns the result once it is done.
+
+        :returns: ``True`` if the call was started
+        :rtype: bool
+        """
+        with self._lock:
+            self._prune()
+            if key in self._calls:
+                return False
+
+        def run():
+            try:
+                self.do(key, fn, *args, **kwargs)
+            except Exception:
+                pass
+
+        t = threading.Thread(target=run, name='cognito-single-flight')
+        t.daemon = True
+        t.start()
+        return True
+
+    def _prune(self):
+        # finished calls are moved to the end when they get an expiration
+        # time, so the expired ones are the first finished ones
+        now = time.monotonic()
+        expired = []
+        for key, call in self._calls.items():
+            if call.expires is None:
+                continue
+            if call.expires > now:
+                break
+            expired.append(key)
+        for key in expired:
+            del self._calls[key]
+
+
+class TokenCache(object):
+    """Bounded LRU cache of verified token claims
+
+    Entries are keyed by a hash of the token, so the tokens themselves are
+    not kept, and expire at the token ``exp`` claim. At most ``size``
+    entries are kept, that is the memory ceiling of the cache.
+
+    Hits and misses are also reported to ``metrics``, a
+    :class:`~flask_cognitologin.metrics.Metrics`, if given.
+    """
+
+    def __init__(self, size=DEFAULT_TOKEN_CACHE_SIZE, metrics=None):
+        self.size = size
+        self.metrics = metrics
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts):
+        """Build a cache key from the token (and related values)"""
+        h = hashlib.sha256()
+        for part in parts:
+            h.update((part or '').encode())
+            h.update(b'\0')
+        return h.digest()
+
+    def get(self, key):
+        """Return the cached claims for ``key`` or ``None``"""
+        claims = self._lookup(key)
+        with self._lock:
+            if claims is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if self.metrics is not None:
+            self.metrics.count(
+                'token_cache', result='miss' if claims is None else 'hit')
+        return claims
+
+    def _lookup(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] > time.time():
+                self._data.move_to_end(key)
+                return item[1]
+            del self._data[key]
+            return None
+
+    def set(self, key, claims):
+        """Cache the verified ``claims`` until they expire"""
+        if self.size <= 0 or 'exp' not in claims:
+            return
+        with self._lock:
+            self._data[key] = (claims['exp'], claims)
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Return the cache counters
+
+        :rtype: dict
+        """
+        return {
+            'hits': self.hits, 'misses': self.misses,
+            'size': len(self._data), 'max_size': self.size}
+
+
+class _UserInfo(object):
+    __slots__ = ('info', 'etag', 'expires')
+
+    def __init__(self, info, etag, expires):
+        self.info = info
+        self.etag = etag
+        self.expires = expires
+
+
+class UserInfoCache(object):
+    """Bounded LRU cache of userInfo responses
+
+    A response is used ``ttl`` seconds, but never after the access token it
+    was fetched with expires. Then it is fetched again, with the ``ETag`` of
+    the cached response if it had one. Concurrent lookups of the same key
+    share one fetch.
+
+    Lookups are reported to ``metrics``, a
+    :class:`~flask_cognitologin.metrics.Metrics`, if given.
+    """
+
+    def __init__(self, size=DEFAULT_USERINFO_CACHE_SIZE,
+                 ttl=DEFAULT_USERINFO_TTL, metrics=None):
+        self.size = size
+        self.ttl = ttl
+        self.metrics = metrics
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._fetches = SingleFlight()
+
+    def get(self, key, fetch, expires):
+        """Return the cached user info for ``key`` or fetch it
+
+        :param key: hashable key of the user
+        :param fetch: called as ``fetch(etag)``, returns the user info and
+            its ``ETag``, ``(None, etag)`` if it did not change, or
+            ``None`` if the lookup failed
+        :param expires: time stamp when the access token expires
+        :returns: the user info or ``None``
+        :rtype: dict
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+        if entry is not None and entry.expires > time.time():
+            self._count('hit')
+            return entry.info
+        return self._fetches.do(
+            key, self._fetch, key, fetch, entry, expires)
+
+    def _fetch(self, key, fetch, entry, expires):
+        ret = fetch(entry.etag if entry is not None else None)
+        if ret is None:
+            self._count('error')
+            return None
+        info, etag = ret
+        if info is None:
+            self._count('revalidated')
+            info = entry.info
+        else:
+            self._count('miss')
+        if self.size > 0:
+            with self._lock:
+                self._data[key] = _UserInfo(
+                    info, etag, min(time.time() + self.ttl, expires))
+                self._data.move_to_end(key)
+                while len(self._data) > self.size:
+                    self._data.popitem(last=False)
+        return info
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _count(self, result):
+        if self.metrics is not None:
+            self.metrics.count('userinfo_cache', result=result)
@@ -1,16 +1,145 @@
 """Main module."""
-from flask import session, request, current_app, _app_ctx_stack
-from requests.auth import HTTPBasicAuth
-from jose import jwt
-from datetime import datetime
-import requests
+from flask import session, request, current_app, g, abort, Response
+from flask import jsonify
+from flask import has_request_context
+from .jwks import jwks_cache, DEFAULT_TTL, DEFAULT_REFETCH_INTERVAL
+from .jwks import KeysUnavailableError
+from .cache import SingleFlight, TokenCache, DEFAULT_TOKEN_CACHE_SIZE
+from .cache import UserInfoCache, DEFAULT_USERINFO_CACHE_SIZE
+from .cache import DEFAULT_USERINFO_TTL
+from .store import storeFromConfig
+from .revocation import revocationsFromConfig
+from .tokens import TokenSet, identityChanges
+from .metrics import Metrics
+from .tenants import Tenant, TenantRegistry, REQUIRED_KEYS
+from .pkce import StateSigner, newVerifier, codeChallenge
+from .pkce import DEFAULT_STATE_MAX_AGE
+from .credentials import ClientCredentials, DEFAULT_RENEW_WINDOW
+from .breaker import CircuitBreaker, CLOSED
+from .breaker import DEFAULT_THRESHOLD, DEFAULT_RESET_TIMEOUT
+from .policy import Policy
+import functools
+import hmac
+import time
 import os
 
+#: tokens read from the input of :meth:`CognitoLogin.verifyMany` at a time
+DEFAULT_BATCH_SIZE = 1000
+#: tokens signed with the same key sent to a pool worker at a time
+POOL_SLICE = 64
+
+# refresh result when cognito could not be reached
+_UNAVAILABLE = object()
+
+
+class _CognitoState(object):
+    """Per app data of the extension, built once in ``init_app``
+
+    The HTTP clients are built when they are first used, so creating the
+    app does not import them.
+    """
+
+    def __init__(self, config, metrics):
+        self.config = config
+        self.metrics = metrics
+        self._http = None
+        default = None
+        if config.get('COGNITO_CLIENT_ID') is not None:
+            default = Tenant('default', config)
+        self.tenants = TenantRegistry(default)
+        for name, tenant in config['COGNITO_TENANTS'].items():
+            if not isinstance(tenant, Tenant):
+                tenant = Tenant(name, tenant)
+            self.tenants.add(tenant)
+        self.tenant_by = config['COGNITO_TENANT_BY']
+        self.pkce = config['COGNITO_PKCE']
+        self.signer = None
+        if config['COGNITO_STATELESS_STATE']:
+            if self.pkce:
+                # the verifier would be rebuilt for anyone with the state
+                raise ValueError(
+                    "COGNITO_PKCE needs the session state, it can not be "
+                    "used with COGNITO_STATELESS_STATE")
+            self.signer = StateSigner(
+                config.get('SECRET_KEY'), config['COGNITO_STATE_MAX_AGE'])
+        self.refreshes = SingleFlight(ttl=config['COGNITO_REFRESH_CACHE_TTL'])
+        self.refresh_threshold = (
+            config['COGNITO_REFRESH_WINDOW'] + config['COGNITO_CLOCK_SKEW'])
+        self.refresh_async = config['COGNITO_REFRESH_ASYNC']
+        self.refresh_grace = config['COGNITO_REFRESH_GRACE']
+        self.refresh_failing = False
+        self.breaker = CircuitBreaker(
+            config['COGNITO_CIRCUIT_THRESHOLD'],
+            config['COGNITO_CIRCUIT_RESET_TIMEOUT'], metrics=metrics)
+        self.identity_store = storeFromConfig(config)
+        self.policy = Policy.fromConfig(config)
+        self.identity_claims = config['COGNITO_IDENTITY_CLAIMS']
+        if self.identity_claims is not None and self.tenant_by == 'issuer':
+            # the refresh of an identity finds its tenant with them
+            self.identity_claims = tuple(self.identity_claims) + (
+                'iss', 'aud')
+        self.shared_db = None
+        if config.get('COGNITO_SHARED_CACHE_PATH'):
+            from .shared import SharedDB, SharedTokenCache
+            self.shared_db = SharedDB(config['COGNITO_SHARED_CACHE_PATH'])
+            self.token_cache = SharedTokenCache(
+                self.shared_db, config['COGNITO_TOKEN_CACHE_SIZE'],
+                metrics=metrics)
+        else:
+            self.token_cache = TokenCache(
+                config['COGNITO_TOKEN_CACHE_SIZE'], metrics=metrics)
+        self.userinfo = UserInfoCache(
+            config['COGNITO_USERINFO_CACHE_SIZE'],
+            config['COGNITO_USERINFO_TTL'], metrics=metrics)
+        self.revocations = None
+        if config.get('COGNITO_REVOCATION_FEED') is not None:
+            self.revocations = revocationsFromConfig(
+                config, metrics=metrics, http_factory=lambda: self.http)
+        self._aio = None
+        self._async_refreshes = None
+        self._verifier = None
+
+    @property
+    def verifier(self):
+        if self._verifier is None:
+            from .verifiers import verifierFromConfig
+            self._verifier = verifierFromConfig(self.config)
+        return self._verifier
+
+    @property
+    def http(self):
+        if self._http is None:
+            from .transport import CognitoClient
+            self._http = CognitoClient.fromConfig(self.config)
+            self._http.metrics = self.metrics
+            self._http.breaker = self.breaker
+        return self._http
+
+    @property
+    def aio(self):
+        if self._aio is None:
+            from .aio import AsyncCognitoClient
+            self._aio = AsyncCognitoClient.fromConfig(self.config)
+            self._aio.metrics = self.metrics
+            self._aio.breaker = self.breaker
+        return self._aio
+
+    @property
+    def async_refreshes(self):
+        if self._async_refreshes is None:
+            from .aio import AsyncSingleFlight
+            self._async_refreshes = AsyncSingleFlight()
+        return self._async_refreshes
+
 
 class CognitoLogin(object):
 
     def __init__(self, app=None):
         self.app = app
+        self.jwks_cache = jwks_cache
+        #: instrumentation hooks, see :class:`~flask_cognitologin.metrics.
+        #: Metrics`
+        self.metrics = Metrics()
 
         if app is not None:
             self.init_app(app)
@@ -29,58 +158,278 @@ class CognitoLogin(object):
         *  ``COGNITO_POOL_ID``:  Cognito user pool ID
         *  ``COGNITO_DOMAIN``: this is the full hostname of the cognito domain
            for example, ``mycogdomain.auth.eu-west-1.amazoncognito.com``,
-           refer to `aws documentation`_
+           refer to `aws documentation`_, ``https`` is used unless a scheme
+           is given
         *  ``COGNITO_CLIENT_ID``: Your cognito client ID
         *  ``COGNITO_CALLBACK_URL``: URL for the `autorization code grant`_,
            cognito will call to this URL with the user tokens
         *  ``COGNITO_CLIENT_SECRET``: Your cognito client secret
 
+        Optional keys:
+
+        *  ``COGNITO_ISSUER``: the user pool issuer URL, by default
+           ``https://cognito-idp.<AWS_REGION>.amazonaws.com/<COGNITO_POOL_ID>``
+           the user pool keys are fetched from it
+        *  ``COGNITO_SCOPE``: scopes requested by :meth:`getSignInUrl`, a
+           string or a list, by default all the scopes of the app client
+        *  ``COGNITO_IDENTITY_PROVIDER``: send the users straight to this
+           identity provider instead of the cognito hosted UI, default
+           ``None``
+        *  ``COGNITO_PKCE``: if ``True`` the sign in uses PKCE, the verifier
+           is kept in the session, default ``False``
+        *  ``COGNITO_STATELESS_STATE``: if ``True`` the sign in state is
+           signed with ``SECRET_KEY`` instead of kept in the session, so
+           :meth:`getSignInUrl` does not change the session. The signed
+           state is not bound to the browser and can be replayed until it
+           expires, it does **not** protect against login CSRF. Can not be
+           used with ``COGNITO_PKCE``, default ``False``
+        *  ``COGNITO_STATE_MAX_AGE``: seconds a signed state is accepted,
+           default ``600``
+
+        *  ``COGNITO_JWKS_TTL``: seconds before the cached user pool keys are
+           refreshed in the background, default ``3600``
+        *  ``COGNITO_JWKS_REFETCH_INTERVAL``: minimum seconds between two
+           fetchs of the keys caused by an unknown key id, default ``30``
+        *  ``COGNITO_JWKS_PRELOAD``: if ``True`` fetch the user pool keys
+           here, so the first request does not have to, default ``False``
+        *  ``COGNITO_HTTP_POOL_SIZE``: connections kept alive with cognito,
+           default ``10``
+        *  ``COGNITO_HTTP_CONNECT_TIMEOUT``: seconds, default ``3.05``
+        *  ``COGNITO_HTTP_READ_TIMEOUT``: seconds, default ``10``
+        *  ``COGNITO_HTTP_RETRIES``: times a failed request is retried,
+           default ``2``
+        *  ``COGNITO_HTTP_BACKOFF``: backoff factor between retries, default
+           ``0.3``
+        *  ``COGNITO_REFRESH_CACHE_TTL``: seconds a refreshed identity is
+           reused for other requests with the same refresh token, default
+           ``10``
+        *  ``COGNITO_REFRESH_WINDOW``: ``checkIdentity`` refresh the identity
+           when less than this seconds remain before it expires, default
+           ``60``
+        *  ``COGNITO_CLOCK_SKEW``: seconds of tolerance between our clock and
+           cognito clock, widens the refresh window and is used as leeway
+           when verifying ``exp``, default ``5``
+        *  ``COGNITO_VERIFIER``: library verifying the tokens, ``'jose'``,
+           ``'cryptography'`` (a fast path for RS256), ``'pyjwt'`` or an
+           object like the ones in :mod:`flask_cognitologin.verifiers`,
+           default ``'jose'``
+        *  ``COGNITO_REFRESH_ASYNC``: if ``True`` an identity inside the
+           refresh window that is not expired yet is refreshed in the
+           background, ``checkIdentity`` returns the refreshed identity in a
+           later call, default ``False``
+        *  ``COGNITO_REFRESH_GRACE``: seconds an expired identity is still
+           accepted by ``checkIdentity`` while cognito can not be reached
+           to refresh it, default ``0``
+        *  ``COGNITO_CIRCUIT_THRESHOLD``: consecutive failed requests to a
+           cognito host before the following ones fail without being sent,
+           ``0`` to disable it, see
+           :class:`~flask_cognitologin.breaker.CircuitBreaker`, default
+           ``5``
+        *  ``COGNITO_CIRCUIT_RESET_TIMEOUT``: seconds before a request is
+           sent again to a failing host, default ``30``
+        *  ``COGNITO_HEALTH_PATH``: if set, serve :meth:`health` as JSON at
+           this URL, default ``None``
+        *  ``COGNITO_PERMISSIONS``: permissions granted by each group and
+           scope, ``{'groups': {group: [permission, ...]}, 'scopes':
+           {scope: [permission, ...]}}``, see :meth:`hasPermission`,
+           default ``None``
+        *  ``COGNITO_IDENTITY_CLAIMS``: claims kept in the identities, besides
+           ``exp`` and ``refresh_token``, and ``iss`` and ``aud`` when
+           ``COGNITO_TENANT_BY`` is ``'issuer'``, for a compact identity, by
+           default all the ``id_token`` claims
+        *  ``COGNITO_SERVICE_TOKEN_RENEW_WINDOW``: seconds before a token of
+           :meth:`getServiceToken` expires when it is renewed in the
+           background, default ``300``
+        *  ``COGNITO_IDENTITY_STORE``: keep the identities on the server and
+           only a handle in the session, ``'memory'``, ``'sqlite'`` or a
+           :class:`~flask_cognitologin.store.IdentityStore` instance, see
+           :meth:`storeIdentity`, default ``None``
+        *  ``COGNITO_IDENTITY_STORE_TTL``: seconds an identity is kept in the
+           store, default 30 days
+        *  ``COGNITO_IDENTITY_STORE_SIZE``: identities kept by the
+           ``'memory'`` store, default ``10000``
+        *  ``COGNITO_IDENTITY_STORE_PATH``: database file of the ``'sqlite'``
+           store
+        *  ``COGNITO_TOKEN_CACHE_SIZE``: verified tokens kept so they are not
+           verified again until they expire, ``0`` to disable the cache,
+           default ``1024``
+        *  ``COGNITO_USERINFO_CACHE_SIZE``: users whose :meth:`getUserInfo`
+           response is kept, ``0`` to disable the cache, default ``1024``
+        *  ``COGNITO_USERINFO_TTL``: seconds a :meth:`getUserInfo` response
+           is used, never after its access token expires, default ``300``
+        *  ``COGNITO_SHARED_CACHE_PATH``: SQLite database file where the
+           user pool keys and the verified tokens are shared with the other
+           processes of the host, see :mod:`flask_cognitologin.shared`,
+           default ``None``
+        *  ``COGNITO_METRICS_PATH``: if set, serve the extension metrics in
+           the Prometheus text format at this URL, for example
+           ``'/metrics'``, default ``None``
+        *  ``COGNITO_REVOCATION_FEED``: revoked ``jti``, ``origin_jti`` and
+           ``sub`` values, a file path, an ``http(s)://`` URL or a callable,
+           tokens and identities with them are refused, see
+           :class:`~flask_cognitologin.revocation.RevocationList`. The feed
+           is first read by the first check, not by ``init_app``, default
+           ``None``
+        *  ``COGNITO_REVOCATION_INTERVAL``: seconds between two reads of the
+           revocation feed, default ``30``
+        *  ``COGNITO_REVOCATION_BLOOM_THRESHOLD``: bigger revocation lists
+           are kept in a Bloom filter, default ``100000``
+        *  ``COGNITO_REVOCATION_ERROR_RATE``: false positive rate of the
+           Bloom filter, default ``0.001``
+        *  ``COGNITO_TENANTS``: more user pools and app clients served by
+           this app, a ``dict`` of tenant name to a
+           :class:`~flask_cognitologin.tenants.Tenant` or to its config, see
+           :ref:`multi-tenant`. With tenants the keys above are only needed
+           for the default tenant, default ``{}``
+        *  ``COGNITO_TENANT_BY``: how the tenant of a request is found,
+           ``'host'``, ``'path'``, ``'issuer'`` (the ``iss`` claim of the
+           bearer token) or a callable taking the request and returning the
+           tenant name, default ``'host'``
+
         :raises ValueError: if the config keys are missing
 
         .. _aws documentation: https://shorturl.at/tuwBF
         .. _autorization code grant: https://shorturl.at/pFIKR
         """
         config = app.config
-        mykeys = [
-            'AWS_REGION', 'COGNITO_POOL_ID', 'COGNITO_DOMAIN',
-            'COGNITO_CLIENT_ID', 'COGNITO_CALLBACK_URL',
-            'COGNITO_CLIENT_SECRET']
-        tests = any([config.get(k) is None for k in mykeys])
-        if tests:
+        config.setdefault('COGNITO_TENANTS', {})
+        config.setdefault('COGNITO_TENANT_BY', 'host')
+        config.setdefault('COGNITO_PKCE', False)
+        config.setdefault('COGNITO_STATELESS_STATE', False)
+        config.setdefault('COGNITO_STATE_MAX_AGE', DEFAULT_STATE_MAX_AGE)
+        tests = any([config.get(k) is None for k in REQUIRED_KEYS])
+        if tests and not config['COGNITO_TENANTS']:
             raise ValueError("Missing config keys for flask_cognito")
+        config.setdefault('COGNITO_JWKS_TTL', DEFAULT_TTL)
+        config.setdefault(
+            'COGNITO_JWKS_REFETCH_INTERVAL', DEFAULT_REFETCH_INTERVAL)
+        config.setdefault('COGNITO_JWKS_PRELOAD', False)
+        config.setdefault('COGNITO_REFRESH_CACHE_TTL', 10)
+        config.setdefault('COGNITO_REFRESH_WINDOW', 60)
+        config.setdefault('COGNITO_CLOCK_SKEW', 5)
+        config.setdefault('COGNITO_VERIFIER', 'jose')
+        config.setdefault('COGNITO_REFRESH_ASYNC', False)
+        config.setdefault('COGNITO_REFRESH_GRACE', 0)
+        config.setdefault('COGNITO_CIRCUIT_THRESHOLD', DEFAULT_THRESHOLD)
+        config.setdefault(
+            'COGNITO_CIRCUIT_RESET_TIMEOUT', DEFAULT_RESET_TIMEOUT)
+        config.setdefault('COGNITO_IDENTITY_CLAIMS', None)
+        config.setdefault(
+            'COGNITO_SERVICE_TOKEN_RENEW_WINDOW', DEFAULT_RENEW_WINDOW)
+        config.setdefault('COGNITO_TOKEN_CACHE_SIZE', DEFAULT_TOKEN_CACHE_SIZE)
+        config.setdefault(
+            'COGNITO_USERINFO_CACHE_SIZE', DEFAULT_USERINFO_CACHE_SIZE)
+        config.setdefault('COGNITO_USERINFO_TTL', DEFAULT_USERINFO_TTL)
+        state = _CognitoState(config, self.metrics)
+        app.extensions['cognitologin'] = state
+        state.service_tokens = ClientCredentials(
+            functools.partial(self._clientCredentials, app),
+            renew_window=config['COGNITO_SERVICE_TOKEN_RENEW_WINDOW'],
+            margin=config['COGNITO_CLOCK_SKEW'])
+        if config['COGNITO_VERIFIER'] != 'jose':
+            # fail here on an unknown verifier, the default is built on use
+            state.verifier
+        if state.shared_db is not None:
+            from .shared import SharedJWKSCache
+            self.jwks_cache = SharedJWKSCache(
+                state.shared_db, ttl=config['COGNITO_JWKS_TTL'])
+        if config.get('COGNITO_METRICS_PATH'):
+            exporter = self.metrics.prometheus()
+            app.add_url_rule(
+                config['COGNITO_METRICS_PATH'], 'cognitologin_metrics',
+                lambda: Response(
+                    exporter.render(),
+                    mimetype='text/plain; version=0.0.4'))
+        if config.get('COGNITO_HEALTH_PATH'):
+            app.add_url_rule(
+                config['COGNITO_HEALTH_PATH'], 'cognitologin_health',
+                lambda: jsonify(self.health()))
+        if config['COGNITO_JWKS_PRELOAD']:
+            for tenant in state.tenants:
+                self.jwks_cache.preload(
+                    tenant.issuer, http=state.http, verifier=state.verifier)
         app.teardown_appcontext(self.teardown)
 
+    @property
+    def _state(self):
+        return current_app.extensions['cognitologin']
+
+    @property
+    def tenant(self):
+        """The tenant of the current request
+
+        Outside of a request, or when ``COGNITO_TENANT_BY`` is
+        ``'issuer'``, this is the default tenant.
+
+        :rtype: flask_cognitologin.tenants.Tenant
+        :raises werkzeug.exceptions.NotFound: if there is no tenant
+        """
+        state = self._state
+        tenant = state.tenants.default
+        if state.tenant_by != 'issuer' and has_request_context():
+            tenant = state.tenants.resolve(request, state.tenant_by)
+        if tenant is None:
+            abort(404)
+        return tenant
+
+    @property
+    def tenants(self):
+        """The tenants of the current app
+
+        :rtype: flask_cognitologin.tenants.TenantRegistry
+        """
+        return self._state.tenants
+
+    @property
+    def http(self):
+        """The pooled HTTP client of the current app
+
+        :rtype: flask_cognitologin.transport.CognitoClient
+        """
+        return self._state.http
+
+    @property
+    def aio(self):
+        """The pooled asyncio HTTP client of the current app, needs httpx
+
+        :rtype: flask_cognitologin.aio.AsyncCognitoClient
+        """
+        return self._state.aio
+
     def _getCsrfState(self):
         session['mycogext_csrf_state'] = os.urandom(16).hex()
 
         return session['mycogext_csrf_state']
 
-    def getSignInUrl(self):
-        """Return the cognito url for login"""
-        csrf_state = self._getCsrfState()
-        config = current_app.config
-        return (
-            "https://{domain}/login?response_type=code&"
-            "client_id={clientid}&state={csrf_state}&"
-            "redirect_uri={callbackurl}".format(
-                domain=config.get('COGNITO_DOMAIN'),
-                clientid=config.get('COGNITO_CLIENT_ID'),
-                csrf_state=csrf_state,
-                callbackurl=config.get('COGNITO_CALLBACK_URL')
-            )
-        )
+    def getSignInUrl(self, **params):
+        """Return the cognito url for login
+
+        The URL is built once in ``init_app``, only the CSRF state is added
+        here. Extra query parameters, for example ``scope`` or
+        ``identity_provider``, send the user to the ``/oauth2/authorize``
+        endpoint::
+
+            cognito_login.getSignInUrl(identity_provider='Google')
+
+        See also ``COGNITO_SCOPE``, ``COGNITO_IDENTITY_PROVIDER``,
+        ``COGNITO_PKCE`` and ``COGNITO_STATELESS_STATE``.
+        """
+        state = self._state
+        tenant = self.tenant
+        if state.signer is not None:
+            csrf_state = state.signer.sign(tenant.name.encode())
+        else:
+            csrf_state = self._getCsrfState()
+            if state.pkce:
+                verifier = session['mycogext_code_verifier'] = newVerifier()
+        if state.pkce:
+            params['code_challenge'] = codeChallenge(verifier)
+            params['code_challenge_method'] = 'S256'
+        return tenant.signInUrl(csrf_state, params)
 
     def getLogOutUrl(self):
         """Return the cognito logout url"""
-        config = current_app.config
-        return (
-            "https://{domain}/logout?response_type=code&client_id="
-            "{clientid}&redirect_uri={callbackurl}".format(
-                domain=config.get('COGNITO_DOMAIN'),
-                clientid=config.get('COGNITO_CLIENT_ID'),
-                callbackurl=config.get('COGNITO_CALLBACK_URL')
-            )
-        )
+        return self.tenant.logout_url
 
     def getIdentity(self):
         """Process cognito autorization code grant
@@ -88,34 +437,18 @@ class CognitoLogin(object):
         :return: the user identity or None
         :rtype: dict
         """
-        csrf_state = request.args.get('state')
-        code = request.args.get('code')
-        config = current_app.config
-        payload = {
-            'grant_type': 'authorization_code',
-            'client_id': config.get('COGNITO_CLIENT_ID'),
-            'code': code,
-            "redirect_uri": config.get('COGNITO_CALLBACK_URL')
-        }
-        r = requests.post(
-            "https://%s/oauth2/token" % config.get('COGNITO_DOMAIN'),
-            data=payload,
-            auth=HTTPBasicAuth(
-                config.get('COGNITO_CLIENT_ID'),
-                config.get('COGNITO_CLIENT_SECRET')
-            )
-        )
-        if r.ok and (csrf_state == session['mycogext_csrf_state']):
-            self._verify(r.json()['access_token'])
-            id_token = self._verify(
-                r.json()['id_token'],
-                access_token=r.json()['access_token'])
-            ret = dict()
-            ret.update(id_token)
-            ret['refresh_token'] = r.json()['refresh_token']
-            return ret
+        tenant = self.tenant
+        payload = self._codePayload(tenant)
+        if payload is None:
+            return None
+        tokens = self._exchange(tenant, payload)
+        if tokens is None:
+            return None
+        id_claims = self._verifyTokenSet(tokens, tenant)
+        if id_claims is None:
+            return None
 
-        return None
+        return tokens.identity(id_claims, claims=self._state.identity_claims)
 
     def getTokens(self, refresh_token):
         """Returns the ``id_token`` and ``access_token``
@@ -124,79 +457,995 @@ class CognitoLogin(object):
         :returns: a ``dict`` with the keys ``id_token`` and ``access_token``
         :rtype: dict
         """
-        config = current_app.config
+        tenant = self.tenant
+        tokens = self._exchange(
+            tenant, self._refreshPayload(tenant, refresh_token))
+
+        if tokens is not None:
+            return {
+                'access_token': tokens.access_token,
+                'id_token': tokens.id_token
+            }
+        else:
+            return None
+
+    async def getIdentityAsync(self):
+        """Same as :meth:`getIdentity` without blocking the event loop"""
+        tenant = self.tenant
+        payload = self._codePayload(tenant)
+        if payload is None:
+            return None
+        tokens = await self._exchangeAsync(tenant, payload)
+        if tokens is None:
+            return None
+        id_claims = await self._verifyTokenSetAsync(tokens, tenant)
+        if id_claims is None:
+            return None
+
+        return tokens.identity(id_claims, claims=self._state.identity_claims)
+
+    async def getTokensAsync(self, refresh_token):
+        """Same as :meth:`getTokens` without blocking the event loop"""
+        tenant = self.tenant
+        tokens = await self._exchangeAsync(
+            tenant, self._refreshPayload(tenant, refresh_token))
+
+        if tokens is not None:
+            return {
+                'access_token': tokens.access_token,
+                'id_token': tokens.id_token
+            }
+        else:
+            return None
+
+    def _codePayload(self, tenant):
+        """Check the callback state and build the code grant
+
+        :returns: the token request payload or ``None`` if the state is
+            not valid
+        :rtype: dict
+        """
+        state = self._state
+        csrf_state = request.args.get('state')
+        verifier = None
+        if state.signer is not None:
+            if state.signer.verify(csrf_state, tenant.name.encode()) is None:
+                self.metrics.count('csrf_mismatch')
+                return None
+        else:
+            # the state is good for one callback only
+            expected = session.pop('mycogext_csrf_state', None)
+            if state.pkce:
+                verifier = session.pop('mycogext_code_verifier', None)
+            if not csrf_state or not expected or not hmac.compare_digest(
+                    csrf_state.encode(), expected.encode()):
+                self.metrics.count('csrf_mismatch')
+                return None
 
         payload = {
+            'grant_type': 'authorization_code',
+            'client_id': tenant.client_id,
+            'code': request.args.get('code'),
+            "redirect_uri": tenant.callback_url
+        }
+        if verifier is not None:
+            payload['code_verifier'] = verifier
+        return payload
+
+    def _refreshPayload(self, tenant, refresh_token):
+        return {
             'grant_type': 'refresh_token',
-            'client_id': config.get('COGNITO_CLIENT_ID'),
+            'client_id': tenant.client_id,
             'refresh_token': refresh_token
         }
-        r = requests.post(
-            "https://%s/oauth2/token" % config.get('COGNITO_DOMAIN'),
-            data=payload,
-            auth=HTTPBasicAuth(
-                config.get('COGNITO_CLIENT_ID'),
-                config.get('COGNITO_CLIENT_SECRET'))
-        )
-
-        if r.ok:
-            return {
-                'access_token': r.json()['access_token'],
-                'id_token': r.json()['id_token']
+
+    def getServiceToken(self, scopes=(), tenant=None):
+        """Return an access token of the ``client_credentials`` grant, to
+        call other services
+
+        The token is cached for each tenant and scope set until it is about
+        to expire, and renewed in the background before that, see
+        ``COGNITO_SERVICE_TOKEN_RENEW_WINDOW``::
+
+            token = cognito_login.getServiceToken(['orders/read'])
+            requests.get(url, headers={'Authorization': 'Bearer ' + token})
+
+        :param scopes: the custom scopes requested, by default all the
+            scopes allowed to the app client
+        :param tenant: by default the tenant of the current request
+        :type tenant: flask_cognitologin.tenants.Tenant
+        :returns: the access token or ``None`` if cognito refused the grant
+        :rtype: str
+        """
+        return self._state.service_tokens.get(tenant or self.tenant, scopes)
+
+    def _clientCredentials(self, app, tenant, scopes):
+        with app.app_context():
+            payload = {
+                'grant_type': 'client_credentials',
+                'client_id': tenant.client_id,
             }
-        else:
+            if scopes:
+                payload['scope'] = ' '.join(scopes)
+            r = self._tokenRequest(tenant, payload)
+            if r is None or not r.ok:
+                self.metrics.count('service_token', outcome='failed')
+                return None
+            data = r.json()
+            self.metrics.count('service_token', outcome='ok')
+            return data['access_token'], data.get('expires_in', 3600)
+
+    def _exchange(self, tenant, payload):
+        """Run a token endpoint grant
+
+        :returns: the parsed tokens or ``None`` if the grant failed
+        :rtype: flask_cognitologin.tokens.TokenSet
+        """
+        r = self._tokenRequest(tenant, payload)
+        if r is None or not r.ok:
+            return None
+        return TokenSet.fromJson(r.json())
+
+    async def _exchangeAsync(self, tenant, payload):
+        r = await self._tokenRequestAsync(tenant, payload)
+        if r is None or not r.is_success:
+            return None
+        return TokenSet.fromJson(r.json())
+
+    def _tokenRequest(self, tenant, payload):
+        """POST ``payload`` to the token endpoint of ``tenant``
+
+        :returns: the response or ``None`` if cognito could not be reached
+        :rtype: requests.Response
+        """
+        import requests
+
+        try:
+            return self._state.http.post(
+                tenant.token_url, data=payload, auth=tenant.auth)
+        except requests.RequestException as e:
+            current_app.logger.warning("Cognito token request failed: %s", e)
+            return None
+
+    async def _tokenRequestAsync(self, tenant, payload):
+        import httpx
+
+        try:
+            return await self._state.aio.post(
+                tenant.token_url, data=payload,
+                auth=tenant.auth)
+        except httpx.HTTPError as e:
+            current_app.logger.warning("Cognito token request failed: %s", e)
             return None
 
+    @property
+    def identityStore(self):
+        """The identity store of the current app
+
+        :rtype: flask_cognitologin.store.IdentityStore
+        :raises RuntimeError: if ``COGNITO_IDENTITY_STORE`` is not set
+        """
+        store = self._state.identity_store
+        if store is None:
+            raise RuntimeError("No COGNITO_IDENTITY_STORE configured")
+        return store
+
+    def storeIdentity(self, identity):
+        """Save ``identity`` in the identity store
+
+        Put the returned handle in the session instead of the identity,
+        :meth:`checkIdentity` accepts the handle too::
+
+            session['identity'] = cognito_login.storeIdentity(identity)
+
+        :param dict identity: the identity returned by :meth:`getIdentity`
+        :returns: an opaque handle for the identity
+        :rtype: str
+        """
+        return self.identityStore.add(identity)
+
+    def forgetIdentity(self, handle):
+        """Remove the identity for ``handle`` from the store, on logout"""
+        self.identityStore.delete(handle)
+
     def checkIdentity(self, identity):
         """Check identity claims
 
-        If the current identity is about to expire a new one will be emitted.
+        If the current identity is about to expire (see
+        ``COGNITO_REFRESH_WINDOW``) a new one will be emitted. Concurrent
+        refreshes of the same identity are done only once, and the new
+        identity is reused for ``COGNITO_REFRESH_CACHE_TTL`` seconds.
+
+        With ``COGNITO_REFRESH_ASYNC`` an identity that is not expired yet is
+        returned as is while the new one is requested in the background.
+
+        If ``identity`` does not has ``exp`` and ``refresh_token`` keys, or
+        it was revoked (see ``COGNITO_REVOCATION_FEED``), this returns
+        ``None``
+
+        ``identity`` can also be a handle returned by :meth:`storeIdentity`,
+        then the stored identity is checked and updated, the handle stays
+        the same so there is no need to change the session.
 
-        If ``identity`` does not has ``exp`` and ``refresh_token`` keys this
-        returns ``None``
+        An identity that does not need a refresh is returned as is, use
+        :meth:`checkIdentityChanges` to know what a refresh changed.
 
-        :param dict identity: current user identity claims
+        :param identity: current user identity claims or its handle
+        :type identity: dict or str
         :returns: identity
         :rtype: dict
         """
+        if not isinstance(identity, str):
+            return self._checkIdentity(identity)
+
+        store = self.identityStore
+        handle = identity
+        identity = store.get(handle)
+        if identity is None:
+            return None
+        ret = self._checkIdentity(identity)
+        self._updateStore(store, handle, identity, ret)
+        return ret
+
+    async def checkIdentityAsync(self, identity):
+        """Same as :meth:`checkIdentity` without blocking the event loop
+
+        Concurrent refreshes are shared with the other tasks of the event
+        loop and the refreshed identity with :meth:`checkIdentity`.
+        """
+        if not isinstance(identity, str):
+            return await self._checkIdentityAsync(identity)
+
+        store = self.identityStore
+        handle = identity
+        identity = store.get(handle)
+        if identity is None:
+            return None
+        ret = await self._checkIdentityAsync(identity)
+        self._updateStore(store, handle, identity, ret)
+        return ret
+
+    def checkIdentityChanges(self, identity):
+        """Same as :meth:`checkIdentity` but tells what changed
+
+        Only the changes need to be saved, so the session is not written
+        again when nothing changed::
+
+            idt, changes = cognito_login.checkIdentityChanges(
+                session['identity'])
+            if changes:
+                session['identity'] = idt
+
+        The changes include the new ``refresh_token`` when cognito rotates
+        it. A handle returned by :meth:`storeIdentity` never changes.
+
+        :returns: the identity and a dict with its changed claims (see
+            :func:`~flask_cognitologin.tokens.identityChanges`), empty if
+            nothing changed, or ``(None, None)``
+        :rtype: tuple
+        """
+        if isinstance(identity, str):
+            return self.checkIdentity(identity), {}
+        return self._changes(identity, self._checkIdentity(identity))
+
+    async def checkIdentityChangesAsync(self, identity):
+        """Same as :meth:`checkIdentityChanges` without blocking the event
+        loop"""
+        if isinstance(identity, str):
+            return await self.checkIdentityAsync(identity), {}
+        return self._changes(
+            identity, await self._checkIdentityAsync(identity))
+
+    def _changes(self, identity, ret):
+        if ret is None:
+            return None, None
+        if ret is identity:
+            return ret, {}
+        return ret, identityChanges(identity, ret)
+
+    def _updateStore(self, store, handle, identity, ret):
+        if ret is None:
+            store.delete(handle)
+        elif ret is not identity and identityChanges(identity, ret):
+            store.set(handle, ret)
+
+    def _checkIdentity(self, identity):
         if 'exp' not in identity:
             return None
         if 'refresh_token' not in identity:
             return None
-        expires = datetime.utcfromtimestamp(identity['exp'])
-        expires_seconds = (expires - datetime.utcnow()).total_seconds()
-
-        if expires_seconds < 0:
-            refresh_token = identity['refresh_token']
-            r = self.getTokens(refresh_token)
-
-            if r:
-                self._verify(r['access_token'])
-                id_token = self._verify(
-                    r['id_token'],
-                    access_token=r['access_token'])
-                ret = dict()
-                ret.update(id_token)
-                ret['refresh_token'] = refresh_token
-                return ret
-            else:
-                return None
+        if self._isRevoked(identity):
+            return None
+        state = self._state
+        remaining = identity['exp'] - time.time()
+        if remaining > state.refresh_threshold:
+            return identity
 
+        refresh_token = identity['refresh_token']
+        tenant = self._identityTenant(identity)
+        if tenant is None:
+            return None
+        if state.refresh_async and remaining > 0:
+            ret = state.refreshes.peek(refresh_token)
+            if ret is None:
+                app = current_app._get_current_object()
+                state.refreshes.doInBackground(
+                    refresh_token, self._refreshInAppContext, app, tenant,
+                    refresh_token)
+                return identity
+        else:
+            ret = state.refreshes.do(
+                refresh_token, self._refreshIdentity, tenant, refresh_token)
+
+        if ret is None:
+            return None
+        if ret is _UNAVAILABLE:
+            return self._inGrace(identity, remaining)
+        # every caller gets its own copy
+        return dict(ret)
+
+    async def _checkIdentityAsync(self, identity):
+        if 'exp' not in identity:
+            return None
+        if 'refresh_token' not in identity:
+            return None
+        if self._isRevoked(identity):
+            return None
+        state = self._state
+        remaining = identity['exp'] - time.time()
+        if remaining > state.refresh_threshold:
+            return identity
+
+        refresh_token = identity['refresh_token']
+        tenant = self._identityTenant(identity)
+        if tenant is None:
+            return None
+        ret = state.refreshes.peek(refresh_token)
+        if ret is None:
+            if state.refresh_async and remaining > 0:
+                app = current_app._get_current_object()
+                state.refreshes.doInBackground(
+                    refresh_token, self._refreshInAppContext, app, tenant,
+                    refresh_token)
+                return identity
+            ret = await state.async_refreshes.do(
+                refresh_token, self._refreshIdentityAsync, tenant,
+                refresh_token)
+            state.refreshes.put(refresh_token, ret)
+
+        if ret is None:
+            return None
+        if ret is _UNAVAILABLE:
+            return self._inGrace(identity, remaining)
+        return dict(ret)
+
+    def _inGrace(self, identity, remaining):
+        """Keep ``identity`` while cognito can not refresh it, until the
+        ``COGNITO_REFRESH_GRACE`` after it expires"""
+        if remaining + self._state.refresh_grace <= 0:
+            return None
+        self.metrics.count('refresh', outcome='grace')
         return identity
 
-    def _verify(self, token, access_token=None):
+    async def _refreshIdentityAsync(self, tenant, refresh_token):
+        r = await self._tokenRequestAsync(
+            tenant, self._refreshPayload(tenant, refresh_token))
+        if self._unavailable(r):
+            return _UNAVAILABLE
+        if not r.is_success:
+            self.metrics.count('refresh', outcome='failed')
+            return None
+
+        tokens = TokenSet.fromJson(r.json())
+        id_claims = await self._verifyTokenSetAsync(tokens, tenant)
+        if id_claims is None:
+            return None
+        ret = tokens.identity(
+            id_claims, refresh_token, claims=self._state.identity_claims)
+        self._countRefresh(ret, refresh_token)
+        return ret
+
+    def _refreshInAppContext(self, app, tenant, refresh_token):
+        with app.app_context():
+            try:
+                return self._refreshIdentity(tenant, refresh_token)
+            except Exception:
+                app.logger.exception("Cognito background refresh failed")
+                return None
+
+    def _refreshIdentity(self, tenant, refresh_token):
+        r = self._tokenRequest(
+            tenant, self._refreshPayload(tenant, refresh_token))
+        if self._unavailable(r):
+            return _UNAVAILABLE
+        if not r.ok:
+            self.metrics.count('refresh', outcome='failed')
+            return None
+
+        tokens = TokenSet.fromJson(r.json())
+        id_claims = self._verifyTokenSet(tokens, tenant)
+        if id_claims is None:
+            return None
+        ret = tokens.identity(
+            id_claims, refresh_token, claims=self._state.identity_claims)
+        self._countRefresh(ret, refresh_token)
+        return ret
+
+    def _unavailable(self, r):
+        # cognito down or failing, not a refused refresh token
+        failing = r is None or r.status_code >= 500
+        self._state.refresh_failing = failing
+        if failing:
+            self.metrics.count('refresh', outcome='unavailable')
+        return failing
+
+    def _countRefresh(self, identity, refresh_token):
+        self.metrics.count('refresh', outcome='ok')
+        if identity['refresh_token'] != refresh_token:
+            self.metrics.count('refresh_token_rotated')
+
+    def verifyAccessToken(self, token, tenant=None):
+        """Verify a cognito access token
+
+        Besides the signature and expiration, checks that the token is an
+        access token issued by the user pool of the tenant for its client.
+
+        :param str token: the access token
+        :param tenant: by default the tenant of the current request, or
+            the tenant of the token issuer if ``COGNITO_TENANT_BY`` is
+            ``'issuer'``
+        :type tenant: flask_cognitologin.tenants.Tenant
+        :returns: the token claims
+        :rtype: dict
+        :raises jose.JWTError: if the token is not valid
+        """
+        from jose import jwt
+
+        if tenant is None:
+            tenant = self._tenantOf(token)
+        claims = self._verify(token, tenant=tenant)
+        if claims.get('token_use') != 'access':
+            raise jwt.JWTError("Not an access token")
+        if claims.get('client_id') != tenant.client_id:
+            raise jwt.JWTError("Invalid client_id")
+        if claims.get('iss') != tenant.issuer:
+            raise jwt.JWTError("Invalid issuer")
+        return claims
+
+    def verifyMany(self, tokens, tenant=None, pool=None, app=None,
+                   batch_size=DEFAULT_BATCH_SIZE):
+        """Verify a stream of tokens, also outside a request
+
+        The tokens are read ``batch_size`` at a time. In each batch repeated
+        and already cached tokens are verified once, and the key of the
+        tokens signed with the same ``kid`` is looked up once. The tokens
+        are checked like :meth:`_verify` does, use
+        :meth:`verifyAccessToken` to check the token use, client and issuer
+        too.
+
+        :param tokens: an iterable of tokens
+        :param tenant: the tenant or tenant name, by default the tenant
+            built from the app config
+        :param pool: a :class:`concurrent.futures.Executor` verifying the
+            signatures, threads or processes, by default they are verified
+            here
+        :param app: the app, by default the one given to the extension or
+            the current app
+        :returns: a generator of ``(token, claims, error)``, in the order of
+            ``tokens``, ``claims`` is ``None`` and ``error`` the
+            :class:`jose.JWTError` if the token is not valid
+        """
+        if app is None:
+            app = self.app or current_app._get_current_object()
+        state = app.extensions['cognitologin']
+        if tenant is None or isinstance(tenant, str):
+            tenant = state.tenants.get(tenant)
+        if tenant is None:
+            raise ValueError("No tenant to verify the tokens")
+
+        batch = []
+        for token in tokens:
+            batch.append(token)
+            if len(batch) >= batch_size:
+                yield from self._verifyBatch(app, state, tenant, batch, pool)
+                batch = []
+        if batch:
+            yield from self._verifyBatch(app, state, tenant, batch, pool)
+
+    def _verifyBatch(self, app, state, tenant, tokens, pool):
+        from jose.exceptions import JWTError
+        from .verifiers import decodeGroup
+
+        verifier = state.verifier
+        cache = state.token_cache
+        audience = tenant.client_id
+        leeway = app.config.get('COGNITO_CLOCK_SKEW', 0)
+        results = {}
+        groups = {}
+        for token in tokens:
+            if token in results:
+                continue
+            claims = cache.get(cache.key(token, None, audience))
+            if claims is not None:
+                results[token] = (claims, None)
+                continue
+            try:
+                kid = _keyId(verifier, token)
+            except JWTError as e:
+                results[token] = (None, e)
+                continue
+            results[token] = None
+            groups.setdefault(kid, []).append(token)
+
+        with app.app_context():
+            jobs = []
+            by_kid = None
+            for kid, group in groups.items():
+                try:
+                    key = self._getKey(kid, tenant)
+                except (JWTError, KeysUnavailableError) as e:
+                    for token in group:
+                        results[token] = (None, e)
+                    continue
+                if pool is None:
+                    jobs.append((group, decodeGroup(
+                        verifier, key, group, audience, leeway)))
+                    continue
+                if _isProcessPool(pool):
+                    # parsed keys do not pickle, the workers parse the JWK
+                    if by_kid is None:
+                        by_kid = {k['kid']: k for k in self.jwks_cache.get(
+                            tenant.issuer,
+                            ttl=app.config.get('COGNITO_JWKS_TTL'),
+                            http=state.http)}
+                    key = by_kid[kid]
+                for i in range(0, len(group), POOL_SLICE):
+                    part = group[i:i + POOL_SLICE]
+                    jobs.append((part, pool.submit(
+                        decodeGroup, verifier, key, part, audience, leeway)))
+
+            verified = 0
+            for group, decoded in jobs:
+                if pool is not None:
+                    decoded = decoded.result()
+                for token, (claims, error) in zip(group, decoded):
+                    if claims is not None:
+                        verified += 1
+                        cache.set(cache.key(token, None, audience), claims)
+                    results[token] = (claims, error)
+            if jobs:
+                self.metrics.count('batch_verify', verified, outcome='ok')
+                self.metrics.count(
+                    'batch_verify',
+                    sum(len(group) for group, _ in jobs) - verified,
+                    outcome='invalid')
+
+            for token, (claims, error) in results.items():
+                if claims is not None and self._isRevoked(claims):
+                    results[token] = (None, JWTError("Token revoked"))
+
+        for token in tokens:
+            claims, error = results[token]
+            if claims is not None:
+                claims = dict(claims)
+            yield token, claims, error
+
+    def getUserInfo(self, access_token, tenant=None):
+        """Return the user attributes from the cognito ``userInfo`` endpoint
+
+        The access token is verified first, see :meth:`verifyAccessToken`.
+        The response is cached for each user and scope set, see
+        ``COGNITO_USERINFO_TTL`` and ``COGNITO_USERINFO_CACHE_SIZE``, and
+        concurrent lookups of the same user share one request.
+
+        :param str access_token: the access token of the user
+        :param tenant: by default the tenant of the token, see
+            :meth:`verifyAccessToken`
+        :type tenant: flask_cognitologin.tenants.Tenant
+        :returns: the user attributes or ``None`` if cognito could not
+            return them
+        :rtype: dict
+        :raises jose.JWTError: if the token is not valid
+        """
+        import requests
+
+        if tenant is None:
+            tenant = self._tenantOf(access_token)
+        claims = self.verifyAccessToken(access_token, tenant)
+        state = self._state
+        logger = current_app.logger
+
+        def fetch(etag):
+            headers = {'Authorization': 'Bearer ' + access_token}
+            if etag:
+                headers['If-None-Match'] = etag
+            try:
+                r = state.http.get(tenant.userinfo_url, headers=headers)
+            except requests.RequestException as e:
+                logger.warning("Cognito userInfo request failed: %s", e)
+                return None
+            if r.status_code == 304:
+                return None, etag
+            if not r.ok:
+                return None
+            return r.json(), r.headers.get('ETag')
+
+        info = state.userinfo.get(
+            (tenant.client_id, claims['sub'], claims.get('scope')), fetch,
+            claims['exp'])
+        return None if info is None else dict(info)
+
+    def _tenantOf(self, token):
+        from jose import jwt
+
+        state = self._state
+        if state.tenant_by != 'issuer':
+            return self.tenant
+        tenant = self._tenantOfClaims(jwt.get_unverified_claims(token))
+        if tenant is None:
+            raise jwt.JWTError("Unknown issuer or client")
+        return tenant
+
+    def _tenantOfClaims(self, claims):
+        """Return the tenant of the ``iss`` and the ``client_id`` or
+        ``aud`` claims of a token or identity, or ``None``"""
+        issuer = claims.get('iss')
+        # client_id in access tokens, aud in id tokens
+        clients = claims.get('client_id') or claims.get('aud')
+        if not isinstance(clients, list):
+            clients = [clients]
+        for client_id in clients:
+            if isinstance(client_id, str):
+                tenant = self._state.tenants.byIssuer(issuer, client_id)
+                if tenant is not None:
+                    return tenant
+        return None
+
+    def _identityTenant(self, identity):
+        """Return the tenant that refreshes ``identity``
+
+        With ``COGNITO_TENANT_BY = 'issuer'`` it is the tenant of the
+        identity claims, never the default one, so a refresh token is only
+        sent to the app client that issued it.
+        """
+        if self._state.tenant_by != 'issuer':
+            return self.tenant
+        tenant = self._tenantOfClaims(identity)
+        if tenant is None:
+            current_app.logger.warning(
+                "No tenant for the identity of %s", identity.get('iss'))
+        return tenant
+
+    def permissionsOf(self, claims):
+        """Return the permissions of a token or identity
+
+        The permissions are granted by the ``cognito:groups`` and ``scope``
+        claims, see ``COGNITO_PERMISSIONS``.
+
+        :param dict claims: verified token claims or identity
+        :rtype: frozenset
+        """
+        return self._state.policy.permissions(claims)
+
+    def hasPermission(self, permission, claims=None):
+        """Check a permission of ``COGNITO_PERMISSIONS``::
+
+            if cognito_login.hasPermission('orders:write'):
+                ...
+
+        :param str permission: the permission
+        :param dict claims: verified token claims or identity, by default
+            the bearer token of the current request, see
+            :meth:`authorizeRequest`
+        :rtype: bool
+        """
+        if claims is None:
+            permissions = g.get('cognito_permissions')
+            if permissions is None:
+                return False
+            return permission in permissions
+        return permission in self.permissionsOf(claims)
+
+    def authorizeRequest(self, scopes=(), groups=(), permissions=()):
+        """Check the bearer token of the current request
+
+        The claims of the token are saved in ``flask.g.cognito_claims`` and
+        its permissions in ``flask.g.cognito_permissions``.
+
+        :param scopes: all this scopes must be granted to the token
+        :param groups: the user must belong to at least one of this groups
+        :param permissions: the token must have all this permissions, see
+            :meth:`hasPermission`
+        :returns: the token claims
+        :rtype: dict
+        :raises werkzeug.exceptions.HTTPException: 401 if there is no valid
+            token, 403 if the scopes, groups or permissions do not match,
+            503 if the user pool keys could not be fetched
+        """
+        from jose import jwt
+
+        auth = request.headers.get('Authorization', '')
+        scheme, _, token = auth.partition(' ')
+        if scheme.lower() != 'bearer' or not token:
+            _deny(401, 'Bearer realm="cognito"')
+        try:
+            claims = self.verifyAccessToken(token.strip())
+        except jwt.JWTError:
+            _deny(401, 'Bearer error="invalid_token"')
+        except KeysUnavailableError as e:
+            current_app.logger.warning(
+                "Cognito keys unavailable: %s", e.__cause__)
+            _deny(503)
+
+        if scopes and not set(scopes).issubset(
+                claims.get('scope', '').split()):
+            _deny(403, 'Bearer error="insufficient_scope", scope="%s"' % (
+                " ".join(scopes)))
+        if groups and set(groups).isdisjoint(
+                claims.get('cognito:groups', ())):
+            _deny(403)
+        granted = self.permissionsOf(claims)
+        if permissions and not granted.issuperset(permissions):
+            _deny(403)
+
+        g.cognito_claims = claims
+        g.cognito_permissions = granted
+        return claims
+
+    def requireToken(self, scopes=None, groups=None, permissions=None):
+        """Decorator for views that need a cognito access token::
+
+            @app.route('/api/orders')
+            @cognito_login.requireToken(scopes=['orders/read'])
+            def orders():
+                return jsonify(owner=g.cognito_claims['sub'])
+
+        See :meth:`authorizeRequest` for ``scopes``, ``groups`` and
+        ``permissions``.
+        """
+        scopes = frozenset(scopes or ())
+        groups = frozenset(groups or ())
+        permissions = frozenset(permissions or ())
+
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                self.authorizeRequest(scopes, groups, permissions)
+                return view(*args, **kwargs)
+            return wrapper
+
+        return decorator
+
+    def protect(self, target, scopes=None, groups=None, permissions=None):
+        """Require a cognito access token for every request of ``target``
+
+        Register a ``before_request`` hook in ``target``, an app or a
+        blueprint.
+
+        See :meth:`authorizeRequest` for ``scopes``, ``groups`` and
+        ``permissions``.
+        """
+        scopes = frozenset(scopes or ())
+        groups = frozenset(groups or ())
+        permissions = frozenset(permissions or ())
+
+        def guard():
+            self.authorizeRequest(scopes, groups, permissions)
+
+        target.before_request(guard)
+
+    def _verify(self, token, access_token=None, tenant=None):
         """Verify a cognito JWT
 
         Get the key id from the header, locate it in the cognito keys
-        and verify the key
+        and verify the key. Verified tokens are cached until they expire,
+        see ``COGNITO_TOKEN_CACHE_SIZE``. Revoked tokens are refused, see
+        ``COGNITO_REVOCATION_FEED``.
+        """
+        from jose.exceptions import JWTError
+
+        if tenant is None:
+            tenant = self.tenant
+        state = self._state
+        cache = state.token_cache
+        cache_key = cache.key(token, access_token, tenant.client_id)
+        claims = cache.get(cache_key)
+        if claims is None:
+            key = self._getKey(_keyId(state.verifier, token), tenant)
+            claims = self._decode(token, key, access_token, cache_key, tenant)
+        else:
+            claims = dict(claims)
+        if self._isRevoked(claims):
+            raise JWTError("Token revoked")
+        return claims
+
+    def _verifyTokenSet(self, tokens, tenant=None):
+        """Verify the access and id tokens of a token endpoint response
+
+        The key of both tokens is looked up once when they share it. The
+        access token claims are kept in ``tokens.access_claims``.
+
+        :returns: the ``id_token`` claims or ``None`` if the tokens were
+            revoked, see ``COGNITO_REVOCATION_FEED``
+        :rtype: dict
+        """
+        if tenant is None:
+            tenant = self.tenant
+        verifier = self._state.verifier
+        cache = self._state.token_cache
+        access_key = cache.key(tokens.access_token, None, tenant.client_id)
+        id_key = cache.key(
+            tokens.id_token, tokens.access_token, tenant.client_id)
+        access_claims = cache.get(access_key)
+        id_claims = cache.get(id_key)
+
+        keys = dict()
+        if access_claims is None:
+            kid = _keyId(verifier, tokens.access_token)
+            keys[kid] = self._getKey(kid, tenant)
+            access_claims = self._decode(
+                tokens.access_token, keys[kid], None, access_key, tenant)
+        if id_claims is None:
+            kid = _keyId(verifier, tokens.id_token)
+            key = keys.get(kid) or self._getKey(kid, tenant)
+            id_claims = self._decode(
+                tokens.id_token, key, tokens.access_token, id_key, tenant)
+
+        if self._isRevoked(access_claims) or self._isRevoked(id_claims):
+            return None
+        tokens.access_claims = access_claims
+        return id_claims
+
+    async def _verifyTokenSetAsync(self, tokens, tenant=None):
+        if tenant is None:
+            tenant = self.tenant
+        verifier = self._state.verifier
+        cache = self._state.token_cache
+        access_key = cache.key(tokens.access_token, None, tenant.client_id)
+        id_key = cache.key(
+            tokens.id_token, tokens.access_token, tenant.client_id)
+        access_claims = cache.get(access_key)
+        id_claims = cache.get(id_key)
+
+        keys = dict()
+        if access_claims is None:
+            kid = _keyId(verifier, tokens.access_token)
+            keys[kid] = await self._getKeyAsync(kid, tenant)
+            access_claims = self._decode(
+                tokens.access_token, keys[kid], None, access_key, tenant)
+        if id_claims is None:
+            kid = _keyId(verifier, tokens.id_token)
+            key = keys.get(kid) or await self._getKeyAsync(kid, tenant)
+            id_claims = self._decode(
+                tokens.id_token, key, tokens.access_token, id_key, tenant)
+
+        if self._isRevoked(access_claims) or self._isRevoked(id_claims):
+            return None
+        tokens.access_claims = access_claims
+        return id_claims
+
+    def _isRevoked(self, claims):
+        revocations = self._state.revocations
+        if revocations is None or not revocations.isRevoked(claims):
+            return False
+        self.metrics.count('revoked')
+        return True
+
+    def _decode(self, token, key, access_token, cache_key, tenant):
+        from jose.exceptions import JWTError
+
+        config = current_app.config
+        start = self.metrics.start()
+        try:
+            id_token = self._state.verifier.decode(
+                token, key, audience=tenant.client_id,
+                access_token=access_token,
+                leeway=config.get('COGNITO_CLOCK_SKEW', 0))
+        except JWTError:
+            self.metrics.observe('verify', start, outcome='invalid')
+            raise
+        self.metrics.observe('verify', start, outcome='ok')
+        self._state.token_cache.set(cache_key, id_token)
+        return dict(id_token)
+
+    @property
+    def tokenCache(self):
+        """The verified tokens cache of the current app
+
+        :rtype: flask_cognitologin.cache.TokenCache
         """
-        header = jwt.get_unverified_header(token)
+        return self._state.token_cache
+
+    def _getKey(self, kid, tenant=None):
+        """Locate the key ``kid`` in the keys of the tenant user pool
+
+        An unknown ``kid`` may mean that cognito rotated the keys, in that
+        case the keys are fetched again (see ``COGNITO_JWKS_REFETCH_INTERVAL``)
+
+        :returns: the public key parsed by the ``COGNITO_VERIFIER``
+        :raises jose.JWTError: if there is no such key
+        """
+        from jose import jwt
+
+        config = current_app.config
+        state = self._state
+        issuer = (tenant or self.tenant).issuer
+        ttl = config.get('COGNITO_JWKS_TTL')
+        verifier = state.verifier
+        key = self.jwks_cache.getKey(
+            issuer, kid, ttl=ttl, http=state.http, verifier=verifier)
+        if key is None:
+            try:
+                self.jwks_cache.refetch(
+                    issuer,
+                    min_interval=config.get('COGNITO_JWKS_REFETCH_INTERVAL'),
+                    http=state.http)
+            except Exception as e:
+                # keep the known keys
+                current_app.logger.warning("Cognito JWKS fetch failed: %s", e)
+            key = self.jwks_cache.getKey(
+                issuer, kid, ttl=ttl, http=state.http, verifier=verifier)
+        if key is None:
+            raise jwt.JWTError("Unknown key id: %s" % kid)
+
+        return key
+
+    async def _getKeyAsync(self, kid, tenant=None):
+        from jose import jwt
+
         config = current_app.config
-        key = [k for k in self.JWKS if k["kid"] == header['kid']][0]
-        id_token = jwt.decode(
-            token, key, audience=config.get('COGNITO_CLIENT_ID'),
-            access_token=access_token)
-        return id_token
+        state = self._state
+        issuer = (tenant or self.tenant).issuer
+        ttl = config.get('COGNITO_JWKS_TTL')
+        key = await self.jwks_cache.getKeyAsync(
+            issuer, kid, ttl=ttl, http=state.http, aio=state.aio,
+            verifier=state.verifier)
+        if key is None:
+            try:
+                await self.jwks_cache.refetchAsync(
+                    issuer,
+                    min_interval=config.get('COGNITO_JWKS_REFETCH_INTERVAL'),
+                    aio=state.aio)
+            except Exception as e:
+                current_app.logger.warning("Cognito JWKS fetch failed: %s", e)
+            key = await self.jwks_cache.getKeyAsync(
+                issuer, kid, ttl=ttl, http=state.http, aio=state.aio,
+                verifier=state.verifier)
+        if key is None:
+            raise jwt.JWTError("Unknown key id: %s" % kid)
+
+        return key
+
+    def health(self):
+        """Report the degraded modes of the current app
+
+        The status is ``'degraded'`` while the circuit of a cognito host is
+        not closed, the user pool keys failed to refresh and the last ones
+        are used, or identities can not be refreshed::
+
+            {'status': 'degraded',
+             'circuits': {'mypool.auth.eu-west-1.amazoncognito.com': 'open'},
+             'jwks': {'https://cognito-idp...': {'age': 4000, 'stale': True}},
+             'refresh': 'failing'}
+
+        :rtype: dict
+        """
+        state = self._state
+        issuers = set(tenant.issuer for tenant in state.tenants)
+        jwks = {
+            issuer: status
+            for issuer, status in self.jwks_cache.status().items()
+            if issuer in issuers}
+        circuits = state.breaker.states()
+        degraded = state.refresh_failing or \
+            any(s != CLOSED for s in circuits.values()) or \
+            any(s['stale'] for s in jwks.values())
+        return {
+            'status': 'degraded' if degraded else 'ok',
+            'circuits': circuits,
+            'jwks': jwks,
+            'refresh': 'failing' if state.refresh_failing else 'ok',
+        }
 
     def teardown(self, exception):
         pass
@@ -204,15 +1453,34 @@ class CognitoLogin(object):
 
     @property
     def JWKS(self):
-        config = current_app.config
-        ctx = _app_ctx_stack.top
-        if ctx is not None:
-            if not hasattr(ctx, 'aws_jwkeys'):
-                url = (
-                    "https://cognito-idp.{}.amazonaws.com/{}/"
-                    ".well-known/jwks.json").format(
-                        config.get('AWS_REGION'),
-                        config.get('COGNITO_POOL_ID')
-                )
-                ctx.aws_jwkeys = requests.get(url).json()["keys"]
-            return ctx.aws_jwkeys
+        """The user pool keys of the current tenant"""
+        state = self._state
+        return self.jwks_cache.get(
+            self.tenant.issuer, ttl=state.config.get('COGNITO_JWKS_TTL'),
+            http=state.http)
+
+
+def _isProcessPool(pool):
+    from concurrent.futures import ProcessPoolExecutor
+    return isinstance(pool, ProcessPoolExecutor)
+
+
+def _keyId(verifier, token):
+    """Return the ``kid`` of the token header
+
+    :raises jose.JWTError: if the header has no valid ``kid``
+    """
+    from jose.exceptions import JWTError
+
+    header = verifier.header(token)
+    kid = header.get('kid') if isinstance(header, dict) else None
+    if not isinstance(kid, str):
+        raise JWTError("Invalid token header")
+    return kid
+
+
+def _deny(status, authenticate=None):
+    headers = {}
+    if authenticate is not None:
+        headers['WWW-Authenticate'] = authenticate
+    abort(Response(status=status, headers=headers))
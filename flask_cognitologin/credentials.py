@@ -0,0 +1,70 @@
+"""Access tokens of the ``client_credentials`` grant, for calls between
+services."""
+from .cache import SingleFlight
+import time
+
+#: seconds before a token expires when it is renewed in the background
+DEFAULT_RENEW_WINDOW = 300
+
+
+class _Token(object):
+    __slots__ = ('access_token', 'expires', 'renew')
+
+    def __init__(self, access_token, expires, renew):
+        self.access_token = access_token
+        self.expires = expires
+        self.renew = renew
+
+
+class ClientCredentials(object):
+    """Cache the client credentials tokens of each tenant and scope set
+
+    ``fetch(tenant, scopes)`` runs the grant and returns the access token
+    and its ``expires_in``, or ``None`` if it failed. A token is used until
+    ``margin`` seconds before it expires and renewed in the background
+    ``renew_window`` seconds before, but not before half its lifetime, so in
+    steady state :meth:`get` never waits for cognito. Concurrent callers
+    share one fetch.
+    """
+
+    def __init__(self, fetch, renew_window=DEFAULT_RENEW_WINDOW, margin=0):
+        self.fetch = fetch
+        self.renew_window = renew_window
+        self.margin = margin
+        self._tokens = {}
+        self._fetches = SingleFlight()
+
+    def get(self, tenant, scopes=()):
+        """Return an access token of ``tenant`` for ``scopes``
+
+        :param tenant: a :class:`~flask_cognitologin.tenants.Tenant`
+        :param scopes: the scopes requested, their order does not matter
+        :returns: the access token or ``None`` if it could not be fetched
+        :rtype: str
+        """
+        key = (tenant.name, frozenset(scopes))
+        token = self._tokens.get(key)
+        now = time.monotonic()
+        if token is not None and now < token.expires:
+            if now >= token.renew:
+                self._fetches.doInBackground(
+                    key, self._fetch, key, tenant, scopes)
+            return token.access_token
+
+        token = self._fetches.do(key, self._fetch, key, tenant, scopes)
+        return None if token is None else token.access_token
+
+    def clear(self):
+        """Forget all the cached tokens"""
+        self._tokens.clear()
+
+    def _fetch(self, key, tenant, scopes):
+        start = time.monotonic()
+        ret = self.fetch(tenant, sorted(scopes))
+        if ret is None:
+            return None
+        access_token, expires_in = ret
+        token = self._tokens[key] = _Token(
+            access_token, start + expires_in - self.margin,
+            start + max(expires_in - self.renew_window, expires_in / 2))
+        return token
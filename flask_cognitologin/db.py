@@ -0,0 +1,46 @@
+"""SQLite database shared by the processes of a host."""
+import contextlib
+import threading
+import os
+
+#: seconds to wait for the database lock
+DEFAULT_LOCK_TIMEOUT = 15
+#: expired rows are removed from the databases every this many writes
+PURGE_EVERY = 1000
+
+
+class SQLiteDB(object):
+    """SQLite database with one connection for each process
+
+    The threads of a process share its connection, one at a time. A process
+    forked after the database was opened (for example by
+    ``gunicorn --preload``) opens its own connection, the one of the parent
+    is never used.
+    """
+
+    def __init__(self, path, timeout=DEFAULT_LOCK_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+
+    @contextlib.contextmanager
+    def connect(self):
+        """Use the connection of this process in a transaction
+
+        The connection is held by the calling thread until the transaction
+        ends.
+        """
+        import sqlite3
+
+        with self._lock:
+            if self._pid != os.getpid():
+                # never use the connection of the parent process
+                self._db = sqlite3.connect(
+                    self.path, timeout=self.timeout, check_same_thread=False)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("PRAGMA synchronous=NORMAL")
+                self._pid = os.getpid()
+            with self._db:
+                yield self._db
@@ -0,0 +1,271 @@
+"""Process wide cache for the cognito user pools signing keys."""
+import threading
+import time
+
+#: ``iss`` claim of the tokens of a user pool
+ISSUER_URL = "https://cognito-idp.{region}.amazonaws.com/{pool_id}"
+#: where the keys of an issuer are published
+JWKS_PATH = "/.well-known/jwks.json"
+
+#: seconds a fetched key set is considered fresh
+DEFAULT_TTL = 3600
+#: minimum seconds between two refetchs triggered by an unknown ``kid``
+DEFAULT_REFETCH_INTERVAL = 30
+
+
+class KeysUnavailableError(Exception):
+    """The keys of a user pool are not cached and could not be fetched"""
+
+
+def parseKeys(keys):
+    """Build the public key objects of a key set
+
+    Keys that can not be used for verification (unknown algorithm, bad
+    values) are left out.
+
+    :param list keys: the ``keys`` of a JWKS document
+    :returns: the key objects indexed by ``kid``
+    :rtype: dict
+    """
+    from jose import jwk
+
+    parsed = dict()
+    for k in keys:
+        try:
+            parsed[k['kid']] = jwk.construct(k)
+        except Exception:
+            continue
+    return parsed
+
+
+class _Entry(object):
+    __slots__ = (
+        'keys', 'parsed', 'verifiers', 'fetched_at', 'refreshing',
+        'retry_at')
+
+    def __init__(self, keys, verifiers=()):
+        self.keys = keys
+        self.parsed = {}
+        self.verifiers = []
+        # a refreshed key set is parsed for the verifiers of the old one
+        for verifier in verifiers:
+            self.keysFor(verifier)
+        self.fetched_at = time.monotonic()
+        self.refreshing = False
+        self.retry_at = 0
+
+    def keysFor(self, verifier=None):
+        name = 'jose' if verifier is None else verifier.name
+        by_kid = self.parsed.get(name)
+        if by_kid is None:
+            if verifier is None:
+                by_kid = parseKeys(self.keys)
+            else:
+                by_kid = verifier.parseKeys(self.keys)
+            self.parsed[name] = by_kid
+            self.verifiers.append(verifier)
+        return by_kid
+
+
+class JWKSCache(object):
+    """Cache the JSON Web Key Sets of one or more cognito user pools
+
+    Entries are keyed by the user pool issuer URL (see :data:`ISSUER_URL`)
+    and shared by every app and thread of the process. A stale entry is
+    still served while a background thread fetches a fresh copy, so only
+    the very first lookup of a user pool pays for the round trip to cognito.
+    If the refresh fails the last keys are kept and the refresh is tried
+    again :attr:`refresh_retry` seconds later.
+    """
+
+    #: seconds between two background refreshes of keys failing to refresh
+    refresh_retry = DEFAULT_REFETCH_INTERVAL
+
+    def __init__(self):
+        self._entries = {}
+        self._last_refetch = {}
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+
+    def fetch(self, issuer, http=None):
+        """Download the key set of a user pool
+
+        :param str issuer: the user pool issuer URL
+        :param http: client used for the request, anything with the
+            :func:`requests.get` signature, by default :mod:`requests`
+        :returns: the list of keys
+        :rtype: list
+        """
+        if http is None:
+            import requests as http
+        return http.get(issuer + JWKS_PATH).json()["keys"]
+
+    async def fetchAsync(self, issuer, aio):
+        """Same as :meth:`fetch` with an asyncio HTTP client
+
+        :param aio: a :class:`~flask_cognitologin.aio.AsyncCognitoClient`
+        """
+        r = await aio.get(issuer + JWKS_PATH)
+        return r.json()["keys"]
+
+    def get(self, issuer, ttl=DEFAULT_TTL, http=None):
+        """Return the keys of a user pool
+
+        If the keys are not in the cache they are fetched, if they are older
+        than ``ttl`` seconds the cached keys are returned and a refresh is
+        started in the background.
+
+        :param str issuer: the user pool issuer URL
+        :param int ttl: seconds before the keys are refreshed, ``None`` to
+            never refresh them
+        :param http: client for the fetch, see :meth:`fetch`
+        :rtype: list
+        """
+        return self._entry(issuer, ttl, http).keys
+
+    def getKey(self, issuer, kid, ttl=DEFAULT_TTL, http=None, verifier=None):
+        """Return the ready to use public key ``kid`` of a user pool
+
+        Same as :meth:`get` but the key is returned already parsed, so
+        verifying a signature does not have to build it from ``n``/``e``.
+        The keys are parsed once for each verifier.
+
+        :param verifier: a verifier of :mod:`flask_cognitologin.verifiers`,
+            by default the key is a :class:`jose.jwk.Key`
+        :returns: the key or ``None`` if there is no such key
+        :raises KeysUnavailableError: if the keys are not cached and the
+            fetch failed
+        """
+        return self._entry(issuer, ttl, http).keysFor(verifier).get(kid)
+
+    async def getKeyAsync(self, issuer, kid, ttl=DEFAULT_TTL, http=None,
+                          aio=None, verifier=None):
+        """Same as :meth:`getKey` without blocking the event loop
+
+        Missing keys are fetched with ``aio``, stale keys are refreshed in a
+        background thread with ``http``.
+        """
+        entry = self._entries.get(issuer)
+        if entry is None:
+            try:
+                keys = await self.fetchAsync(issuer, aio)
+            except Exception as e:
+                raise KeysUnavailableError(issuer) from e
+            entry = self._store(issuer, keys)
+        elif ttl is not None and \
+                time.monotonic() - entry.fetched_at > ttl and \
+                time.monotonic() >= entry.retry_at:
+            self._refreshInBackground(issuer, entry, http)
+        return entry.keysFor(verifier).get(kid)
+
+    def refetch(self, issuer, min_interval=DEFAULT_REFETCH_INTERVAL,
+                http=None):
+        """Fetch the keys again, for example after a key rotation
+
+        Refetchs are rate limited to one every ``min_interval`` seconds for
+        each user pool, callers arriving while a refetch is in progress wait
+        for it to finish.
+
+        :returns: ``True`` if the keys where downloaded by this call
+        :rtype: bool
+        """
+        with self._fetch_lock:
+            if not self._allowRefetch(issuer, min_interval):
+                return False
+            self._store(issuer, self.fetch(issuer, http=http))
+            return True
+
+    async def refetchAsync(self, issuer, min_interval=DEFAULT_REFETCH_INTERVAL,
+                           aio=None):
+        """Same as :meth:`refetch` without blocking the event loop"""
+        with self._lock:
+            if not self._allowRefetch(issuer, min_interval):
+                return False
+        self._store(issuer, await self.fetchAsync(issuer, aio))
+        return True
+
+    def preload(self, issuer, http=None, verifier=None):
+        """Fetch the keys of a user pool if they are not cached yet, and
+        parse them for ``verifier``"""
+        self._load(issuer, http).keysFor(verifier)
+
+    def status(self):
+        """Return the age in seconds of the keys of each issuer, and if they
+        are ``stale`` because the last refresh failed
+
+        :rtype: dict
+        """
+        now = time.monotonic()
+        return {
+            issuer: {
+                'age': now - entry.fetched_at,
+                'stale': entry.retry_at > 0,
+            } for issuer, entry in list(self._entries.items())}
+
+    def clear(self):
+        """Forget all the cached keys"""
+        with self._lock:
+            self._entries.clear()
+            self._last_refetch.clear()
+
+    def _allowRefetch(self, issuer, min_interval):
+        now = time.monotonic()
+        last = self._last_refetch.get(issuer)
+        if last is not None and now - last < min_interval:
+            return False
+        self._last_refetch[issuer] = now
+        return True
+
+    def _entry(self, issuer, ttl, http):
+        entry = self._entries.get(issuer)
+        if entry is None:
+            return self._load(issuer, http)
+
+        now = time.monotonic()
+        if ttl is not None and now - entry.fetched_at > ttl and \
+                now >= entry.retry_at:
+            self._refreshInBackground(issuer, entry, http)
+
+        return entry
+
+    def _store(self, issuer, keys):
+        old = self._entries.get(issuer)
+        entry = _Entry(keys, old.verifiers if old is not None else ())
+        with self._lock:
+            self._entries[issuer] = entry
+        return entry
+
+    def _load(self, issuer, http):
+        with self._fetch_lock:
+            # other thread may have done the work while we waited
+            entry = self._entries.get(issuer)
+            if entry is None:
+                try:
+                    keys = self.fetch(issuer, http=http)
+                except Exception as e:
+                    raise KeysUnavailableError(issuer) from e
+                entry = self._store(issuer, keys)
+            return entry
+
+    def _refreshInBackground(self, issuer, entry, http):
+        with self._lock:
+            if entry.refreshing:
+                return
+            entry.refreshing = True
+
+        def refresh():
+            try:
+                self._store(issuer, self.fetch(issuer, http=http))
+            except Exception:
+                # keep serving the stale keys, try again later
+                entry.retry_at = time.monotonic() + self.refresh_retry
+                entry.refreshing = False
+
+        t = threading.Thread(target=refresh, name='cognito-jwks-refresh')
+        t.daemon = True
+        t.start()
+
+
+#: cache shared by all the :class:`~flask_cognitologin.CognitoLogin`
+#: instances of the process
+jwks_cache = JWKSCache()
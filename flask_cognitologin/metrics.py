@@ -0,0 +1,155 @@
+"""Instrumentation hooks and a Prometheus exporter."""
+import threading
+import bisect
+import time
+
+#: histogram buckets, in seconds, of :class:`PrometheusExporter`
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+    2.5, 5.0, 10.0)
+
+
+class Metrics(object):
+    """Dispatch the extension measures to the connected listeners
+
+    A listener is called as ``listener(kind, name, value, labels)``, with
+    ``kind`` ``'timing'`` (``value`` in seconds) or ``'count'``. The measures
+    are:
+
+    *  ``http_request`` timing, labels ``path`` and ``outcome``, every
+       request to cognito (token, JWKS, ...)
+    *  ``verify`` timing, a JWT signature and claims verification
+    *  ``upstream_error`` count, labels ``path`` and ``error``
+    *  ``circuit`` count, labels ``host`` and ``state``, circuit breaker
+       state changes
+    *  ``refresh`` count, label ``outcome``, identity refreshes, ``grace``
+       for identities kept while cognito can not be reached
+    *  ``refresh_token_rotated`` count, refreshes returning a new refresh
+       token
+    *  ``service_token`` count, label ``outcome``, client credentials
+       grants of :meth:`~flask_cognitologin.CognitoLogin.getServiceToken`
+    *  ``csrf_mismatch`` count, callbacks with a bad ``state``
+    *  ``token_cache`` count, label ``result`` (``hit`` or ``miss``)
+    *  ``userinfo_cache`` count, label ``result`` (``hit``, ``miss``,
+       ``revalidated`` or ``error``)
+    *  ``revocation_sync`` count, label ``outcome``, reads of the revocation
+       feed
+    *  ``revoked`` count, refused revoked tokens and identities
+    *  ``batch_verify`` count, label ``outcome``, tokens verified by
+       :meth:`~flask_cognitologin.CognitoLogin.verifyMany`
+
+    Without listeners nothing is measured, the only cost is checking the
+    empty listeners list.
+    """
+
+    def __init__(self):
+        self.listeners = []
+
+    def connect(self, listener):
+        """Add a listener, can be used as a decorator"""
+        self.listeners.append(listener)
+        return listener
+
+    def disconnect(self, listener):
+        self.listeners.remove(listener)
+
+    def start(self):
+        """Start a timing
+
+        :returns: the start time or ``None`` if nobody is listening
+        """
+        if self.listeners:
+            return time.perf_counter()
+        return None
+
+    def observe(self, name, start, **labels):
+        """End the timing started at ``start``, see :meth:`start`"""
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        for listener in self.listeners:
+            listener('timing', name, elapsed, labels)
+
+    def count(self, name, value=1, **labels):
+        if not self.listeners:
+            return
+        for listener in self.listeners:
+            listener('count', name, value, labels)
+
+    def prometheus(self):
+        """Return the :class:`PrometheusExporter` of this metrics
+
+        It is created and connected the first time.
+        """
+        for listener in self.listeners:
+            if isinstance(listener, PrometheusExporter):
+                return listener
+        return self.connect(PrometheusExporter())
+
+
+class PrometheusExporter(object):
+    """Listener keeping the measures in the Prometheus text format
+
+    Timings become histograms named ``cognito_<name>_seconds`` and counts
+    become counters named ``cognito_<name>_total``.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, kind, name, value, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if kind == 'count':
+                self._counters[key] = self._counters.get(key, 0) + value
+                return
+            h = self._histograms.get(key)
+            if h is None:
+                # one slot per bucket plus +Inf, then the sum
+                h = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            h[bisect.bisect_left(self.buckets, value)] += 1
+            h[-1] += value
+
+    def render(self):
+        """Return the measures in the Prometheus text exposition format
+
+        :rtype: str
+        """
+        with self._lock:
+            histograms = dict((k, list(v)) for k, v in
+                              self._histograms.items())
+            counters = dict(self._counters)
+
+        lines = []
+        for name in sorted(set(k[0] for k in histograms)):
+            metric = 'cognito_%s_seconds' % name
+            lines.append('# TYPE %s histogram' % metric)
+            for (n, labels), h in sorted(histograms.items()):
+                if n != name:
+                    continue
+                total = 0
+                for le, count in zip(self.buckets + ('+Inf',), h):
+                    total += count
+                    lines.append('%s_bucket%s %d' % (
+                        metric, _labels(labels + (('le', le),)), total))
+                lines.append('%s_sum%s %r' % (metric, _labels(labels), h[-1]))
+                lines.append('%s_count%s %d' % (
+                    metric, _labels(labels), total))
+        for name in sorted(set(k[0] for k in counters)):
+            metric = 'cognito_%s_total' % name
+            lines.append('# TYPE %s counter' % metric)
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append('%s%s %r' % (metric, _labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in labels)
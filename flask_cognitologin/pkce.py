@@ -0,0 +1,82 @@
+"""PKCE and signed OAuth state for the sign in flow."""
+import hashlib
+import base64
+import struct
+import hmac
+import time
+import os
+
+#: seconds a signed state is accepted after it was issued
+DEFAULT_STATE_MAX_AGE = 600
+
+_NONCE_SIZE = 16
+_MAC_SIZE = 16
+_STATE_SIZE = _NONCE_SIZE + 4 + _MAC_SIZE
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def newVerifier():
+    """Return a random PKCE ``code_verifier``"""
+    return _b64(os.urandom(32))
+
+
+def codeChallenge(verifier):
+    """Return the ``S256`` ``code_challenge`` of ``verifier``"""
+    return _b64(hashlib.sha256(verifier.encode('ascii')).digest())
+
+
+class StateSigner(object):
+    """Stateless OAuth ``state``
+
+    The state is a random nonce and the time it was issued, signed with
+    HMAC-SHA256, so the callback can check it without reading the session.
+
+    The state proves the sign in started at this app a moment ago, unlike
+    the session state it is not bound to the browser that started it and
+    can be replayed until it expires, so it does not protect against login
+    CSRF.
+    """
+
+    def __init__(self, secret, max_age=DEFAULT_STATE_MAX_AGE):
+        if not secret:
+            raise ValueError("A SECRET_KEY is needed to sign the state")
+        if isinstance(secret, str):
+            secret = secret.encode('utf-8')
+        # don't use the app secret as is, it also signs the session
+        self.key = hmac.new(
+            secret, b'flask_cognitologin.state', hashlib.sha256).digest()
+        self.max_age = max_age
+
+    def sign(self, context=b''):
+        """Return a new state
+
+        :param bytes context: the state is only valid for this context
+        :rtype: str
+        """
+        nonce = os.urandom(_NONCE_SIZE)
+        payload = nonce + struct.pack('>I', int(time.time()))
+        return _b64(payload + self._mac(payload, context))
+
+    def verify(self, state, context=b''):
+        """Return the nonce of ``state`` or ``None`` if it is not valid"""
+        if not state or len(state) != _STATE_SIZE * 4 // 3:
+            return None
+        try:
+            data = base64.urlsafe_b64decode(state)
+        except ValueError:
+            return None
+        payload, mac = data[:-_MAC_SIZE], data[-_MAC_SIZE:]
+        if not hmac.compare_digest(mac, self._mac(payload, context)):
+            return None
+        issued, = struct.unpack('>I', payload[_NONCE_SIZE:])
+        if time.time() - issued > self.max_age:
+            return None
+        return payload[:_NONCE_SIZE]
+
+    def _mac(self, payload, context):
+        return hmac.new(
+            self.key, context + b'\0' + payload,
+            hashlib.sha256).digest()[:_MAC_SIZE]
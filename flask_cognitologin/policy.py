@@ -0,0 +1,74 @@
+"""Permissions granted by the cognito groups and the token scopes."""
+
+#: group and scope combinations whose permissions are remembered
+DEFAULT_MEMO_SIZE = 4096
+
+_EMPTY = frozenset()
+
+
+class Policy(object):
+    """Map the groups of a user and the scopes of a token to permissions
+
+    ``groups`` and ``scopes`` map each group or scope to the permissions it
+    grants. They are compiled once into frozensets, and the permissions of
+    each groups and scope combination seen are remembered, so the
+    permissions of a verified token or identity are a dict lookup and a
+    permission check is a set lookup.
+    """
+
+    def __init__(self, groups=None, scopes=None, memo_size=DEFAULT_MEMO_SIZE):
+        self.groups = _compile('groups', groups)
+        self.scopes = _compile('scopes', scopes)
+        self.memo_size = memo_size
+        self._memo = {}
+
+    @classmethod
+    def fromConfig(cls, config):
+        """Build the policy from ``COGNITO_PERMISSIONS``
+
+        :raises ValueError: if the policy is not valid
+        """
+        policy = config.get('COGNITO_PERMISSIONS')
+        if policy is None or isinstance(policy, Policy):
+            return policy or cls()
+        unknown = set(policy) - {'groups', 'scopes'}
+        if unknown:
+            raise ValueError(
+                "Unknown COGNITO_PERMISSIONS keys: %s" % ", ".join(
+                    sorted(unknown)))
+        return cls(policy.get('groups'), policy.get('scopes'))
+
+    def permissions(self, claims):
+        """Return the permissions granted by the ``cognito:groups`` and
+        ``scope`` claims
+
+        :param dict claims: token claims or identity
+        :rtype: frozenset
+        """
+        groups = claims.get('cognito:groups') or ()
+        scope = claims.get('scope') or ''
+        key = (tuple(groups), scope)
+        ret = self._memo.get(key)
+        if ret is not None:
+            return ret
+
+        ret = _EMPTY
+        for group in groups:
+            ret = ret | self.groups.get(group, _EMPTY)
+        for name in scope.split():
+            ret = ret | self.scopes.get(name, _EMPTY)
+        if len(self._memo) >= self.memo_size:
+            self._memo.clear()
+        self._memo[key] = ret
+        return ret
+
+
+def _compile(kind, mapping):
+    ret = {}
+    for name, permissions in (mapping or {}).items():
+        if isinstance(permissions, str):
+            raise ValueError(
+                "COGNITO_PERMISSIONS %s %r: give a list of permissions" % (
+                    kind, name))
+        ret[name] = frozenset(permissions)
+    return ret
@@ -0,0 +1,246 @@
+"""Revoked tokens and users, checked without calling cognito."""
+import threading
+import hashlib
+import math
+import time
+import os
+
+#: seconds between two reads of the revocation feed
+DEFAULT_INTERVAL = 30
+#: revoked values kept in a plain set, bigger lists use a Bloom filter
+DEFAULT_BLOOM_THRESHOLD = 100000
+#: false positive rate of the Bloom filter
+DEFAULT_ERROR_RATE = 0.001
+
+
+class BloomFilter(object):
+    """Fixed size probabilistic set
+
+    Membership tests may return false positives, at the ``error_rate`` for
+    ``capacity`` values, but never false negatives.
+    """
+
+    def __init__(self, capacity, error_rate=DEFAULT_ERROR_RATE):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(
+            -capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(
+            self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.sha256(str(value).encode('utf-8')).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for p in self._positions(value):
+            self.bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, value):
+        bits = self.bits
+        for p in self._positions(value):
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+
+class FileFeed(object):
+    """Revoked values in a text file, one per line
+
+    Empty lines and lines starting with ``#`` are ignored. The file is only
+    read again when its modification time changes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._mtime = None
+
+    def __call__(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self._mtime:
+            return None
+        with open(self.path) as f:
+            values = [line.strip() for line in f]
+        self._mtime = mtime
+        return [v for v in values if v and not v.startswith('#')]
+
+
+class HTTPFeed(object):
+    """Revoked values served as a JSON list, or an object with a
+    ``revoked`` list, at ``url``
+
+    The ``ETag`` of the response is sent back so an unchanged list is not
+    downloaded again.
+
+    The HTTP client is ``http``, or the one returned by ``http_factory``
+    on the first read, so it is not built before it is needed.
+    """
+
+    def __init__(self, url, http=None, http_factory=None):
+        self.url = url
+        self.http = http
+        self.http_factory = http_factory
+        self._etag = None
+
+    def __call__(self):
+        headers = {}
+        if self._etag:
+            headers['If-None-Match'] = self._etag
+        if self.http is None and self.http_factory is not None:
+            self.http = self.http_factory()
+        http = self.http
+        if http is None:
+            import requests as http
+        r = http.get(self.url, headers=headers)
+        if r.status_code == 304:
+            return None
+        r.raise_for_status()
+        data = r.json()
+        if isinstance(data, dict):
+            data = data['revoked']
+        self._etag = r.headers.get('ETag')
+        return data
+
+
+class RevocationList(object):
+    """Revoked ``jti``, ``origin_jti`` and ``sub`` values
+
+    The values come from ``feed``, a callable returning the revoked values,
+    or ``None`` if they did not change since the last call. The first check
+    reads the feed and waits for it, the other checks made meanwhile wait
+    too. Then the feed is called again in the background once ``interval``
+    seconds passed, the current values keep being used meanwhile and if the
+    feed fails.
+
+    Lists bigger than ``bloom_threshold`` are kept in a
+    :class:`BloomFilter`, a few valid tokens may then be taken as revoked.
+
+    Reads of the feed are reported to ``metrics``, a
+    :class:`~flask_cognitologin.metrics.Metrics`, if given.
+    """
+
+    #: claims looked up in the revoked values
+    CLAIMS = ('jti', 'origin_jti', 'sub')
+
+    def __init__(self, feed, interval=DEFAULT_INTERVAL,
+                 bloom_threshold=DEFAULT_BLOOM_THRESHOLD,
+                 error_rate=DEFAULT_ERROR_RATE, metrics=None):
+        self.feed = feed
+        self.interval = interval
+        self.bloom_threshold = bloom_threshold
+        self.error_rate = error_rate
+        self.metrics = metrics
+        self.revoked = frozenset()
+        self.loaded_at = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._first_load = threading.Lock()
+
+    def load(self):
+        """Read the feed now
+
+        :returns: ``True`` if the revoked values changed
+        :rtype: bool
+        """
+        try:
+            values = self.feed()
+        except Exception:
+            self.loaded_at = time.monotonic()
+            self._count('error')
+            raise
+        self.loaded_at = time.monotonic()
+        if values is None:
+            self._count('unchanged')
+            return False
+        values = frozenset(values)
+        if len(values) > self.bloom_threshold:
+            bloom = BloomFilter(len(values), self.error_rate)
+            for value in values:
+                bloom.add(value)
+            values = bloom
+        self.revoked = values
+        self._count('ok')
+        return True
+
+    def isRevoked(self, claims):
+        """Return ``True`` if any of the :attr:`CLAIMS` of ``claims`` is
+        revoked"""
+        loaded_at = self.loaded_at
+        if loaded_at is None:
+            self._loadFirst()
+        elif time.monotonic() - loaded_at > self.interval:
+            self._refreshInBackground()
+        revoked = self.revoked
+        for name in self.CLAIMS:
+            value = claims.get(name)
+            if value is not None and value in revoked:
+                return True
+        return False
+
+    def _loadFirst(self):
+        with self._first_load:
+            if self.loaded_at is not None:
+                return
+            try:
+                self.load()
+            except Exception:
+                # retried in the background after the interval
+                pass
+
+    def _refreshInBackground(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                self.load()
+            except Exception:
+                # keep the current values, try again after the interval
+                pass
+            finally:
+                self._refreshing = False
+
+        t = threading.Thread(target=refresh, name='cognito-revocation-sync')
+        t.daemon = True
+        t.start()
+
+    def _count(self, outcome):
+        if self.metrics is not None:
+            self.metrics.count('revocation_sync', outcome=outcome)
+
+
+def revocationsFromConfig(config, http=None, metrics=None,
+                          http_factory=None):
+    """Build the revocation list from the ``COGNITO_REVOCATION_*`` keys
+
+    ``COGNITO_REVOCATION_FEED`` is a file path, an ``http(s)://`` URL or a
+    feed callable, see :class:`RevocationList`. The feed is not read here,
+    the first check reads it.
+
+    :param http: client of an URL feed, see :class:`HTTPFeed`
+    :param http_factory: returns the client of an URL feed when it is first
+        read
+
+    :returns: the revocation list or ``None`` if there is no feed
+    :rtype: RevocationList
+    """
+    feed = config.get('COGNITO_REVOCATION_FEED')
+    if feed is None:
+        return None
+    if isinstance(feed, str):
+        if feed.startswith(('http://', 'https://')):
+            feed = HTTPFeed(feed, http=http, http_factory=http_factory)
+        else:
+            feed = FileFeed(feed)
+    return RevocationList(
+        feed,
+        interval=config.get('COGNITO_REVOCATION_INTERVAL', DEFAULT_INTERVAL),
+        bloom_threshold=config.get(
+            'COGNITO_REVOCATION_BLOOM_THRESHOLD', DEFAULT_BLOOM_THRESHOLD),
+        error_rate=config.get(
+            'COGNITO_REVOCATION_ERROR_RATE', DEFAULT_ERROR_RATE),
+        metrics=metrics)
@@ -0,0 +1,186 @@
+"""Caches shared by the processes of a host, for prefork servers."""
+from .jwks import JWKSCache, DEFAULT_TTL, DEFAULT_REFETCH_INTERVAL
+from .cache import TokenCache, DEFAULT_TOKEN_CACHE_SIZE
+from .db import SQLiteDB, DEFAULT_LOCK_TIMEOUT, PURGE_EVERY
+import contextlib
+import sqlite3
+import json
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+class SharedDB(SQLiteDB):
+    """SQLite database of the caches shared by the processes of the host
+
+    Every process opens its own connection, also a process forked after
+    the database was opened, so an app created before the fork (for example
+    with ``gunicorn --preload``) can use it in the workers.
+    """
+
+    def __init__(self, path, timeout=DEFAULT_LOCK_TIMEOUT):
+        super(SharedDB, self).__init__(path, timeout=timeout)
+        with self.connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cognito_jwks ("
+                "issuer TEXT PRIMARY KEY, keys TEXT, fetched_at REAL)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cognito_claims ("
+                "key BLOB PRIMARY KEY, claims TEXT, expires REAL)")
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        """Hold the lock file of the database, for one process and thread
+        at a time"""
+        if fcntl is None:  # pragma: no cover
+            yield
+            return
+        with open(self.path + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class SharedJWKSCache(JWKSCache):
+    """JWKS cache sharing the downloaded keys through a :class:`SharedDB`
+
+    Before downloading a key set the process takes the database lock file
+    and looks for a copy younger than ``ttl`` in the database, so only one
+    worker of a prefork server downloads the keys and the other ones read
+    them. Each process still keeps the parsed keys in memory.
+    """
+
+    def __init__(self, db, ttl=DEFAULT_TTL):
+        super(SharedJWKSCache, self).__init__()
+        self.db = db
+        self.ttl = ttl
+        # fetch time of the copy each issuer keys came from
+        self._versions = {}
+        self._ages = {}
+
+    def fetch(self, issuer, http=None):
+        """Same as :meth:`JWKSCache.fetch` but the keys in the database are
+        used if they are younger than ``ttl`` seconds"""
+        return self._fetchShared(issuer, http, self.ttl)
+
+    async def fetchAsync(self, issuer, aio):
+        keys = self._read(issuer, self.ttl)
+        if keys is None:
+            keys = await super(SharedJWKSCache, self).fetchAsync(issuer, aio)
+            self._write(issuer, keys)
+        return keys
+
+    def refetch(self, issuer, min_interval=DEFAULT_REFETCH_INTERVAL,
+                http=None):
+        with self._fetch_lock:
+            if not self._allowRefetch(issuer, min_interval):
+                return False
+            # other worker may have refetched the rotated keys already
+            self._store(issuer, self._fetchShared(
+                issuer, http, min_interval, self._versions.get(issuer)))
+            return True
+
+    def _fetchShared(self, issuer, http, max_age, newer_than=None):
+        with self.db.exclusive():
+            keys = self._read(issuer, max_age, newer_than)
+            if keys is None:
+                keys = super(SharedJWKSCache, self).fetch(issuer, http=http)
+                self._write(issuer, keys)
+        return keys
+
+    def _store(self, issuer, keys):
+        entry = super(SharedJWKSCache, self)._store(issuer, keys)
+        # keys read from the database are as old as the copy there
+        entry.fetched_at -= self._ages.pop(issuer, 0)
+        return entry
+
+    def _read(self, issuer, max_age, newer_than=None):
+        try:
+            with self.db.connect() as db:
+                row = db.execute(
+                    "SELECT keys, fetched_at FROM cognito_jwks "
+                    "WHERE issuer = ?", (issuer,)).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        if newer_than is not None and row[1] <= newer_than:
+            return None
+        age = max(time.time() - row[1], 0)
+        if age > max_age:
+            return None
+        self._versions[issuer] = row[1]
+        self._ages[issuer] = age
+        return json.loads(row[0])
+
+    def _write(self, issuer, keys):
+        now = time.time()
+        self._versions[issuer] = now
+        try:
+            with self.db.connect() as db:
+                db.execute(
+                    "INSERT OR REPLACE INTO cognito_jwks "
+                    "(issuer, keys, fetched_at) VALUES (?, ?, ?)",
+                    (issuer, json.dumps(keys), now))
+        except sqlite3.Error:
+            pass
+
+
+class SharedTokenCache(TokenCache):
+    """Verified claims cache backed by a :class:`SharedDB`
+
+    Claims verified by any process are found by the others. The in process
+    LRU cache is looked up first, the database is only read on a miss.
+    """
+
+    def __init__(self, db, size=DEFAULT_TOKEN_CACHE_SIZE, metrics=None):
+        super(SharedTokenCache, self).__init__(size, metrics=metrics)
+        self.db = db
+        self._writes = 0
+
+    def _lookup(self, key):
+        claims = super(SharedTokenCache, self)._lookup(key)
+        if claims is not None or self.size <= 0:
+            return claims
+        try:
+            with self.db.connect() as db:
+                row = db.execute(
+                    "SELECT claims, expires FROM cognito_claims "
+                    "WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None or row[1] <= time.time():
+            return None
+        claims = json.loads(row[0])
+        super(SharedTokenCache, self).set(key, claims)
+        return claims
+
+    def set(self, key, claims):
+        if self.size <= 0 or 'exp' not in claims:
+            return
+        super(SharedTokenCache, self).set(key, claims)
+        try:
+            with self.db.connect() as db:
+                # counted under the database lock
+                self._writes += 1
+                db.execute(
+                    "INSERT OR REPLACE INTO cognito_claims "
+                    "(key, claims, expires) VALUES (?, ?, ?)",
+                    (key, json.dumps(claims), claims['exp']))
+                if self._writes % PURGE_EVERY == 0:
+                    db.execute(
+                        "DELETE FROM cognito_claims WHERE expires < ?",
+                        (time.time(),))
+        except sqlite3.Error:
+            # the local cache is still there
+            pass
+
+    def clear(self):
+        super(SharedTokenCache, self).clear()
+        with self.db.connect() as db:
+            db.execute("DELETE FROM cognito_claims")
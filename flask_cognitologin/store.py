@@ -0,0 +1,168 @@
+"""Server side storage for the user identities."""
+from collections import OrderedDict
+from .db import SQLiteDB, PURGE_EVERY
+import threading
+import json
+import time
+import os
+
+#: seconds an identity is kept after it was saved, cognito refresh tokens
+#: are valid for 30 days by default
+DEFAULT_TTL = 30 * 24 * 60 * 60
+#: identities kept by :class:`MemoryIdentityStore`
+DEFAULT_SIZE = 10000
+
+
+class IdentityStore(object):
+    """Keep the identity claims and refresh tokens out of the session
+
+    The session only holds the opaque handle returned by :meth:`add`.
+    Subclasses implement :meth:`get`, :meth:`set` and :meth:`delete`.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+
+    def add(self, identity):
+        """Save a new identity
+
+        :returns: the handle of the identity
+        :rtype: str
+        """
+        handle = os.urandom(16).hex()
+        self.set(handle, identity)
+        return handle
+
+    def get(self, handle):
+        """Return the identity for ``handle`` or ``None``"""
+        raise NotImplementedError()
+
+    def set(self, handle, identity):
+        """Save ``identity`` under ``handle``"""
+        raise NotImplementedError()
+
+    def delete(self, handle):
+        """Forget the identity for ``handle``"""
+        raise NotImplementedError()
+
+
+class MemoryIdentityStore(IdentityStore):
+    """Keep the identities in process memory
+
+    At most ``size`` identities are kept, the least recently used ones are
+    dropped first. Only useful with a single process.
+    """
+
+    def __init__(self, size=DEFAULT_SIZE, ttl=DEFAULT_TTL):
+        super(MemoryIdentityStore, self).__init__(ttl=ttl)
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, handle):
+        with self._lock:
+            item = self._data.get(handle)
+            if item is None:
+                return None
+            expires, identity = item
+            if expires < time.time():
+                del self._data[handle]
+                return None
+            self._data.move_to_end(handle)
+            return identity
+
+    def set(self, handle, identity):
+        with self._lock:
+            self._data[handle] = (time.time() + self.ttl, identity)
+            self._data.move_to_end(handle)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def delete(self, handle):
+        with self._lock:
+            self._data.pop(handle, None)
+
+
+class SQLiteIdentityStore(IdentityStore):
+    """Keep the identities in a SQLite database
+
+    The database can be shared by all the processes of the same host. Every
+    process opens its own connection, also a process forked after the store
+    was created (for example with ``gunicorn --preload``). The expired
+    identities are removed every ``PURGE_EVERY`` writes.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        super(SQLiteIdentityStore, self).__init__(ttl=ttl)
+        self.path = path
+        self.db = SQLiteDB(path)
+        self._writes = 0
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cognito_identities ("
+                "handle TEXT PRIMARY KEY, identity TEXT, expires REAL)")
+
+    def _connect(self):
+        return self.db.connect()
+
+    def get(self, handle):
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT identity, expires FROM cognito_identities "
+                "WHERE handle = ?", (handle,)).fetchone()
+        if row is None:
+            return None
+        if row[1] < time.time():
+            self.delete(handle)
+            return None
+        return json.loads(row[0])
+
+    def set(self, handle, identity):
+        with self._connect() as db:
+            # counted under the database lock
+            self._writes += 1
+            db.execute(
+                "INSERT OR REPLACE INTO cognito_identities "
+                "(handle, identity, expires) VALUES (?, ?, ?)",
+                (handle, json.dumps(identity), time.time() + self.ttl))
+            if self._writes % PURGE_EVERY == 0:
+                self._purge(db)
+
+    def delete(self, handle):
+        with self._connect() as db:
+            db.execute(
+                "DELETE FROM cognito_identities WHERE handle = ?", (handle,))
+
+    def purge(self):
+        """Remove the expired identities"""
+        with self._connect() as db:
+            self._purge(db)
+
+    def _purge(self, db):
+        db.execute(
+            "DELETE FROM cognito_identities WHERE expires < ?",
+            (time.time(),))
+
+
+def storeFromConfig(config):
+    """Build the identity store selected by ``COGNITO_IDENTITY_STORE``
+
+    :returns: the store or ``None`` if there is none configured
+    :rtype: IdentityStore
+    :raises ValueError: if the store is unknown
+    """
+    store = config.get('COGNITO_IDENTITY_STORE')
+    ttl = config.get('COGNITO_IDENTITY_STORE_TTL', DEFAULT_TTL)
+    if store is None or isinstance(store, IdentityStore):
+        return store
+    if store == 'memory':
+        return MemoryIdentityStore(
+            size=config.get('COGNITO_IDENTITY_STORE_SIZE', DEFAULT_SIZE),
+            ttl=ttl)
+    if store == 'sqlite':
+        path = config.get('COGNITO_IDENTITY_STORE_PATH')
+        if path is None:
+            raise ValueError(
+                "COGNITO_IDENTITY_STORE_PATH is needed for the sqlite store")
+        return SQLiteIdentityStore(path, ttl=ttl)
+    raise ValueError("Unknown identity store: %s" % store)
@@ -0,0 +1,168 @@
+"""Many user pools and app clients served by the same app."""
+from urllib.parse import urlencode
+from .jwks import ISSUER_URL
+
+#: config keys every tenant needs
+REQUIRED_KEYS = (
+    'AWS_REGION', 'COGNITO_POOL_ID', 'COGNITO_DOMAIN', 'COGNITO_CLIENT_ID',
+    'COGNITO_CALLBACK_URL', 'COGNITO_CLIENT_SECRET')
+
+
+class Tenant(object):
+    """A cognito user pool and app client
+
+    Everything derived from the config is computed once here, so serving a
+    request does not have to read the config again.
+    """
+
+    __slots__ = (
+        'name', 'client_id', 'callback_url', 'domain_url', 'token_url',
+        'userinfo_url', 'issuer', 'auth', 'hosts', 'path_prefix',
+        'sign_in_params', 'sign_in_url', 'authorize_url', 'logout_url')
+
+    def __init__(self, name, config):
+        """
+        :param str name: tenant name
+        :param config: mapping with the :data:`REQUIRED_KEYS`, and
+            optionally ``COGNITO_ISSUER``, ``COGNITO_SCOPE``,
+            ``COGNITO_IDENTITY_PROVIDER``, ``HOSTS`` (host names served by
+            this tenant) and ``PATH_PREFIX`` (first path segment of the
+            requests of this tenant)
+        :raises ValueError: if the config keys are missing
+        """
+        missing = [k for k in REQUIRED_KEYS if config.get(k) is None]
+        if missing:
+            raise ValueError(
+                "Missing config keys for flask_cognito: %s" % (
+                    ", ".join(missing)))
+        self.name = name
+        self.client_id = config['COGNITO_CLIENT_ID']
+        self.callback_url = config['COGNITO_CALLBACK_URL']
+        domain = config['COGNITO_DOMAIN']
+        if '://' not in domain:
+            domain = 'https://' + domain
+        self.domain_url = domain.rstrip('/')
+        self.token_url = self.domain_url + '/oauth2/token'
+        self.userinfo_url = self.domain_url + '/oauth2/userInfo'
+        self.issuer = config.get('COGNITO_ISSUER') or ISSUER_URL.format(
+            region=config['AWS_REGION'], pool_id=config['COGNITO_POOL_ID'])
+        # HTTP basic auth for the token endpoint, requests and httpx take it
+        self.auth = (
+            config['COGNITO_CLIENT_ID'], config['COGNITO_CLIENT_SECRET'])
+        self.hosts = tuple(config.get('HOSTS', ()))
+        self.path_prefix = config.get('PATH_PREFIX')
+
+        # the sign in and logout URLs only lack the state, build them once
+        params = {
+            'response_type': 'code',
+            'client_id': self.client_id,
+            'redirect_uri': self.callback_url,
+        }
+        self.logout_url = self.domain_url + '/logout?' + urlencode(params)
+        scope = config.get('COGNITO_SCOPE')
+        if scope:
+            if not isinstance(scope, str):
+                scope = ' '.join(scope)
+            params['scope'] = scope
+        provider = config.get('COGNITO_IDENTITY_PROVIDER')
+        if provider:
+            params['identity_provider'] = provider
+        self.sign_in_params = params
+        self.authorize_url = (
+            self.domain_url + '/oauth2/authorize?' + urlencode(params))
+        if provider:
+            self.sign_in_url = self.authorize_url
+        else:
+            self.sign_in_url = (
+                self.domain_url + '/login?' + urlencode(params))
+
+    def signInUrl(self, state, params=None):
+        """Return the sign in URL
+
+        :param str state: the CSRF state, it must be URL safe
+        :param dict params: more query parameters, they go to the
+            ``/oauth2/authorize`` endpoint
+        :rtype: str
+        """
+        if not params:
+            return self.sign_in_url + '&state=' + state
+        if params.keys().isdisjoint(self.sign_in_params):
+            return '%s&state=%s&%s' % (
+                self.authorize_url, state, urlencode(params))
+        params = dict(self.sign_in_params, **params)
+        params['state'] = state
+        return self.domain_url + '/oauth2/authorize?' + urlencode(params)
+
+
+class TenantRegistry(object):
+    """Find the tenant of a request in constant time
+
+    Tenants are indexed by name, by host name, by the first segment of the
+    request path and by issuer and client id, several app clients of a user
+    pool are several tenants.
+    """
+
+    def __init__(self, default=None):
+        #: tenant used when nothing else matches
+        self.default = default
+        self._by_name = {}
+        self._by_host = {}
+        self._by_prefix = {}
+        self._by_issuer = {}
+        self._by_client = {}
+        if default is not None:
+            self.add(default)
+
+    def add(self, tenant):
+        self._by_name[tenant.name] = tenant
+        self._by_issuer.setdefault(tenant.issuer, tenant)
+        self._by_client[(tenant.issuer, tenant.client_id)] = tenant
+        for host in tenant.hosts:
+            self._by_host[host.lower()] = tenant
+        if tenant.path_prefix:
+            self._by_prefix[tenant.path_prefix.strip('/')] = tenant
+
+    def __iter__(self):
+        return iter(self._by_name.values())
+
+    def __len__(self):
+        return len(self._by_name)
+
+    def get(self, name):
+        """Return the tenant called ``name`` or :attr:`default`"""
+        return self._by_name.get(name, self.default)
+
+    def byHost(self, host):
+        """Return the tenant of ``host`` (port is ignored) or
+        :attr:`default`"""
+        return self._by_host.get(
+            host.rsplit(':', 1)[0].lower(), self.default)
+
+    def byPath(self, path):
+        """Return the tenant of the first segment of ``path`` or
+        :attr:`default`"""
+        first = path.lstrip('/').split('/', 1)[0]
+        return self._by_prefix.get(first, self.default)
+
+    def byIssuer(self, issuer, client_id=None):
+        """Return the tenant of the user pool ``issuer`` and app client
+        ``client_id`` or ``None``
+
+        Without ``client_id`` the first tenant of the user pool is returned.
+        """
+        if client_id is None:
+            return self._by_issuer.get(issuer)
+        return self._by_client.get((issuer, client_id))
+
+    def resolve(self, request, by='host'):
+        """Return the tenant of ``request``
+
+        :param by: ``'host'``, ``'path'`` or a callable taking the request
+            and returning the tenant name
+        :rtype: Tenant
+        """
+        if by == 'host':
+            return self.byHost(request.host)
+        if by == 'path':
+            return self.byPath(request.path)
+        return self.get(by(request))
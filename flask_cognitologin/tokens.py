@@ -0,0 +1,76 @@
+"""Tokens returned by the cognito token endpoint."""
+
+#: claims every identity keeps, see ``COGNITO_IDENTITY_CLAIMS``
+IDENTITY_CLAIMS = ('exp', 'refresh_token')
+
+
+class TokenSet(object):
+    """The parsed response of the cognito token endpoint
+
+    ``refresh_token`` is only present for the ``authorization_code`` grant,
+    ``access_claims`` holds the claims of the access token once it is
+    verified.
+    """
+
+    __slots__ = (
+        'id_token', 'access_token', 'refresh_token', 'expires_in',
+        'token_type', 'access_claims')
+
+    def __init__(self, id_token, access_token, refresh_token=None,
+                 expires_in=None, token_type=None):
+        self.id_token = id_token
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.expires_in = expires_in
+        self.token_type = token_type
+        self.access_claims = None
+
+    @classmethod
+    def fromJson(cls, data):
+        """Build the token set from the decoded response body
+
+        :param dict data: the token endpoint response
+        :rtype: TokenSet
+        :raises KeyError: if the ``id_token`` or ``access_token`` are missing
+        """
+        return cls(
+            data['id_token'], data['access_token'],
+            refresh_token=data.get('refresh_token'),
+            expires_in=data.get('expires_in'),
+            token_type=data.get('token_type'))
+
+    def identity(self, id_claims, refresh_token=None, claims=None):
+        """Build the user identity from the verified id token claims
+
+        :param dict id_claims: the verified ``id_token`` claims
+        :param str refresh_token: used if the response has none, cognito
+            only returns a new one when it rotates them
+        :param claims: keep only this claims and the
+            :data:`IDENTITY_CLAIMS`, by default all of them
+        :rtype: dict
+        """
+        if claims is None:
+            ret = dict(id_claims)
+        else:
+            ret = {k: id_claims[k] for k in claims if k in id_claims}
+            if 'exp' in id_claims:
+                ret['exp'] = id_claims['exp']
+        ret['refresh_token'] = self.refresh_token or refresh_token
+        return ret
+
+
+def identityChanges(old, new):
+    """Return the claims of ``new`` missing or different in ``old``
+
+    Claims of ``old`` missing in ``new`` are returned as ``None``.
+
+    :rtype: dict
+    """
+    changes = {}
+    for k, v in new.items():
+        if k not in old or old[k] != v:
+            changes[k] = v
+    for k in old:
+        if k not in new:
+            changes[k] = None
+    return changes
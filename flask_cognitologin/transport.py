@@ -0,0 +1,163 @@
+"""HTTP client for the cognito endpoints."""
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urlsplit
+from . import breaker as _breaker
+import requests
+import threading
+import os
+
+#: connections kept alive for each host
+DEFAULT_POOL_SIZE = 10
+#: seconds to wait for the connection to cognito
+DEFAULT_CONNECT_TIMEOUT = 3.05
+#: seconds to wait for the cognito response
+DEFAULT_READ_TIMEOUT = 10
+#: times a failed request is retried
+DEFAULT_RETRIES = 2
+#: backoff factor between retries, see :class:`urllib3.util.retry.Retry`
+DEFAULT_BACKOFF = 0.3
+
+
+class CircuitOpenError(_breaker.CircuitOpenError, requests.ConnectionError):
+    """The circuit of the host is open, see
+    :class:`~flask_cognitologin.breaker.CircuitBreaker`"""
+
+
+class CognitoClient(object):
+    """Pooled keep-alive HTTP client
+
+    All the threads share the same connection pool, each thread gets its own
+    :class:`requests.Session` mounted on it, so nothing mutable is shared
+    between threads. A process forked after the client was used (for
+    example by ``gunicorn --preload``) gets its own pool and sessions, the
+    keep-alive connections of the parent are never used.
+
+    Requests are retried with backoff if the connection fails, ``GET``
+    requests are also retried on read errors and ``5xx`` responses. A
+    ``POST`` to the token endpoint is never sent twice because an
+    authorization code can be used only once.
+
+    Requests are reported to ``metrics``, a
+    :class:`~flask_cognitologin.metrics.Metrics`, if it is set. With a
+    ``breaker``, a :class:`~flask_cognitologin.breaker.CircuitBreaker`,
+    requests to a failing host raise :class:`CircuitOpenError` without
+    being sent.
+    """
+
+    metrics = None
+    breaker = None
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+        retry = Retry(
+            total=retries, connect=retries, read=retries, status=retries,
+            backoff_factor=backoff,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False)
+        self.pool_size = pool_size
+        self.retry = retry
+        self.timeout = (connect_timeout, read_timeout)
+        self._lock = threading.Lock()
+        self._adapter = None
+        self._local = None
+        self._pid = None
+
+    @classmethod
+    def fromConfig(cls, config):
+        """Build a client from the ``COGNITO_HTTP_*`` keys of ``config``"""
+        return cls(
+            pool_size=config.get(
+                'COGNITO_HTTP_POOL_SIZE', DEFAULT_POOL_SIZE),
+            connect_timeout=config.get(
+                'COGNITO_HTTP_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT),
+            read_timeout=config.get(
+                'COGNITO_HTTP_READ_TIMEOUT', DEFAULT_READ_TIMEOUT),
+            retries=config.get('COGNITO_HTTP_RETRIES', DEFAULT_RETRIES),
+            backoff=config.get('COGNITO_HTTP_BACKOFF', DEFAULT_BACKOFF))
+
+    def _forProcess(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # never use the connections of the parent process
+                self._adapter = HTTPAdapter(
+                    pool_connections=self.pool_size,
+                    pool_maxsize=self.pool_size, max_retries=self.retry)
+                self._local = threading.local()
+                self._pid = os.getpid()
+
+    @property
+    def adapter(self):
+        """The connection pool of the current process
+
+        :rtype: requests.adapters.HTTPAdapter
+        """
+        if self._pid != os.getpid():
+            self._forProcess()
+        return self._adapter
+
+    @property
+    def session(self):
+        """The :class:`requests.Session` of the current thread"""
+        adapter = self.adapter
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._local.session = session
+        return session
+
+    def get(self, url, **kwargs):
+        return self._send(self.session.get, url, kwargs)
+
+    def post(self, url, **kwargs):
+        return self._send(self.session.post, url, kwargs)
+
+    def _send(self, send, url, kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        breaker = self.breaker
+        if breaker is None:
+            return self._measure(send, url, kwargs)
+
+        host = urlsplit(url).netloc
+        if not breaker.allow(host):
+            raise CircuitOpenError("Circuit open for %s" % host)
+        try:
+            r = self._measure(send, url, kwargs)
+        except Exception:
+            breaker.failure(host)
+            raise
+        if r.status_code >= 500:
+            breaker.failure(host)
+        else:
+            breaker.success(host)
+        return r
+
+    def _measure(self, send, url, kwargs):
+        metrics = self.metrics
+        start = metrics.start() if metrics is not None else None
+        if start is None:
+            return send(url, **kwargs)
+
+        path = urlsplit(url).path
+        try:
+            r = send(url, **kwargs)
+        except requests.RequestException as e:
+            metrics.observe('http_request', start, path=path, outcome='error')
+            metrics.count('upstream_error', path=path, error=type(e).__name__)
+            raise
+        if r.ok:
+            metrics.observe('http_request', start, path=path, outcome='ok')
+        else:
+            error = 'http_%d' % r.status_code
+            metrics.observe('http_request', start, path=path, outcome=error)
+            metrics.count('upstream_error', path=path, error=error)
+        return r
+
+    def close(self):
+        """Close all the pooled connections"""
+        self.adapter.close()
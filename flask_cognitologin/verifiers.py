@@ -0,0 +1,256 @@
+"""JWT signature and claims verification backends.
+
+A verifier parses the keys of a JWKS document once, see
+:meth:`~flask_cognitologin.jwks.JWKSCache.getKey`, and verifies tokens with
+them. Every backend checks the signature and the ``exp``, ``nbf``, ``iat``,
+``aud``, ``sub``, ``jti`` and ``at_hash`` claims like
+:func:`jose.jwt.decode` does and raises :class:`jose.exceptions.JWTError`,
+``tests/test_verifiers.py`` holds them to it.
+"""
+from jose.exceptions import JWTError, JWTClaimsError, ExpiredSignatureError
+import hashlib
+import base64
+import json
+import time
+
+
+def _b64decode(data):
+    if isinstance(data, str):
+        data = data.encode('ascii')
+    return base64.urlsafe_b64decode(data + b'=' * (-len(data) % 4))
+
+
+def _header(token):
+    try:
+        header = json.loads(_b64decode(token.split('.', 1)[0]))
+    except (AttributeError, TypeError, ValueError):
+        raise JWTError("Error decoding token headers.")
+    if not isinstance(header, dict):
+        raise JWTError("Invalid header string: must be a json object")
+    return header
+
+
+def atHash(access_token):
+    """Return the ``at_hash`` of ``access_token`` for a RS256 id token"""
+    digest = hashlib.sha256(access_token.encode('ascii')).digest()
+    return base64.urlsafe_b64encode(digest[:16]).rstrip(b'=').decode()
+
+
+def checkClaims(claims, audience=None, access_token=None, leeway=0):
+    """Check the registered claims of a token with a valid signature
+
+    :raises jose.exceptions.JWTError: if a claim is not valid
+    """
+    if not isinstance(claims, dict):
+        raise JWTError("Invalid payload string: must be a json object")
+    now = int(time.time())
+    for name in ('exp', 'nbf', 'iat'):
+        if name in claims:
+            try:
+                int(claims[name])
+            except (TypeError, ValueError):
+                raise JWTClaimsError("Claim (%s) must be an integer." % name)
+    if 'exp' in claims and int(claims['exp']) < now - leeway:
+        raise ExpiredSignatureError("Signature has expired.")
+    if 'nbf' in claims and int(claims['nbf']) > now + leeway:
+        raise JWTClaimsError("The token is not yet valid (nbf)")
+    if 'aud' in claims:
+        aud = claims['aud']
+        if isinstance(aud, str):
+            aud = [aud]
+        if not isinstance(aud, list) or \
+                any(not isinstance(a, str) for a in aud):
+            raise JWTClaimsError("Invalid claim format in token")
+        if audience not in aud:
+            raise JWTClaimsError("Invalid audience")
+    for name in ('sub', 'jti'):
+        if name in claims and not isinstance(claims[name], str):
+            raise JWTClaimsError("Claim (%s) must be a string." % name)
+    if 'at_hash' in claims:
+        if not access_token:
+            raise JWTClaimsError(
+                "No access_token provided to compare against at_hash claim.")
+        if claims['at_hash'] != atHash(access_token):
+            raise JWTClaimsError("at_hash claim does not match access_token.")
+
+
+class JoseVerifier(object):
+    """Verify with :func:`jose.jwt.decode`, any algorithm python-jose
+    supports"""
+
+    name = 'jose'
+
+    def parseKeys(self, keys):
+        from .jwks import parseKeys
+        return parseKeys(keys)
+
+    def header(self, token):
+        """Return the unverified header of ``token``"""
+        from jose import jwt
+
+        return jwt.get_unverified_header(token)
+
+    def decode(self, token, key, audience=None, access_token=None, leeway=0):
+        """Verify ``token`` with ``key`` and return its claims
+
+        :param key: a key returned by :meth:`parseKeys`
+        :param str audience: the expected ``aud``, if the token has one
+        :param str access_token: the access token issued with an id token
+        :param leeway: seconds of tolerance for ``exp`` and ``nbf``
+        :rtype: dict
+        :raises jose.exceptions.JWTError: if the token is not valid
+        """
+        from jose import jwt
+
+        return jwt.decode(
+            token, key, audience=audience, access_token=access_token,
+            options={'leeway': leeway})
+
+
+class CryptographyVerifier(JoseVerifier):
+    """Fast path for RS256 straight on :mod:`cryptography`
+
+    Keys of other types or algorithms are left out by :meth:`parseKeys`.
+    """
+
+    name = 'cryptography'
+
+    def __init__(self):
+        from cryptography.hazmat.primitives.asymmetric.padding import (
+            PKCS1v15)
+        from cryptography.hazmat.primitives.hashes import SHA256
+        from cryptography.exceptions import InvalidSignature
+
+        self._padding = PKCS1v15()
+        self._hash = SHA256()
+        self._invalid = InvalidSignature
+
+    def parseKeys(self, keys):
+        from cryptography.hazmat.primitives.asymmetric.rsa import (
+            RSAPublicNumbers)
+
+        parsed = dict()
+        for k in keys:
+            if k.get('kty') != 'RSA' or k.get('alg', 'RS256') != 'RS256':
+                continue
+            try:
+                parsed[k['kid']] = RSAPublicNumbers(
+                    int.from_bytes(_b64decode(k['e']), 'big'),
+                    int.from_bytes(_b64decode(k['n']), 'big')).public_key()
+            except Exception:
+                continue
+        return parsed
+
+    def header(self, token):
+        return _header(token)
+
+    def decode(self, token, key, audience=None, access_token=None, leeway=0):
+        try:
+            signing_input, signature = token.rsplit('.', 1)
+            header, payload = signing_input.split('.')
+            signature = _b64decode(signature)
+        except (AttributeError, TypeError, ValueError):
+            raise JWTError("Not enough segments")
+        if _header(token).get('alg') != 'RS256':
+            raise JWTError("The specified alg value is not allowed")
+        try:
+            key.verify(
+                signature, signing_input.encode('ascii'), self._padding,
+                self._hash)
+        except (self._invalid, ValueError):
+            raise JWTError("Signature verification failed.")
+        try:
+            claims = json.loads(_b64decode(payload))
+        except ValueError:
+            raise JWTError("Invalid payload string")
+        checkClaims(claims, audience, access_token, leeway)
+        return claims
+
+
+class PyJWTVerifier(JoseVerifier):
+    """Verify with PyJWT, RS256 only"""
+
+    name = 'pyjwt'
+
+    #: claims are checked by :func:`checkClaims`, like the other backends
+    OPTIONS = {
+        'verify_signature': True, 'verify_exp': False, 'verify_nbf': False,
+        'verify_iat': False, 'verify_aud': False, 'verify_iss': False,
+    }
+
+    def parseKeys(self, keys):
+        import jwt
+
+        parsed = dict()
+        for k in keys:
+            try:
+                parsed[k['kid']] = jwt.PyJWK(k, algorithm='RS256').key
+            except Exception:
+                continue
+        return parsed
+
+    def header(self, token):
+        return _header(token)
+
+    def decode(self, token, key, audience=None, access_token=None, leeway=0):
+        import jwt
+
+        try:
+            claims = jwt.api_jws.decode(
+                token, key, algorithms=['RS256'], options=self.OPTIONS)
+            claims = json.loads(claims)
+        except (jwt.PyJWTError, ValueError) as e:
+            raise JWTError(str(e))
+        checkClaims(claims, audience, access_token, leeway)
+        return claims
+
+
+# JWKs parsed by decodeGroup in the workers of a process pool
+_group_keys = {}
+
+
+def decodeGroup(verifier, key, tokens, audience=None, leeway=0):
+    """Verify tokens signed with the same key
+
+    ``key`` is a key parsed by ``verifier`` or, to run the call in a process
+    pool, the JWK itself, parsed once by each process.
+
+    :returns: a ``(claims, error)`` pair for each token
+    :rtype: list
+    """
+    if isinstance(key, dict):
+        jwk = key
+        cache_key = (verifier.name, jwk['kid'], jwk.get('n'), jwk.get('e'))
+        key = _group_keys.get(cache_key)
+        if key is None:
+            key = _group_keys[cache_key] = \
+                verifier.parseKeys([jwk])[jwk['kid']]
+    results = []
+    for token in tokens:
+        try:
+            results.append((verifier.decode(
+                token, key, audience=audience, leeway=leeway), None))
+        except JWTError as e:
+            results.append((None, e))
+    return results
+
+
+#: verifiers selectable by ``COGNITO_VERIFIER``
+VERIFIERS = {
+    'jose': JoseVerifier,
+    'cryptography': CryptographyVerifier,
+    'pyjwt': PyJWTVerifier,
+}
+
+
+def verifierFromConfig(config):
+    """Build the verifier selected by ``COGNITO_VERIFIER``
+
+    :raises ValueError: if the verifier is unknown
+    """
+    verifier = config.get('COGNITO_VERIFIER', 'jose')
+    if not isinstance(verifier, str):
+        return verifier
+    if verifier not in VERIFIERS:
+        raise ValueError("Unknown verifier: %s" % verifier)
+    return VERIFIERS[verifier]()
@@ -10,7 +10,15 @@ with open('README.rst') as readme_file:
 with open('HISTORY.rst') as history_file:
     history = history_file.read()
 
-requirements = ['Flask>=1.1.2', 'python-jose>=3.2.0', 'requests>=2.24.0']
+requirements = [
+    'Flask>=1.1.2', 'python-jose>=3.2.0', 'requests>=2.24.0',
+    'urllib3>=1.26.0']
+
+extras_requirements = {
+    'async': ['httpx>=0.18.0'],
+    'cryptography': ['cryptography>=3.2'],
+    'pyjwt': ['PyJWT[crypto]>=2.0.0'],
+}
 
 setup_requirements = ['pytest-runner', ]
 
@@ -32,6 +40,7 @@ setup(
     ],
     description="Flask-Login and AWS Cognito Integration",
     install_requires=requirements,
+    extras_require=extras_requirements,
     license="GNU General Public License v3",
     long_description=readme + '\n\n' + history,
     include_package_data=True,
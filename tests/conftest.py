@@ -1,7 +1,17 @@
 """pytest config for `flask_cognitologin` package."""
-from jose import jwt
+from flask_cognitologin.jwks import jwks_cache
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from jose import jwk, jwt
+from jose.utils import long_to_base64, calculate_at_hash
+import threading
+import hashlib
+import time
 import pytest
 import flask
+import json
 import os
 import requests
 import datetime
@@ -12,14 +22,26 @@ TEST_KEYS = {
             'alg': 'RS256', 'e': 'AQAB',
             'kid': 'key1',
             'kty': 'RSA',
-            'n': 'somevalue',
+            'n': (
+                '8Fwpq2s2oeS2YGg8opkmYczp-GjkeOorBNfU660_gFGI9JUS_c_7bwiwHNlr'
+                'FilzxppgfbTzZz4xnKmbBFe4YS9HFg0WbwMSnj2n1jBvfi8EI7M5kqzFbnY-'
+                'fLPBefBsnrB20YUrcBDGpP8mHaMcF4aes_lEMJ39nHMYsVB0yYVHsfNqRYIC'
+                'NXVS3yq4X67nedRabSIqIrS7Cg1CMEHczWm0rCCD0kwuFlIFALRAbYntn5R7'
+                '1Uz2VDjWJDg6OWNDrLWDHyMfs9VLyktURU7fVLEuLKNGk7FtgDwNLvfDOs_Z'
+                't7I6o7c-8ka_ckPlQ905BiG_4FM2W57vXhT2UsOmPw'),
             'use': 'sig'
         },
         {
             'alg': 'RS256', 'e': 'AQAB',
             'kid': 'key2',
             'kty': 'RSA',
-            'n': 'somevalue',
+            'n': (
+                'iNrD9ZJImQKRDBstHeiz285MUkbGBczD8wJz2uWnX9r8gw6GFliGtLbJklF5'
+                'xV4VtZQRdtv9nl167vMOWSiCl4iTv51qIynxuAYTTGsCDvkDuuJc38_d6mdC'
+                'fmA1eXUthqOIa_jdtswH3zG_raYrXXVZnE9W-xL8-q3d-eyf5tTe0LZ28uc1'
+                'wU3aFyG8IMpTdb6FXTzeDaWRrtxD9W4VaM2rRWcAO22D4owDfbVerv_giLre'
+                'aXfRGf0w8dHEMU15zByhZKVs-U535suPRJERxKJa8xYygUwwXFpNwzE_6C0r'
+                'rVuaZAXnnlvxYE2H-3dn-1CfTn08qAjJrn18cDwvQw'),
             'use': 'sig'
         }
     ]
@@ -52,6 +74,9 @@ def app(request):
 
 class JWKSResponse():
 
+    ok = True
+    status_code = 200
+
     @staticmethod
     def json():
         return TEST_KEYS
@@ -60,6 +85,7 @@ class JWKSResponse():
 class OAUTHResponse():
 
     ok = True
+    status_code = 200
 
     @staticmethod
     def json():
@@ -73,20 +99,27 @@ class OAUTHResponse():
 @pytest.fixture(autouse=True)
 def path_requests(monkeypatch):
 
-    def mock_get(*args, **kwargs):
-        if 'jwks.json' in args[0]:
+    def mock_get(session, url, *args, **kwargs):
+        if 'jwks.json' in url:
             return JWKSResponse()
 
         return None
 
-    def mock_post(*args, **kwargs):
-        if 'oauth2/token' in args[0]:
+    def mock_post(session, url, *args, **kwargs):
+        if 'oauth2/token' in url:
             return OAUTHResponse()
 
         return None
 
-    monkeypatch.setattr(requests, "get", mock_get)
-    monkeypatch.setattr(requests, "post", mock_post)
+    monkeypatch.setattr(requests.Session, "get", mock_get)
+    monkeypatch.setattr(requests.Session, "post", mock_post)
+
+
+@pytest.fixture(autouse=True)
+def clear_jwks_cache():
+    jwks_cache.clear()
+    yield
+    jwks_cache.clear()
 
 
 @pytest.fixture(params=["expired", "valid", "no-exp", "no-refresh"])
@@ -141,8 +174,67 @@ def ident(request):
     return data[request.param]
 
 
+#: app client of the tokens signed by :func:`makeToken`
+RSA_CLIENT_ID = 'rsa-client-id'
+RSA_ISSUER = 'https://cognito-idp.rsa-region.amazonaws.com/rsa-pool'
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers', 'real_jwt: verify real tokens, python-jose is not mocked')
+
+
+@pytest.fixture(scope='session')
+def rsa_keys():
+    """Two RSA keys, ``rsa-key-0`` and ``rsa-key-1``
+
+    :returns: the private keys, indexed by ``kid``, and the public JWKS
+        document
+    """
+    private, public = dict(), []
+    for i in range(2):
+        kid = 'rsa-key-%d' % i
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        private[kid] = jwk.construct(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()).decode(), 'RS256')
+        numbers = key.public_key().public_numbers()
+        public.append({
+            'alg': 'RS256', 'kty': 'RSA', 'use': 'sig', 'kid': kid,
+            'e': long_to_base64(numbers.e).decode(),
+            'n': long_to_base64(numbers.n).decode(),
+        })
+    return private, {'keys': public}
+
+
+def makeToken(private, kid, token_use='id', lifetime=3600, access_token=None,
+              **claims):
+    """Sign a cognito like token with the ``rsa_keys`` key ``kid``
+
+    An id token for ``access_token`` gets its ``at_hash`` claim.
+    """
+    now = int(time.time())
+    data = {
+        'sub': 'rsa-user', 'iss': RSA_ISSUER, 'token_use': token_use,
+        'iat': now, 'exp': now + lifetime, 'auth_time': now,
+    }
+    if token_use == 'id':
+        data['aud'] = RSA_CLIENT_ID
+    else:
+        data['client_id'] = RSA_CLIENT_ID
+        data['scope'] = 'openid'
+    if access_token is not None:
+        data['at_hash'] = calculate_at_hash(access_token, hashlib.sha256)
+    data.update(claims)
+    return jwt.encode(
+        data, private[kid], algorithm='RS256', headers={'kid': kid})
+
+
 @pytest.fixture(autouse=True)
-def path_jwt(monkeypatch):
+def path_jwt(request, monkeypatch):
+    if request.node.get_closest_marker('real_jwt') is not None:
+        return
 
     def header(token):
         return TEST_KEYS['keys'][0]
@@ -166,3 +258,45 @@ def path_jwt(monkeypatch):
 
     monkeypatch.setattr(jwt, 'get_unverified_header', header)
     monkeypatch.setattr(jwt, 'decode', decode)
+
+
+class _StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+
+    def _reply(self, data):
+        self.server.requests.append((self.command, self.path))
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply(TEST_KEYS)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self._reply(OAUTHResponse.json())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def cognito_stub(app):
+    """Local HTTP server playing cognito, ``app`` is configured to use it"""
+    server = _StubServer(('127.0.0.1', 0), _StubHandler)
+    server.requests = []
+    t = threading.Thread(target=server.serve_forever, args=(0.05,))
+    t.daemon = True
+    t.start()
+    url = server.url = 'http://127.0.0.1:%d' % server.server_address[1]
+    app.config['COGNITO_DOMAIN'] = url
+    app.config['COGNITO_ISSUER'] = url
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,64 @@
+from flask_cognitologin.cognitologin import CognitoLogin
+import asyncio
+import flask
+import pytest
+
+pytest.importorskip('httpx')
+
+
+def run(cl, coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            await cl.aio.aclose()
+
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize("csrf", ['somecode', 'othercode'])
+def test_getIdentityAsync(app, cognito_stub, csrf):
+    cl = CognitoLogin(app)
+    with app.test_request_context('/?state=somecode&code=somecode'):
+        flask.session['mycogext_csrf_state'] = csrf
+        info = run(cl, cl.getIdentityAsync())
+    if csrf == 'othercode':
+        assert info is None
+    else:
+        assert info['sub'] == '3ed0096e-6ebd-4879-8786-80b662df0b12'
+        assert info['refresh_token'] == 'fake-refresh-token'
+    if csrf == 'somecode':
+        assert cognito_stub.requests == [
+            ('POST', '/oauth2/token'), ('GET', '/.well-known/jwks.json')]
+    else:
+        # a forged state does not reach cognito
+        assert cognito_stub.requests == []
+
+
+def test_checkIdentityAsync(app, cognito_stub, ident):
+    cl = CognitoLogin(app)
+    with app.test_request_context('/'):
+        info = run(cl, cl.checkIdentityAsync(ident))
+    if ident['at_hash'] == 'expired':
+        assert info['at_hash'] == 'some-thing'
+    elif ident['at_hash'] == 'valid':
+        assert info['email'] == 'some@example.com'
+    else:
+        assert info is None
+
+
+def test_checkIdentityAsync_single_refresh(app, cognito_stub):
+    cl = CognitoLogin(app)
+    identity = {'exp': 1605033103, 'refresh_token': 'fake-refresh-token'}
+
+    async def many():
+        return await asyncio.gather(
+            *[cl.checkIdentityAsync(identity) for _ in range(10)])
+
+    with app.test_request_context('/'):
+        results = run(cl, many())
+        # the refreshed identity is shared with the sync path
+        assert cl.checkIdentity(identity)['at_hash'] == 'some-thing'
+    assert all(r['at_hash'] == 'some-thing' for r in results)
+    posts = [r for r in cognito_stub.requests if r[0] == 'POST']
+    assert len(posts) == 1
@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from flask_cognitologin import CognitoLogin
+from flask_cognitologin.verifiers import CryptographyVerifier
+from flask_cognitologin.revocation import RevocationList
+from jose.exceptions import JWTError
+import multiprocessing
+import pytest
+
+from .conftest import makeToken, RSA_CLIENT_ID as CLIENT_ID
+
+
+pytestmark = pytest.mark.real_jwt
+
+
+class CountingVerifier(CryptographyVerifier):
+
+    def __init__(self):
+        super(CountingVerifier, self).__init__()
+        self.decoded = []
+
+    def decode(self, token, *args, **kwargs):
+        self.decoded.append(token)
+        return super(CountingVerifier, self).decode(token, *args, **kwargs)
+
+
+@pytest.fixture
+def cl(app, rsa_keys):
+    app.config['COGNITO_CLIENT_ID'] = CLIENT_ID
+    app.config['COGNITO_VERIFIER'] = CountingVerifier()
+    cl = CognitoLogin(app)
+    cl.jwks_cache._store(cl.tenant.issuer, rsa_keys[1]['keys'])
+    return cl
+
+
+def tokens(rsa_keys, count=6):
+    return [
+        makeToken(rsa_keys[0], 'rsa-key-%d' % (i % 2), token_use='access',
+                  jti='token-%d' % i)
+        for i in range(count)]
+
+
+def test_verify_many(cl, rsa_keys):
+    good = tokens(rsa_keys)
+    expired = makeToken(rsa_keys[0], 'rsa-key-0', lifetime=-60)
+    stream = good + [expired, 'garbage', good[0], good[1]]
+    results = list(cl.verifyMany(iter(stream), batch_size=4))
+    assert [r[0] for r in results] == stream
+    assert [r[1]['jti'] for r in results[:6]] == [
+        'token-%d' % i for i in range(6)]
+    for token, claims, error in results[6:8]:
+        assert claims is None and isinstance(error, JWTError)
+    assert results[8][1]['jti'] == 'token-0'
+    # the repeated tokens came from the token cache
+    assert sorted(cl.app.config['COGNITO_VERIFIER'].decoded) == sorted(
+        good + [expired])
+
+
+def test_duplicates_in_batch(cl, rsa_keys):
+    token = tokens(rsa_keys, 1)[0]
+    results = list(cl.verifyMany([token] * 5))
+    assert all(r[1]['jti'] == 'token-0' for r in results)
+    assert results[0][1] is not results[1][1]
+    assert cl.app.config['COGNITO_VERIFIER'].decoded == [token]
+
+
+def test_unknown_kid(cl, rsa_keys):
+    private = dict(rsa_keys[0])
+    private['rotated'] = private['rsa-key-0']
+    token = makeToken(private, 'rotated')
+    [(_, claims, error)] = cl.verifyMany([token])
+    assert claims is None
+    assert 'Unknown key id' in str(error)
+
+
+def test_outside_app_context(cl, rsa_keys):
+    stream = tokens(rsa_keys)
+    with ThreadPoolExecutor(1) as executor:
+        results = executor.submit(lambda: list(cl.verifyMany(stream)))
+        results = results.result()
+    assert all(claims is not None for _, claims, _ in results)
+
+
+def test_thread_pool(cl, rsa_keys):
+    stream = tokens(rsa_keys, 10)
+    with ThreadPoolExecutor(4) as pool:
+        results = list(cl.verifyMany(stream, pool=pool))
+    assert [r[1]['jti'] for r in results] == [
+        'token-%d' % i for i in range(10)]
+
+
+def test_process_pool(app, rsa_keys):
+    app.config['COGNITO_CLIENT_ID'] = CLIENT_ID
+    app.config['COGNITO_VERIFIER'] = 'cryptography'
+    cl = CognitoLogin(app)
+    cl.jwks_cache._store(cl.tenant.issuer, rsa_keys[1]['keys'])
+    stream = tokens(rsa_keys) + ['garbage']
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(2, mp_context=context) as pool:
+        results = list(cl.verifyMany(stream, pool=pool))
+    assert [r[1]['jti'] for r in results[:6]] == [
+        'token-%d' % i for i in range(6)]
+    assert results[6][1] is None
+
+
+def test_revoked(cl, rsa_keys, app):
+    state = app.extensions['cognitologin']
+    state.revocations = RevocationList(lambda: ['token-1'])
+    state.revocations.load()
+    results = list(cl.verifyMany(tokens(rsa_keys, 2)))
+    assert results[0][2] is None
+    assert 'revoked' in str(results[1][2])
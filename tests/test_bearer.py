@@ -0,0 +1,126 @@
+from flask_cognitologin.cognitologin import CognitoLogin
+from jose import jwt
+import requests
+import flask
+import pytest
+import time
+
+
+@pytest.fixture
+def claims(monkeypatch):
+    data = {
+        'sub': '3ed0096e-6ebd-4879-8786-80b662df0b12',
+        'cognito:groups': ['SomeGroup'],
+        'iss': 'https://cognito-idp.some-region.amazonaws.com/some-pool-id',
+        'client_id': 'myclient-id',
+        'token_use': 'access',
+        'scope': 'openid orders/read',
+        'exp': int(time.time()) + 3600,
+    }
+    monkeypatch.setattr(jwt, 'decode', lambda *a, **kw: dict(data))
+    return data
+
+
+@pytest.fixture
+def api(app, claims):
+    cl = CognitoLogin(app)
+
+    @app.route('/orders')
+    @cl.requireToken(scopes=['orders/read'])
+    def orders():
+        return flask.g.cognito_claims['sub']
+
+    @app.route('/admin')
+    @cl.requireToken(scopes=['orders/write'], groups=['Admins'])
+    def admin():
+        return 'ok'
+
+    bp = flask.Blueprint('private', __name__)
+
+    @bp.route('/private')
+    def private():
+        return 'ok'
+
+    cl.protect(bp, groups=['SomeGroup', 'Admins'])
+    app.register_blueprint(bp)
+    return app.test_client()
+
+
+def bearer(token='some-token'):
+    return {'Authorization': 'Bearer %s' % token}
+
+
+def test_require_token(api, claims):
+    r = api.get('/orders', headers=bearer())
+    assert r.status_code == 200
+    assert r.get_data(as_text=True) == claims['sub']
+
+
+def test_missing_token(api):
+    r = api.get('/orders')
+    assert r.status_code == 401
+    assert r.headers['WWW-Authenticate'].startswith('Bearer')
+    assert api.get('/private').status_code == 401
+
+
+@pytest.mark.parametrize("claim,value", [
+    ('token_use', 'id'),
+    ('client_id', 'other-client'),
+    ('iss', 'https://some-idp.com')])
+def test_invalid_token(api, claims, claim, value):
+    claims[claim] = value
+    r = api.get('/orders', headers=bearer())
+    assert r.status_code == 401
+    assert 'invalid_token' in r.headers['WWW-Authenticate']
+
+
+def test_scopes_and_groups(api, claims):
+    r = api.get('/admin', headers=bearer())
+    assert r.status_code == 403
+    assert 'insufficient_scope' in r.headers['WWW-Authenticate']
+    claims['scope'] += ' orders/write'
+    assert api.get('/admin', headers=bearer('other')).status_code == 403
+    claims['cognito:groups'] = ['Admins']
+    assert api.get('/admin', headers=bearer('another')).status_code == 200
+
+
+def test_protect(api, claims):
+    assert api.get('/private', headers=bearer()).status_code == 200
+    claims['cognito:groups'] = ['Guests']
+    assert api.get('/private', headers=bearer('other')).status_code == 403
+
+
+def test_require_permission(app, claims):
+    app.config['COGNITO_PERMISSIONS'] = {
+        'groups': {'SomeGroup': ['orders:read']},
+        'scopes': {'orders/write': ['orders:write']},
+    }
+    cl = CognitoLogin(app)
+
+    @app.route('/write')
+    @cl.requireToken(permissions=['orders:write'])
+    def write():
+        return 'ok'
+
+    @app.route('/read')
+    @cl.requireToken(permissions=['orders:read'])
+    def read():
+        assert cl.hasPermission('orders:read')
+        assert not cl.hasPermission('orders:write')
+        return 'ok'
+
+    client = app.test_client()
+    assert client.get('/read', headers=bearer()).status_code == 200
+    assert client.get('/write', headers=bearer()).status_code == 403
+    claims['scope'] += ' orders/write'
+    r = client.get('/write', headers=bearer('other-token'))
+    assert r.status_code == 200
+
+
+def test_keys_unavailable(api, monkeypatch):
+    def mock_get(session, url, *args, **kwargs):
+        raise requests.ConnectionError()
+
+    monkeypatch.setattr(requests.Session, 'get', mock_get)
+    r = api.get('/orders', headers=bearer())
+    assert r.status_code == 503
@@ -0,0 +1,157 @@
+from flask_cognitologin.breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from flask_cognitologin.transport import CognitoClient, CircuitOpenError
+from flask_cognitologin.cognitologin import CognitoLogin
+from flask_cognitologin.jwks import JWKSCache
+from jose import jwt
+import requests
+import pytest
+import time
+
+from .conftest import TEST_KEYS
+
+
+def test_breaker_opens_and_closes(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    breaker = CircuitBreaker(threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.failure('host')
+    assert breaker.allow('host')
+    breaker.success('host')
+    for _ in range(3):
+        breaker.failure('host')
+    assert breaker.states() == {'host': OPEN}
+    assert not breaker.allow('host')
+    assert breaker.allow('other')
+
+    now[0] += 30
+    # one trial request, the others keep failing fast
+    assert breaker.allow('host')
+    assert not breaker.allow('host')
+    assert breaker.states() == {'host': HALF_OPEN}
+    breaker.failure('host')
+    assert breaker.states() == {'host': OPEN}
+
+    now[0] += 30
+    assert breaker.allow('host')
+    breaker.success('host')
+    assert breaker.states() == {'host': CLOSED}
+    assert breaker.allow('host')
+
+
+def test_disabled_breaker():
+    breaker = CircuitBreaker(threshold=0)
+    for _ in range(10):
+        breaker.failure('host')
+    assert breaker.allow('host')
+
+
+def test_client_fails_fast(monkeypatch):
+    calls = []
+
+    def mock_get(session, url, *args, **kwargs):
+        calls.append(url)
+        raise requests.ConnectTimeout()
+
+    monkeypatch.setattr(requests.Session, 'get', mock_get)
+    client = CognitoClient(retries=0)
+    client.breaker = CircuitBreaker(threshold=2)
+    for _ in range(2):
+        with pytest.raises(requests.ConnectTimeout):
+            client.get('https://cognito/.well-known/jwks.json')
+    with pytest.raises(CircuitOpenError):
+        client.get('https://cognito/.well-known/jwks.json')
+    # handled like any other connection error
+    with pytest.raises(requests.RequestException):
+        client.get('https://cognito/oauth2/token')
+    assert len(calls) == 2
+
+
+class ServerError(object):
+    ok = False
+    status_code = 503
+
+
+@pytest.mark.parametrize('grace,kept', [(0, False), (600, True)])
+def test_checkIdentity_grace(app, monkeypatch, grace, kept):
+    app.config['COGNITO_REFRESH_GRACE'] = grace
+    app.config['COGNITO_REFRESH_CACHE_TTL'] = 0
+    monkeypatch.setattr(
+        requests.Session, 'post', lambda *args, **kwargs: ServerError())
+    cl = CognitoLogin(app)
+    expired = {
+        'exp': int(time.time()) - 60, 'refresh_token': 'fake-refresh-token'}
+    expiring = dict(expired, exp=int(time.time()) + 30)
+    with app.test_request_context('/'):
+        # not expired yet, kept while cognito is down
+        assert cl.checkIdentity(expiring) is expiring
+        assert (cl.checkIdentity(expired) is expired) == kept
+        assert cl.health()['refresh'] == 'failing'
+        assert cl.health()['status'] == 'degraded'
+
+
+def test_refused_refresh_has_no_grace(app, monkeypatch):
+    app.config['COGNITO_REFRESH_GRACE'] = 600
+
+    class Refused(object):
+        ok = False
+        status_code = 400
+
+    monkeypatch.setattr(
+        requests.Session, 'post', lambda *args, **kwargs: Refused())
+    cl = CognitoLogin(app)
+    identity = {
+        'exp': int(time.time()) - 60, 'refresh_token': 'fake-refresh-token'}
+    with app.test_request_context('/'):
+        assert cl.checkIdentity(identity) is None
+        assert cl.health()['status'] == 'ok'
+
+
+def test_stale_keys_while_error():
+    fetches = []
+
+    class Failing(object):
+
+        @staticmethod
+        def get(url):
+            fetches.append(url)
+            raise requests.ConnectionError()
+
+    cache = JWKSCache()
+    cache._store('https://issuer', TEST_KEYS['keys'])
+    cache._entries['https://issuer'].fetched_at -= 100
+    assert cache.getKey('https://issuer', 'key1', ttl=10, http=Failing)
+    for _ in range(100):
+        if cache.status()['https://issuer']['stale']:
+            break
+        time.sleep(0.01)
+    assert cache.status()['https://issuer']['stale']
+    # not retried on every lookup
+    assert cache.getKey('https://issuer', 'key1', ttl=10, http=Failing)
+    assert len(fetches) == 1
+
+
+def test_unknown_kid_while_cognito_down(app, monkeypatch):
+    cl = CognitoLogin(app)
+    with app.test_request_context('/'):
+        cl._getKey('key1')
+
+        def mock_get(session, url, *args, **kwargs):
+            raise requests.ConnectionError()
+
+        monkeypatch.setattr(requests.Session, 'get', mock_get)
+        with pytest.raises(jwt.JWTError):
+            cl._getKey('rotated-key')
+        assert cl._getKey('key1') is not None
+
+
+def test_health_endpoint(app):
+    app.config['COGNITO_HEALTH_PATH'] = '/health'
+    cl = CognitoLogin(app)
+    with app.test_request_context('/'):
+        cl._getKey('key1')
+    r = app.test_client().get('/health')
+    assert r.status_code == 200
+    assert r.get_json()['status'] == 'ok'
+    assert r.get_json()['refresh'] == 'ok'
+    assert list(r.get_json()['jwks']) == [cl.tenant.issuer]
@@ -0,0 +1,89 @@
+from flask_cognitologin.cache import SingleFlight, TokenCache
+from flask_cognitologin.cognitologin import CognitoLogin
+from jose import jwt
+import threading
+import pytest
+import time
+
+
+def test_single_flight_shares_call():
+    sf = SingleFlight()
+    calls = []
+    barrier = threading.Barrier(5)
+    results = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.1)
+        return 'value'
+
+    def worker():
+        barrier.wait()
+        results.append(sf.do('key', slow))
+
+    threads = [threading.Thread(target=worker) for _ in range(5)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert results == ['value'] * 5
+    assert len(calls) == 1
+    # no ttl, nothing is kept
+    sf.do('key', slow)
+    assert len(calls) == 2
+
+
+def test_single_flight_keeps_results():
+    sf = SingleFlight(ttl=60)
+    assert sf.do('key', lambda: 'first') == 'first'
+    assert sf.do('key', lambda: 'second') == 'first'
+    assert sf.do('other', lambda: None) is None
+    assert sf.do('other', lambda: 'second') == 'second'
+
+
+def test_single_flight_errors_are_not_kept():
+    sf = SingleFlight(ttl=60)
+
+    def fail():
+        raise RuntimeError()
+
+    with pytest.raises(RuntimeError):
+        sf.do('key', fail)
+    assert sf.do('key', lambda: 'value') == 'value'
+
+
+def test_token_cache():
+    cache = TokenCache(size=2)
+    key = cache.key('token', None)
+    assert key != cache.key('token', 'access-token')
+    assert cache.get(key) is None
+    cache.set(key, {'exp': time.time() + 60, 'sub': 'someuser'})
+    assert cache.get(key)['sub'] == 'someuser'
+    cache.set(cache.key('other'), {'exp': time.time() + 60})
+    cache.set(cache.key('another'), {'exp': time.time() + 60})
+    assert cache.get(key) is None
+    assert len(cache) == 2
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 2
+
+
+def test_token_cache_expires():
+    cache = TokenCache()
+    cache.set(cache.key('token'), {'exp': time.time() - 1})
+    assert cache.get(cache.key('token')) is None
+    cache.set(cache.key('token'), {'sub': 'no-exp'})
+    assert len(cache) == 0
+
+
+def test_verify_uses_cache(app, monkeypatch):
+    decoded = []
+
+    def decode(*args, **kwargs):
+        decoded.append(args[0])
+        return {'exp': time.time() + 60, 'sub': 'someuser'}
+
+    monkeypatch.setattr(jwt, 'decode', decode)
+    cl = CognitoLogin(app)
+    assert cl._verify('some-token')['sub'] == 'someuser'
+    assert cl._verify('some-token')['sub'] == 'someuser'
+    assert cl._verify('some-token', access_token='x')['sub'] == 'someuser'
+    assert decoded == ['some-token', 'some-token']
+    assert cl.tokenCache.stats()['hits'] == 1
@@ -0,0 +1,102 @@
+from flask_cognitologin.cognitologin import CognitoLogin
+import threading
+import requests
+import pytest
+import time
+
+
+class TokenEndpoint(object):
+
+    def __init__(self):
+        self.grants = []
+        self.expires_in = 3600
+        self.ok = True
+
+    @property
+    def status_code(self):
+        return 200 if self.ok else 400
+
+    def post(self, session, url, **kwargs):
+        self.grants.append(kwargs['data'])
+        time.sleep(0.05)
+        return self
+
+    def json(self):
+        return {
+            'access_token': 'service-token-%d' % len(self.grants),
+            'expires_in': self.expires_in, 'token_type': 'Bearer'}
+
+
+@pytest.fixture
+def endpoint(monkeypatch):
+    endpoint = TokenEndpoint()
+    monkeypatch.setattr(
+        requests.Session, 'post',
+        lambda session, url, **kwargs: endpoint.post(session, url, **kwargs))
+    return endpoint
+
+
+def test_cached_per_scope_set(app, endpoint):
+    cl = CognitoLogin(app)
+    assert cl.getServiceToken(['b', 'a']) == 'service-token-1'
+    assert cl.getServiceToken(('a', 'b')) == 'service-token-1'
+    assert cl.getServiceToken() == 'service-token-2'
+    assert endpoint.grants[0] == {
+        'grant_type': 'client_credentials', 'client_id': 'myclient-id',
+        'scope': 'a b'}
+    assert 'scope' not in endpoint.grants[1]
+
+
+def test_concurrent_callers_share_the_grant(app, endpoint):
+    cl = CognitoLogin(app)
+    barrier = threading.Barrier(8)
+    tokens = []
+
+    def worker():
+        with app.app_context():
+            barrier.wait()
+            tokens.append(cl.getServiceToken(['a']))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert tokens == ['service-token-1'] * 8
+    assert len(endpoint.grants) == 1
+
+
+def test_renewed_in_background(app, endpoint):
+    app.config['COGNITO_CLOCK_SKEW'] = 0
+    endpoint.expires_in = 0.4
+    cl = CognitoLogin(app)
+    assert cl.getServiceToken() == 'service-token-1'
+    time.sleep(0.25)
+    # past half its lifetime, still valid: no waiting for the new one
+    start = time.monotonic()
+    assert cl.getServiceToken() == 'service-token-1'
+    assert time.monotonic() - start < 0.05
+    for _ in range(50):
+        if cl.getServiceToken() == 'service-token-2':
+            break
+        time.sleep(0.01)
+    assert cl.getServiceToken() == 'service-token-2'
+    assert len(endpoint.grants) == 2
+
+
+def test_expired_token_fetched_again(app, endpoint):
+    # tokens expiring within the clock skew are not used
+    app.config['COGNITO_CLOCK_SKEW'] = 5
+    endpoint.expires_in = 4
+    cl = CognitoLogin(app)
+    assert cl.getServiceToken() == 'service-token-1'
+    assert cl.getServiceToken() == 'service-token-2'
+
+
+def test_refused_grant(app, endpoint):
+    endpoint.ok = False
+    outcomes = []
+    cl = CognitoLogin(app)
+    cl.metrics.connect(
+        lambda kind, name, value, labels: outcomes.append(labels['outcome'])
+        if name == 'service_token' else None)
+    assert cl.getServiceToken() is None
+    assert outcomes == ['failed']
@@ -1,6 +1,10 @@
 from flask_cognitologin.cognitologin import CognitoLogin
+from urllib.parse import quote, urlsplit, parse_qs
+import threading
+import requests
 import flask
 import pytest
+import time
 
 
 @pytest.mark.xfail(raises=ValueError, strict=True)
@@ -20,17 +24,38 @@ def test_getSignInUrl(app):
     with app.test_request_context():
         cl = CognitoLogin(app)
         lurl = cl.getSignInUrl()
-        assert app.config['COGNITO_CALLBACK_URL'] in lurl
+        assert quote(app.config['COGNITO_CALLBACK_URL'], safe='') in lurl
         t = "/".join([app.config['COGNITO_DOMAIN'], 'login'])
         assert t in lurl
 
 
+def test_getSignInUrl_params(app):
+    app.config['COGNITO_SCOPE'] = ['openid', 'email']
+    with app.test_request_context():
+        cl = CognitoLogin(app)
+        url = urlsplit(cl.getSignInUrl())
+        query = parse_qs(url.query)
+        assert url.path == '/login'
+        assert query['scope'] == ['openid email']
+        assert query['state'] == [flask.session['mycogext_csrf_state']]
+
+        url = urlsplit(cl.getSignInUrl(identity_provider='Google'))
+        query = parse_qs(url.query)
+        assert url.path == '/oauth2/authorize'
+        assert query['identity_provider'] == ['Google']
+        assert query['scope'] == ['openid email']
+
+        query = parse_qs(urlsplit(cl.getSignInUrl(scope='openid')).query)
+        assert query['scope'] == ['openid']
+        assert query['redirect_uri'] == [app.config['COGNITO_CALLBACK_URL']]
+
+
 def test_getLogOutUrl(app):
     with app.test_request_context():
         cl = CognitoLogin(app)
         lurl = cl.getLogOutUrl()
         t = "/".join([app.config['COGNITO_DOMAIN'], 'logout'])
-        assert app.config['COGNITO_CALLBACK_URL'] in lurl
+        assert quote(app.config['COGNITO_CALLBACK_URL'], safe='') in lurl
         assert t in lurl
 
 
@@ -48,6 +73,23 @@ def test_getIdentity(app, csrf):
             assert info['email'] == 'some@example.com'
 
 
+@pytest.mark.parametrize("query", ['code=somecode', 'state=&code=somecode'])
+def test_getIdentity_without_state(app, query):
+    # a forged callback in a browser that never started a sign in
+    with app.test_request_context('/?' + query):
+        cl = CognitoLogin(app)
+        assert cl.getIdentity() is None
+
+
+def test_getIdentity_state_used_once(app):
+    with app.test_request_context('/?state=somecode&code=somecode'):
+        flask.session['mycogext_csrf_state'] = 'somecode'
+        cl = CognitoLogin(app)
+        assert cl.getIdentity() is not None
+        assert 'mycogext_csrf_state' not in flask.session
+        assert cl.getIdentity() is None
+
+
 def test_checkIdentity(app, ident):
     with app.test_request_context('/'):
         cl = CognitoLogin(app)
@@ -58,3 +100,97 @@ def test_checkIdentity(app, ident):
             assert info['email'] == 'some@example.com'
         else:
             assert info is None
+
+
+def test_checkIdentity_single_refresh(app, monkeypatch):
+    posts = []
+    post = requests.Session.post
+
+    def mock_post(session, url, *args, **kwargs):
+        posts.append(url)
+        time.sleep(0.1)
+        return post(session, url, *args, **kwargs)
+
+    monkeypatch.setattr(requests.Session, 'post', mock_post)
+    cl = CognitoLogin(app)
+    identity = {'exp': 1605033103, 'refresh_token': 'fake-refresh-token'}
+    barrier = threading.Barrier(10)
+    results = []
+
+    def worker():
+        with app.test_request_context('/'):
+            barrier.wait()
+            results.append(cl.checkIdentity(identity))
+
+    threads = [threading.Thread(target=worker) for _ in range(10)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert len(posts) == 1
+    assert len(results) == 10
+    assert all(r['sub'] == '3ed0096e-6ebd-4879-8786-80b662df0b12'
+               for r in results)
+
+    # a request arriving right after reuses the fresh identity
+    with app.test_request_context('/'):
+        assert cl.checkIdentity(identity)['at_hash'] == 'some-thing'
+    assert len(posts) == 1
+
+
+@pytest.mark.parametrize("remaining", [30, 120])
+def test_checkIdentity_refresh_window(app, remaining):
+    app.config['COGNITO_REFRESH_WINDOW'] = 60
+    cl = CognitoLogin(app)
+    identity = {
+        'exp': int(time.time()) + remaining,
+        'refresh_token': 'fake-refresh-token'}
+    with app.test_request_context('/'):
+        info = cl.checkIdentity(identity)
+    if remaining < 60:
+        assert info['at_hash'] == 'some-thing'
+    else:
+        assert info is identity
+
+
+def test_checkIdentity_async_refresh(app):
+    app.config['COGNITO_REFRESH_ASYNC'] = True
+    cl = CognitoLogin(app)
+    identity = {
+        'exp': int(time.time()) + 30,
+        'refresh_token': 'fake-refresh-token'}
+    with app.test_request_context('/'):
+        assert cl.checkIdentity(identity) is identity
+        for _ in range(100):
+            info = cl.checkIdentity(identity)
+            if info is not identity:
+                break
+            time.sleep(0.01)
+        assert info['at_hash'] == 'some-thing'
+        # expired identities are still refreshed in the request
+        identity['exp'] = 1605033103
+        identity['refresh_token'] = 'other-refresh-token'
+        assert cl.checkIdentity(identity)['at_hash'] == 'some-thing'
+
+
+def test_checkIdentityChanges(app):
+    app.config['COGNITO_IDENTITY_CLAIMS'] = ['sub', 'email']
+    cl = CognitoLogin(app)
+    rotated = []
+    cl.metrics.connect(
+        lambda kind, name, value, labels: rotated.append(name)
+        if name == 'refresh_token_rotated' else None)
+    fresh = {'exp': int(time.time()) + 3600, 'refresh_token': 'rt'}
+    with app.test_request_context('/'):
+        assert cl.checkIdentityChanges(fresh) == (fresh, {})
+        assert cl.checkIdentityChanges({'exp': 0}) == (None, None)
+
+        identity = {
+            'sub': '3ed0096e-6ebd-4879-8786-80b662df0b12',
+            'email': 'some@example.com', 'name': 'Jhon Doe',
+            'exp': 1605032000, 'refresh_token': 'old-refresh-token'}
+        info, changes = cl.checkIdentityChanges(identity)
+    # compact identity, cognito rotated the refresh token
+    assert set(info) == {'sub', 'email', 'exp', 'refresh_token'}
+    assert changes == {
+        'exp': 1605033103, 'refresh_token': 'fake-refresh-token',
+        'name': None}
+    assert rotated == ['refresh_token_rotated']
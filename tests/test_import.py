@@ -0,0 +1,7 @@
+from benchmarks.bench_import import measure, HEAVY_MODULES, IMPORT_BUDGET
+
+
+def test_import_budget():
+    import_time, init_time, modules = measure()
+    assert not set(HEAVY_MODULES) & modules
+    assert import_time < IMPORT_BUDGET
@@ -0,0 +1,91 @@
+from flask_cognitologin.cognitologin import CognitoLogin
+from flask_cognitologin.jwks import JWKSCache
+from jose import jwt
+import requests
+import pytest
+import time
+
+from .conftest import TEST_KEYS
+
+
+class CountingCache(JWKSCache):
+
+    def __init__(self, keys):
+        super(CountingCache, self).__init__()
+        self.keys = keys
+        self.calls = 0
+
+    def fetch(self, issuer, http=None):
+        self.calls += 1
+        return list(self.keys)
+
+
+def test_keys_are_shared():
+    cache = CountingCache([{'kid': 'key1'}])
+    assert cache.get('https://issuer')[0]['kid'] == 'key1'
+    assert cache.get('https://issuer')[0]['kid'] == 'key1'
+    cache.get('https://other-issuer')
+    assert cache.calls == 2
+
+
+def test_stale_keys_refresh_in_background():
+    cache = CountingCache([{'kid': 'key1'}])
+    cache.get('https://issuer')
+    cache.keys = [{'kid': 'key2'}]
+    # stale keys are served while the refresh happens
+    assert cache.get('https://issuer', ttl=-1)[0]['kid'] == 'key1'
+    for _ in range(100):
+        if cache.get('https://issuer')[0]['kid'] == 'key2':
+            break
+        time.sleep(0.01)
+    assert cache.get('https://issuer')[0]['kid'] == 'key2'
+    assert cache.calls == 2
+
+
+def test_refetch_is_rate_limited():
+    cache = CountingCache([{'kid': 'key1'}])
+    assert cache.refetch('https://issuer', min_interval=60)
+    assert not cache.refetch('https://issuer', min_interval=60)
+    assert cache.calls == 1
+
+
+def test_keys_are_parsed_once():
+    cache = CountingCache([{'kid': 'key1'}])
+    assert cache.getKey('https://issuer', 'key1') is None
+    cache = JWKSCache()
+    cache.fetch = lambda *a, **kw: TEST_KEYS['keys']
+    key = cache.getKey('https://issuer', 'key1')
+    assert key is cache.getKey('https://issuer', 'key1')
+    assert key.to_dict()['n'] == TEST_KEYS['keys'][0]['n']
+
+
+def test_preload(app, monkeypatch):
+    calls = []
+    get = requests.Session.get
+
+    def mock_get(session, url, *args, **kwargs):
+        calls.append(url)
+        return get(session, url, *args, **kwargs)
+
+    monkeypatch.setattr(requests.Session, 'get', mock_get)
+    app.config['COGNITO_JWKS_PRELOAD'] = True
+    cl = CognitoLogin(app)
+    assert len(calls) == 1
+    assert cl.JWKS[0]['kid'] == 'key1'
+    assert len(calls) == 1
+
+
+def test_unknown_kid_refetch(app, monkeypatch):
+    cl = CognitoLogin(app)
+    assert cl._getKey('key2').to_dict()['kty'] == 'RSA'
+
+    fetchs = []
+    fetch = cl.jwks_cache.fetch
+    monkeypatch.setattr(
+        cl.jwks_cache, 'fetch',
+        lambda *a, **kw: fetchs.append(a) or fetch(*a, **kw))
+    with pytest.raises(jwt.JWTError):
+        cl._getKey('rotated-key')
+    with pytest.raises(jwt.JWTError):
+        cl._getKey('rotated-key')
+    assert len(fetchs) == 1
@@ -0,0 +1,55 @@
+from flask_cognitologin.cognitologin import CognitoLogin
+from flask_cognitologin.metrics import Metrics, PrometheusExporter
+import flask
+
+
+def test_disabled_metrics():
+    metrics = Metrics()
+    assert metrics.start() is None
+    metrics.observe('verify', None)
+    metrics.count('refresh')
+
+
+def test_listener(app):
+    events = []
+    cl = CognitoLogin(app)
+    cl.metrics.connect(lambda *event: events.append(event))
+    with app.test_request_context('/?state=somecode&code=somecode'):
+        flask.session['mycogext_csrf_state'] = 'somecode'
+        assert cl.getIdentity() is not None
+        flask.session['mycogext_csrf_state'] = 'othercode'
+        assert cl.getIdentity() is None
+        cl.checkIdentity({'exp': 0, 'refresh_token': 'some-refresh-token'})
+
+    names = [(e[0], e[1]) for e in events]
+    assert ('timing', 'http_request') in names
+    assert ('timing', 'verify') in names
+    assert ('count', 'token_cache') in names
+    assert ('count', 'csrf_mismatch') in names
+    assert ('count', 'refresh') in names
+    requests = [e for e in events if e[1] == 'http_request']
+    assert requests[0][3] == {'path': '/oauth2/token', 'outcome': 'ok'}
+
+
+def test_prometheus_exporter():
+    exporter = PrometheusExporter(buckets=(0.1, 1))
+    exporter('timing', 'verify', 0.05, {})
+    exporter('timing', 'verify', 0.5, {})
+    exporter('count', 'refresh', 1, {'outcome': 'ok'})
+    exporter('count', 'refresh', 1, {'outcome': 'ok'})
+    text = exporter.render()
+    assert '# TYPE cognito_verify_seconds histogram' in text
+    assert 'cognito_verify_seconds_bucket{le="0.1"} 1' in text
+    assert 'cognito_verify_seconds_bucket{le="+Inf"} 2' in text
+    assert 'cognito_verify_seconds_count 2' in text
+    assert 'cognito_refresh_total{outcome="ok"} 2' in text
+
+
+def test_metrics_endpoint(app):
+    app.config['COGNITO_METRICS_PATH'] = '/metrics'
+    cl = CognitoLogin(app)
+    cl.metrics.count('csrf_mismatch')
+    r = app.test_client().get('/metrics')
+    assert r.status_code == 200
+    assert r.mimetype == 'text/plain'
+    assert 'cognito_csrf_mismatch_total 1' in r.get_data(as_text=True)
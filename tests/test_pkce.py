@@ -0,0 +1,96 @@
+from flask_cognitologin.cognitologin import CognitoLogin
+from flask_cognitologin.pkce import StateSigner, codeChallenge
+from urllib.parse import urlsplit, parse_qs
+import requests
+import hashlib
+import base64
+import flask
+import pytest
+import time
+
+
+@pytest.fixture
+def posts(monkeypatch):
+    data = []
+    post = requests.Session.post
+
+    def mock_post(session, url, *args, **kwargs):
+        data.append(kwargs['data'])
+        return post(session, url, *args, **kwargs)
+
+    monkeypatch.setattr(requests.Session, 'post', mock_post)
+    return data
+
+
+def signInQuery(cl):
+    return dict((k, v[0]) for k, v in parse_qs(
+        urlsplit(cl.getSignInUrl()).query).items())
+
+
+def test_code_challenge():
+    verifier = 'some-verifier'
+    digest = hashlib.sha256(verifier.encode()).digest()
+    assert codeChallenge(verifier) == \
+        base64.urlsafe_b64encode(digest).decode().rstrip('=')
+
+
+def test_signed_state(monkeypatch):
+    signer = StateSigner('some-secret', max_age=60)
+    state = signer.sign(b'acme')
+    assert signer.verify(state, b'acme') is not None
+    assert signer.verify(state, b'globex') is None
+    assert signer.verify(state[:-2] + 'AA', b'acme') is None
+    assert signer.verify('garbage', b'acme') is None
+    assert signer.verify(None) is None
+    assert StateSigner('other-secret').verify(state, b'acme') is None
+
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 61)
+    assert signer.verify(state, b'acme') is None
+
+
+def test_state_needs_secret():
+    with pytest.raises(ValueError):
+        StateSigner(None)
+
+
+def test_stateless_pkce_refused(app):
+    app.config['COGNITO_PKCE'] = True
+    app.config['COGNITO_STATELESS_STATE'] = True
+    with pytest.raises(ValueError):
+        CognitoLogin(app)
+
+
+def test_stateless_state(app, posts):
+    app.config['COGNITO_STATELESS_STATE'] = True
+    cl = CognitoLogin(app)
+    with app.test_request_context():
+        query = signInQuery(cl)
+        assert not flask.session.modified
+    assert 'code_challenge' not in query
+
+    url = '/?code=somecode&state=%s' % query['state']
+    with app.test_request_context(url):
+        assert cl.getIdentity() is not None
+        assert not flask.session.modified
+    assert 'code_verifier' not in posts[0]
+
+    with app.test_request_context('/?code=somecode&state=forged'):
+        assert cl.getIdentity() is None
+    assert len(posts) == 1
+
+
+def test_session_pkce(app, posts):
+    app.config['COGNITO_PKCE'] = True
+    cl = CognitoLogin(app)
+    with app.test_request_context():
+        query = signInQuery(cl)
+        stored = dict(flask.session)
+
+    url = '/?code=somecode&state=%s' % query['state']
+    with app.test_request_context(url):
+        flask.session.update(stored)
+        assert cl.getIdentity() is not None
+        assert 'mycogext_code_verifier' not in flask.session
+    assert codeChallenge(posts[0]['code_verifier']) == \
+        query['code_challenge']
@@ -0,0 +1,56 @@
+from flask_cognitologin.policy import Policy
+from flask_cognitologin.cognitologin import CognitoLogin
+import pytest
+
+POLICY = {
+    'groups': {
+        'Admins': ['orders:read', 'orders:write'],
+        'Sales': ['orders:read'],
+    },
+    'scopes': {'reports/read': ['reports:read']},
+}
+
+
+def test_permissions():
+    policy = Policy.fromConfig({'COGNITO_PERMISSIONS': POLICY})
+    claims = {'cognito:groups': ['Sales'], 'scope': 'openid reports/read'}
+    assert policy.permissions(claims) == {'orders:read', 'reports:read'}
+    # remembered for the same groups and scopes
+    assert policy.permissions(dict(claims)) is policy.permissions(claims)
+    assert policy.permissions(
+        {'cognito:groups': ['Admins', 'Unknown']}) == {
+            'orders:read', 'orders:write'}
+    assert policy.permissions({}) == frozenset()
+
+
+def test_memo_bounded():
+    policy = Policy(groups={'a': ['x']}, memo_size=2)
+    for scope in ('1', '2', '3'):
+        policy.permissions({'scope': scope})
+    assert len(policy._memo) <= 2
+
+
+def test_no_policy():
+    assert Policy.fromConfig({}).permissions(
+        {'cognito:groups': ['Admins']}) == frozenset()
+
+
+@pytest.mark.parametrize('config', [
+    {'roles': {}},
+    {'groups': {'Admins': 'orders:write'}},
+])
+def test_invalid_policy(app, config):
+    app.config['COGNITO_PERMISSIONS'] = config
+    with pytest.raises(ValueError):
+        CognitoLogin(app)
+
+
+def test_hasPermission(app):
+    app.config['COGNITO_PERMISSIONS'] = POLICY
+    cl = CognitoLogin(app)
+    identity = {'cognito:groups': ['Sales'], 'exp': 0}
+    with app.test_request_context('/'):
+        assert cl.hasPermission('orders:read', identity)
+        assert not cl.hasPermission('orders:write', identity)
+        # no bearer token in the request
+        assert not cl.hasPermission('orders:read')
@@ -0,0 +1,209 @@
+from flask_cognitologin.cognitologin import CognitoLogin
+from flask_cognitologin.revocation import (
+    BloomFilter, FileFeed, HTTPFeed, RevocationList)
+from jose import jwt
+import flask
+import threading
+import pytest
+import time
+
+from .conftest import makeToken, RSA_CLIENT_ID
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, data=None, etag=None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = {'ETag': etag} if etag else {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(self.status_code)
+
+    def json(self):
+        return self.data
+
+
+class FakeHTTP(object):
+
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url, headers=None):
+        self.requests.append(headers)
+        if headers.get('If-None-Match') == '"v1"':
+            return FakeResponse(304)
+        return FakeResponse(200, {'revoked': ['jti-1']}, etag='"v1"')
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add('revoked-%d' % i)
+    assert all('revoked-%d' % i in bloom for i in range(1000))
+    false_positives = sum('valid-%d' % i in bloom for i in range(1000))
+    assert false_positives < 50
+
+
+def test_file_feed(tmp_path):
+    path = tmp_path / 'revoked.txt'
+    path.write_text('# revoked tokens\njti-1\n\nsub-1\n')
+    feed = FileFeed(str(path))
+    assert feed() == ['jti-1', 'sub-1']
+    assert feed() is None
+
+
+def test_http_feed():
+    http = FakeHTTP()
+    feed = HTTPFeed('http://127.0.0.1/revoked', http=http)
+    assert feed() == ['jti-1']
+    assert feed() is None
+    assert http.requests == [{}, {'If-None-Match': '"v1"'}]
+
+
+def test_revocation_list():
+    values = [['jti-1']]
+    revocations = RevocationList(lambda: values.pop(0))
+    assert revocations.load()
+    assert revocations.isRevoked({'jti': 'jti-1'})
+    assert revocations.isRevoked({'jti': 'other', 'origin_jti': 'jti-1'})
+    assert not revocations.isRevoked({'jti': 'other', 'sub': 'someone'})
+    # a failing feed keeps the current values
+    with pytest.raises(IndexError):
+        revocations.load()
+    assert revocations.isRevoked({'jti': 'jti-1'})
+
+
+def test_big_list_uses_bloom_filter():
+    revocations = RevocationList(
+        lambda: ['jti-%d' % i for i in range(100)], bloom_threshold=10)
+    revocations.load()
+    assert isinstance(revocations.revoked, BloomFilter)
+    assert revocations.isRevoked({'jti': 'jti-42'})
+
+
+def test_background_sync():
+    values = [['jti-1'], ['jti-2']]
+    revocations = RevocationList(lambda: values.pop(0), interval=0)
+    revocations.load()
+    revocations.isRevoked({})
+    for _ in range(100):
+        if revocations.isRevoked({'jti': 'jti-2'}):
+            break
+        time.sleep(0.01)
+    assert revocations.isRevoked({'jti': 'jti-2'})
+    assert not revocations.isRevoked({'jti': 'jti-1'})
+
+
+def test_first_check_waits_for_the_feed():
+    started = threading.Event()
+    release = threading.Event()
+    reads = []
+
+    def feed():
+        reads.append(1)
+        started.set()
+        release.wait(5)
+        return ['jti-1']
+
+    revocations = RevocationList(feed)
+    results = []
+    threads = [threading.Thread(
+        target=lambda: results.append(revocations.isRevoked({'jti': 'jti-1'})))
+        for _ in range(4)]
+    [t.start() for t in threads]
+    started.wait(5)
+    release.set()
+    [t.join() for t in threads]
+    assert results == [True] * 4
+    assert len(reads) == 1
+
+
+@pytest.mark.real_jwt
+def test_revoked_sub_refused_on_first_check(app, tmp_path, rsa_keys):
+    path = tmp_path / 'revoked.txt'
+    path.write_text('rsa-user\n')
+    app.config['COGNITO_REVOCATION_FEED'] = str(path)
+    app.config['COGNITO_CLIENT_ID'] = RSA_CLIENT_ID
+    cl = revokedLogin(app)
+    cl.jwks_cache._store(cl.tenant.issuer, rsa_keys[1]['keys'])
+    token = makeToken(
+        rsa_keys[0], 'rsa-key-0', token_use='access', iss=cl.tenant.issuer)
+    with app.test_request_context('/'):
+        with pytest.raises(jwt.JWTError):
+            cl.verifyAccessToken(token)
+
+
+@pytest.fixture
+def revoked_app(app, tmp_path, monkeypatch):
+    path = tmp_path / 'revoked.txt'
+    path.write_text('revoked-jti\nrevoked-sub\n')
+    app.config['COGNITO_REVOCATION_FEED'] = str(path)
+    claims = {
+        'sub': 'some-sub',
+        'token_use': 'access',
+        'client_id': 'myclient-id',
+        'iss': 'https://cognito-idp.some-region.amazonaws.com/some-pool-id',
+        'exp': time.time() + 3600,
+    }
+    monkeypatch.setattr(
+        jwt, 'decode', lambda token, *a, **kw: dict(claims, jti=token))
+    return app
+
+
+def revokedLogin(app):
+    cl = CognitoLogin(app)
+    # init_app does not read the feed, the first check does
+    assert app.extensions['cognitologin'].revocations.loaded_at is None
+    return cl
+
+
+def test_lazy_http_feed(app):
+    app.config['COGNITO_REVOCATION_FEED'] = 'http://127.0.0.1/revoked'
+    CognitoLogin(app)
+    state = app.extensions['cognitologin']
+    assert state._http is None
+    assert state.revocations.loaded_at is None
+    assert state.revocations.feed.http_factory() is state.http
+
+
+def test_revoked_bearer_token(revoked_app):
+    cl = revokedLogin(revoked_app)
+
+    @revoked_app.route('/orders')
+    @cl.requireToken()
+    def orders():
+        return 'ok'
+
+    client = revoked_app.test_client()
+    r = client.get('/orders', headers={'Authorization': 'Bearer some-jti'})
+    assert r.status_code == 200
+    r = client.get(
+        '/orders', headers={'Authorization': 'Bearer revoked-jti'})
+    assert r.status_code == 401
+
+
+def test_revoked_identity(revoked_app):
+    cl = revokedLogin(revoked_app)
+    identity = {
+        'sub': 'revoked-sub',
+        'exp': time.time() + 3600,
+        'refresh_token': 'some-refresh-token',
+    }
+    assert cl.checkIdentity(identity) is None
+    identity['sub'] = 'some-sub'
+    assert cl.checkIdentity(identity) is identity
+
+
+@pytest.mark.parametrize('sub,revoked', [
+    ('some-sub', False), ('revoked-sub', True)])
+def test_revoked_user_sign_in(revoked_app, monkeypatch, sub, revoked):
+    monkeypatch.setattr(
+        jwt, 'decode',
+        lambda token, *a, **kw: {'sub': sub, 'exp': time.time() + 3600})
+    cl = revokedLogin(revoked_app)
+    with revoked_app.test_request_context('/?state=abc&code=some-code'):
+        flask.session['mycogext_csrf_state'] = 'abc'
+        identity = cl.getIdentity()
+    assert (identity is None) == revoked
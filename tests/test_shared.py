@@ -0,0 +1,89 @@
+from flask_cognitologin.cognitologin import CognitoLogin
+from flask_cognitologin.shared import (
+    SharedDB, SharedJWKSCache, SharedTokenCache)
+import pytest
+import time
+import os
+
+from .conftest import JWKSResponse
+
+ISSUER = 'https://issuer'
+
+
+class CountingHTTP(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        return JWKSResponse()
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'shared.db')
+
+
+def test_keys_are_fetched_once_per_host(path):
+    http = CountingHTTP()
+    # each cache plays a different worker process
+    first = SharedJWKSCache(SharedDB(path))
+    second = SharedJWKSCache(SharedDB(path))
+    assert first.getKey(ISSUER, 'key1', http=http) is not None
+    assert second.getKey(ISSUER, 'key1', http=http) is not None
+    assert http.calls == 1
+    # a rotation refetched by a worker is reused by the others
+    assert first.refetch(ISSUER, http=http)
+    assert second.refetch(ISSUER, http=http)
+    assert http.calls == 2
+
+
+def test_stale_shared_keys(path):
+    http = CountingHTTP()
+    SharedJWKSCache(SharedDB(path)).get(ISSUER, http=http)
+    SharedJWKSCache(SharedDB(path), ttl=-1).get(ISSUER, http=http)
+    assert http.calls == 2
+
+
+def test_claims_are_shared(path):
+    first = SharedTokenCache(SharedDB(path))
+    second = SharedTokenCache(SharedDB(path))
+    key = first.key('token')
+    first.set(key, {'sub': 'someone', 'exp': time.time() + 60})
+    assert second.get(key)['sub'] == 'someone'
+    assert second.stats()['hits'] == 1
+    first.set(first.key('expired'), {'exp': time.time() - 1})
+    assert second.get(first.key('expired')) is None
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="needs fork")
+def test_preload_before_fork(path):
+    http = CountingHTTP()
+    db = SharedDB(path)
+    SharedJWKSCache(db).preload(ISSUER, http=http)
+    tokens = SharedTokenCache(db)
+    key = tokens.key('token')
+    tokens.set(key, {'sub': 'someone', 'exp': time.time() + 60})
+
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        try:
+            worker = SharedJWKSCache(db)
+            ok = worker.getKey(ISSUER, 'key1', http=http) is not None
+            ok = ok and http.calls == 1
+            ok = ok and SharedTokenCache(db).get(key) is not None
+        finally:
+            os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+
+
+def test_app_shared_cache(app, path):
+    app.config['COGNITO_SHARED_CACHE_PATH'] = path
+    cl = CognitoLogin(app)
+    assert isinstance(cl.jwks_cache, SharedJWKSCache)
+    assert isinstance(cl.tokenCache, SharedTokenCache)
+    assert cl._verify('some-token')['sub'] == \
+        '3ed0096e-6ebd-4879-8786-80b662df0b12'
+    assert cl.JWKS[0]['kid'] == 'key1'
@@ -0,0 +1,116 @@
+from flask_cognitologin.cognitologin import CognitoLogin
+from flask_cognitologin.store import MemoryIdentityStore
+from flask_cognitologin.store import SQLiteIdentityStore
+from flask_cognitologin import store as store_module
+import threading
+import pytest
+import os
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryIdentityStore()
+    return SQLiteIdentityStore(str(tmp_path / 'identities.db'))
+
+
+def test_store(store):
+    handle = store.add({'sub': 'someuser'})
+    assert store.get(handle) == {'sub': 'someuser'}
+    store.set(handle, {'sub': 'otheruser'})
+    assert store.get(handle) == {'sub': 'otheruser'}
+    store.delete(handle)
+    assert store.get(handle) is None
+
+
+def test_store_ttl(store):
+    store.ttl = -1
+    handle = store.add({'sub': 'someuser'})
+    assert store.get(handle) is None
+
+
+def test_sqlite_store_purges(tmp_path, monkeypatch):
+    monkeypatch.setattr(store_module, 'PURGE_EVERY', 2)
+    store = SQLiteIdentityStore(str(tmp_path / 'identities.db'), ttl=-1)
+    store.add({'sub': 'expired'})
+    store.ttl = 60
+    store.add({'sub': 'someuser'})
+    with store._connect() as db:
+        rows = db.execute(
+            "SELECT COUNT(*) FROM cognito_identities").fetchone()
+    assert rows == (1,)
+
+
+def test_sqlite_store_counts_every_write(tmp_path):
+    store = SQLiteIdentityStore(str(tmp_path / 'identities.db'))
+
+    def add():
+        for _ in range(50):
+            store.add({'sub': 'someuser'})
+
+    threads = [threading.Thread(target=add) for _ in range(4)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert store._writes == 200
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="needs fork")
+def test_sqlite_store_after_fork(tmp_path):
+    store = SQLiteIdentityStore(str(tmp_path / 'identities.db'))
+    handle = store.add({'sub': 'someuser'})
+
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        ok = False
+        try:
+            ok = store.get(handle) == {'sub': 'someuser'}
+            db = store.db
+            ok = ok and db._db is not None and db._pid == os.getpid()
+            store.set(handle, {'sub': 'otheruser'})
+        finally:
+            os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    assert store.get(handle) == {'sub': 'otheruser'}
+
+
+def test_memory_store_lru():
+    store = MemoryIdentityStore(size=2)
+    first = store.add({'sub': 'first'})
+    second = store.add({'sub': 'second'})
+    store.get(first)
+    store.add({'sub': 'third'})
+    assert store.get(first) is not None
+    assert store.get(second) is None
+
+
+def test_unknown_store(app):
+    app.config['COGNITO_IDENTITY_STORE'] = 'redis'
+    with pytest.raises(ValueError):
+        CognitoLogin(app)
+
+
+def test_no_store(app):
+    cl = CognitoLogin(app)
+    with pytest.raises(RuntimeError):
+        cl.storeIdentity({'sub': 'someuser'})
+
+
+def test_checkIdentity_handle(app, ident):
+    app.config['COGNITO_IDENTITY_STORE'] = 'memory'
+    cl = CognitoLogin(app)
+    with app.test_request_context('/'):
+        handle = cl.storeIdentity(ident)
+        info = cl.checkIdentity(handle)
+        stored = cl.identityStore.get(handle)
+        if ident['at_hash'] == 'expired':
+            assert info['at_hash'] == 'some-thing'
+            assert stored['at_hash'] == 'some-thing'
+        elif ident['at_hash'] == 'valid':
+            assert info['email'] == 'some@example.com'
+            assert stored is ident
+        else:
+            assert info is None
+            assert stored is None
+        cl.forgetIdentity(handle)
+        assert cl.checkIdentity(handle) is None
@@ -0,0 +1,246 @@
+from flask_cognitologin.cognitologin import CognitoLogin
+from flask_cognitologin.tenants import Tenant, TenantRegistry
+from jose import jwt
+from werkzeug.exceptions import NotFound
+import requests
+import flask
+import pytest
+import time
+
+
+def tenantConfig(name, **extra):
+    config = {
+        'AWS_REGION': 'some-region',
+        'COGNITO_POOL_ID': '%s-pool' % name,
+        'COGNITO_DOMAIN': '%s.auth.example.com' % name,
+        'COGNITO_CLIENT_ID': '%s-client' % name,
+        'COGNITO_CALLBACK_URL': 'https://%s.example.com/callback' % name,
+        'COGNITO_CLIENT_SECRET': '%s-secret' % name,
+    }
+    config.update(extra)
+    return config
+
+
+@pytest.fixture
+def tenants_app(app):
+    app.config['COGNITO_TENANTS'] = {
+        'acme': tenantConfig('acme', HOSTS=['acme.example.com']),
+        'globex': tenantConfig(
+            'globex', HOSTS=['globex.example.com'], PATH_PREFIX='globex'),
+    }
+    return app
+
+
+def test_registry_lookups():
+    default = Tenant('default', tenantConfig('default'))
+    acme = Tenant('acme', tenantConfig(
+        'acme', HOSTS=['Acme.example.com'], PATH_PREFIX='/acme/'))
+    registry = TenantRegistry(default)
+    registry.add(acme)
+    assert len(registry) == 2
+    assert registry.get('acme') is acme
+    assert registry.get('nobody') is default
+    assert registry.byHost('acme.example.com:8443') is acme
+    assert registry.byHost('other.example.com') is default
+    assert registry.byPath('/acme/login') is acme
+    assert registry.byPath('/login') is default
+    assert registry.byIssuer(acme.issuer) is acme
+    assert registry.byIssuer('https://unknown') is None
+    assert registry.byIssuer(acme.issuer, 'acme-client') is acme
+    assert registry.byIssuer(acme.issuer, 'other-client') is None
+    assert acme.domain_url == 'https://acme.auth.example.com'
+    assert acme.issuer.endswith('/acme-pool')
+
+
+def test_missing_tenant_keys():
+    with pytest.raises(ValueError):
+        Tenant('broken', {'AWS_REGION': 'some-region'})
+
+
+def test_sign_in_url_by_host(tenants_app):
+    cl = CognitoLogin(tenants_app)
+    with tenants_app.test_request_context(
+            '/', base_url='https://acme.example.com'):
+        url = cl.getSignInUrl()
+        assert url.startswith('https://acme.auth.example.com/login?')
+        assert 'client_id=acme-client' in url
+        assert cl.tenant.name == 'acme'
+    with tenants_app.test_request_context('/'):
+        assert 'client_id=myclient-id' in cl.getSignInUrl()
+        assert cl.tenant.name == 'default'
+
+
+def test_tenant_by_path(tenants_app):
+    tenants_app.config['COGNITO_TENANT_BY'] = 'path'
+    cl = CognitoLogin(tenants_app)
+    with tenants_app.test_request_context('/globex/callback'):
+        assert cl.tenant.name == 'globex'
+    with tenants_app.test_request_context(
+            '/callback', base_url='https://acme.example.com'):
+        assert cl.tenant.name == 'default'
+
+
+def test_tenant_by_callable(tenants_app):
+    tenants_app.config['COGNITO_TENANT_BY'] = (
+        lambda request: request.headers.get('X-Tenant'))
+    cl = CognitoLogin(tenants_app)
+    with tenants_app.test_request_context(
+            '/', headers={'X-Tenant': 'globex'}):
+        assert cl.tenant.name == 'globex'
+
+
+def test_token_request_uses_tenant(tenants_app, monkeypatch):
+    posts = []
+    post = requests.Session.post
+
+    def mock_post(session, url, *args, **kwargs):
+        posts.append((url, kwargs['auth'][0], kwargs['data']))
+        return post(session, url, *args, **kwargs)
+
+    monkeypatch.setattr(requests.Session, 'post', mock_post)
+    cl = CognitoLogin(tenants_app)
+    http = cl.http
+    with tenants_app.test_request_context(
+            '/', base_url='https://globex.example.com'):
+        assert cl.getTokens('some-refresh-token') is not None
+        # every tenant shares the app connection pool
+        assert cl.http is http
+    url, client, data = posts[0]
+    assert url == 'https://globex.auth.example.com/oauth2/token'
+    assert client == 'globex-client'
+    assert data['client_id'] == 'globex-client'
+
+
+def test_only_tenants(unconfig_app):
+    unconfig_app.config['SECRET_KEY'] = 'test-secret'
+    unconfig_app.config['COGNITO_TENANTS'] = {
+        'acme': tenantConfig('acme', HOSTS=['acme.example.com'])}
+    cl = CognitoLogin(unconfig_app)
+    with unconfig_app.test_request_context(
+            '/', base_url='https://acme.example.com'):
+        assert cl.tenant.name == 'acme'
+    with unconfig_app.test_request_context('/'):
+        with pytest.raises(NotFound):
+            cl.getSignInUrl()
+
+
+def test_verified_tokens_are_not_shared(tenants_app, monkeypatch):
+    decoded = []
+
+    def decode(token, key, audience=None, **kwargs):
+        decoded.append(audience)
+        return {'exp': time.time() + 60, 'aud': audience}
+
+    monkeypatch.setattr(jwt, 'decode', decode)
+    cl = CognitoLogin(tenants_app)
+    tenants = cl.tenants
+    assert cl._verify('token', tenant=tenants.get('acme'))['aud'] == \
+        'acme-client'
+    assert cl._verify('token', tenant=tenants.get('acme'))['aud'] == \
+        'acme-client'
+    assert cl._verify('token', tenant=tenants.get('globex'))['aud'] == \
+        'globex-client'
+    assert decoded == ['acme-client', 'globex-client']
+
+
+def test_bearer_tenant_by_issuer(tenants_app, monkeypatch):
+    tenants_app.config['COGNITO_TENANT_BY'] = 'issuer'
+    cl = CognitoLogin(tenants_app)
+    globex = cl.tenants.get('globex')
+    claims = {
+        'iss': globex.issuer,
+        'client_id': globex.client_id,
+        'token_use': 'access',
+        'sub': 'some-user',
+        'exp': time.time() + 60,
+    }
+    monkeypatch.setattr(
+        jwt, 'get_unverified_claims', lambda token: dict(claims, iss=token))
+    monkeypatch.setattr(jwt, 'decode', lambda *a, **kw: dict(claims))
+
+    @tenants_app.route('/orders')
+    @cl.requireToken()
+    def orders():
+        return flask.g.cognito_claims['sub']
+
+    client = tenants_app.test_client()
+    r = client.get(
+        '/orders', headers={'Authorization': 'Bearer ' + globex.issuer})
+    assert r.status_code == 200
+    r = client.get(
+        '/orders', headers={'Authorization': 'Bearer https://unknown'})
+    assert r.status_code == 401
+    # a token of another tenant of the same app is refused
+    acme = cl.tenants.get('acme')
+    r = client.get(
+        '/orders', headers={'Authorization': 'Bearer ' + acme.issuer})
+    assert r.status_code == 401
+
+
+def test_refresh_tenant_by_issuer(tenants_app, monkeypatch):
+    tenants_app.config['COGNITO_TENANT_BY'] = 'issuer'
+    tenants_app.config['COGNITO_IDENTITY_CLAIMS'] = ['sub']
+    posts = []
+    post = requests.Session.post
+
+    def mock_post(session, url, *args, **kwargs):
+        posts.append((url, kwargs['auth'][0]))
+        return post(session, url, *args, **kwargs)
+
+    monkeypatch.setattr(requests.Session, 'post', mock_post)
+    cl = CognitoLogin(tenants_app)
+    # the refresh needs the claims of the tenant
+    assert {'iss', 'aud'} <= set(cl._state.identity_claims)
+    globex = cl.tenants.get('globex')
+    identity = {
+        'exp': 0, 'refresh_token': 'some-refresh-token',
+        'iss': globex.issuer, 'aud': globex.client_id}
+    with tenants_app.test_request_context('/'):
+        cl.checkIdentity(identity)
+        assert posts == [(
+            'https://globex.auth.example.com/oauth2/token', 'globex-client')]
+        # never sent to the default tenant
+        del posts[:]
+        assert cl.checkIdentity(dict(identity, iss='https://unknown')) is None
+        assert cl.checkIdentity({
+            'exp': 0, 'refresh_token': 'some-refresh-token'}) is None
+        assert posts == []
+
+
+def test_clients_of_one_pool(app, monkeypatch):
+    app.config['COGNITO_TENANT_BY'] = 'issuer'
+    app.config['COGNITO_TENANTS'] = {
+        'web': tenantConfig('web', COGNITO_POOL_ID='shared-pool'),
+        'mobile': tenantConfig('mobile', COGNITO_POOL_ID='shared-pool'),
+    }
+    cl = CognitoLogin(app)
+    issuer = cl.tenants.get('web').issuer
+    assert cl.tenants.get('mobile').issuer == issuer
+    claims = {'iss': issuer, 'token_use': 'access', 'sub': 'some-user',
+              'exp': time.time() + 60}
+    monkeypatch.setattr(
+        jwt, 'get_unverified_claims',
+        lambda token: dict(claims, client_id=token))
+    monkeypatch.setattr(
+        jwt, 'decode', lambda token, *a, **kw: dict(claims, client_id=token))
+
+    with app.test_request_context('/'):
+        for client_id in ('web-client', 'mobile-client'):
+            assert cl.verifyAccessToken(client_id)['client_id'] == client_id
+        with pytest.raises(jwt.JWTError):
+            cl.verifyAccessToken('other-client')
+
+
+def test_preload_every_tenant(tenants_app, monkeypatch):
+    calls = []
+    get = requests.Session.get
+
+    def mock_get(session, url, *args, **kwargs):
+        calls.append(url)
+        return get(session, url, *args, **kwargs)
+
+    monkeypatch.setattr(requests.Session, 'get', mock_get)
+    tenants_app.config['COGNITO_JWKS_PRELOAD'] = True
+    CognitoLogin(tenants_app)
+    assert len(calls) == 3
+    assert any('/acme-pool/' in url for url in calls)
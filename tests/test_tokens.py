@@ -0,0 +1,61 @@
+from flask_cognitologin.cognitologin import CognitoLogin
+from flask_cognitologin.tokens import TokenSet, identityChanges
+from jose import jwt
+import pytest
+import time
+
+
+def test_token_set():
+    tokens = TokenSet.fromJson({
+        'id_token': 'id', 'access_token': 'access', 'expires_in': 3600,
+        'token_type': 'Bearer'})
+    assert tokens.refresh_token is None
+    assert tokens.identity({'sub': 'x'}, 'old-refresh') == {
+        'sub': 'x', 'refresh_token': 'old-refresh'}
+    with pytest.raises(AttributeError):
+        tokens.other = 1
+    with pytest.raises(KeyError):
+        TokenSet.fromJson({'id_token': 'id'})
+
+
+def test_compact_identity():
+    tokens = TokenSet('id', 'access', refresh_token='new-refresh')
+    claims = {'sub': 'x', 'email': 'x@example.com', 'exp': 10, 'iat': 5}
+    assert tokens.identity(claims, 'old-refresh', claims=['sub']) == {
+        'sub': 'x', 'exp': 10, 'refresh_token': 'new-refresh'}
+
+
+def test_identity_changes():
+    old = {'sub': 'x', 'exp': 10, 'name': 'X'}
+    assert identityChanges(old, dict(old)) == {}
+    assert identityChanges(old, {'sub': 'x', 'exp': 20, 'email': 'e'}) == {
+        'exp': 20, 'email': 'e', 'name': None}
+
+
+def test_verify_token_set(app, monkeypatch):
+    headers, decoded = [], []
+
+    def header(token):
+        headers.append(token)
+        return {'kid': 'key1'}
+
+    def decode(token, key, **kwargs):
+        decoded.append((token, kwargs.get('access_token')))
+        return {'exp': time.time() + 60, 'token_use': token}
+
+    monkeypatch.setattr(jwt, 'get_unverified_header', header)
+    monkeypatch.setattr(jwt, 'decode', decode)
+    cl = CognitoLogin(app)
+    lookups = []
+    getKey = cl._getKey
+    monkeypatch.setattr(
+        cl, '_getKey',
+        lambda kid, tenant=None: lookups.append(kid) or getKey(kid, tenant))
+    tokens = TokenSet('id', 'access')
+    assert cl._verifyTokenSet(tokens)['token_use'] == 'id'
+    assert tokens.access_claims['token_use'] == 'access'
+    assert decoded == [('access', None), ('id', 'access')]
+    assert lookups == ['key1']
+    # cached now
+    cl._verifyTokenSet(TokenSet('id', 'access'))
+    assert len(headers) == 2
@@ -0,0 +1,71 @@
+from flask_cognitologin.cognitologin import CognitoLogin
+from flask_cognitologin.transport import CognitoClient
+import requests
+import threading
+import pytest
+import os
+
+
+def test_client_from_config(app):
+    app.config['COGNITO_HTTP_POOL_SIZE'] = 3
+    app.config['COGNITO_HTTP_CONNECT_TIMEOUT'] = 1
+    app.config['COGNITO_HTTP_READ_TIMEOUT'] = 2
+    app.config['COGNITO_HTTP_RETRIES'] = 4
+    cl = CognitoLogin(app)
+    assert cl.http.timeout == (1, 2)
+    assert cl.http.adapter._pool_maxsize == 3
+    assert cl.http.adapter.max_retries.total == 4
+    # POST are not retried on read errors
+    assert not cl.http.adapter.max_retries._is_method_retryable('POST')
+
+
+def test_session_per_thread():
+    client = CognitoClient()
+    sessions = [client.session]
+    t = threading.Thread(target=lambda: sessions.append(client.session))
+    t.start()
+    t.join()
+    assert sessions[0] is client.session
+    assert sessions[0] is not sessions[1]
+    assert sessions[1].get_adapter('https://x') is client.adapter
+
+
+def test_token_request_uses_timeout(app, monkeypatch):
+    calls = []
+
+    def mock_post(session, url, *args, **kwargs):
+        calls.append(kwargs)
+        raise requests.ConnectTimeout()
+
+    monkeypatch.setattr(requests.Session, 'post', mock_post)
+    with app.test_request_context('/'):
+        cl = CognitoLogin(app)
+        assert cl.getTokens('fake-refresh-token') is None
+    assert calls[0]['timeout'] == cl.http.timeout
+    assert calls[0]['auth'][0] == app.config['COGNITO_CLIENT_ID']
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="needs fork")
+def test_pool_not_shared_after_fork(cognito_stub, monkeypatch):
+    # real requests sessions
+    monkeypatch.undo()
+    url = cognito_stub.url + '/.well-known/jwks.json'
+    client = CognitoClient()
+    # the preloading master leaves a keep-alive connection in the pool
+    assert client.get(url).ok
+    adapter, session = client.adapter, client.session
+
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        ok = False
+        try:
+            ok = client.adapter is not adapter
+            ok = ok and client.session is not session
+            ok = ok and client.session.get_adapter(url) is client.adapter
+            ok = ok and client.get(url).ok
+        finally:
+            os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    assert client.adapter is adapter
+    assert client.get(url).ok
@@ -0,0 +1,152 @@
+from flask_cognitologin.cache import UserInfoCache
+from flask_cognitologin import CognitoLogin
+from jose.exceptions import JWTError
+import threading
+import requests
+import pytest
+import time
+
+from .conftest import makeToken, RSA_CLIENT_ID as CLIENT_ID
+
+KID = 'rsa-key-0'
+
+pytestmark = pytest.mark.real_jwt
+
+
+class UserInfoEndpoint(object):
+
+    def __init__(self):
+        self.requests = []
+        self.etag = '"v1"'
+        self.status_code = 200
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def headers(self):
+        return {'ETag': self.etag}
+
+    def get(self, session, url, headers=None, **kwargs):
+        if 'jwks.json' in url:
+            raise AssertionError("keys are stored by the test")
+        self.requests.append(dict(headers))
+        time.sleep(0.05)
+        if headers.get('If-None-Match') == self.etag:
+            return NotModified()
+        return self
+
+    def json(self):
+        return {'sub': 'rsa-user', 'email': 'user@example.com',
+                'version': len(self.requests)}
+
+
+class NotModified(object):
+    ok = False
+    status_code = 304
+
+
+@pytest.fixture
+def endpoint(monkeypatch):
+    endpoint = UserInfoEndpoint()
+    monkeypatch.setattr(
+        requests.Session, 'get',
+        lambda session, url, **kwargs: endpoint.get(session, url, **kwargs))
+    return endpoint
+
+
+@pytest.fixture
+def login(app, rsa_keys):
+    app.config['COGNITO_CLIENT_ID'] = CLIENT_ID
+    cl = CognitoLogin(app)
+    cl.jwks_cache._store(cl.tenant.issuer, rsa_keys[1]['keys'])
+    return cl
+
+
+def token(rsa_keys, login, token_use='access', **claims):
+    return makeToken(
+        rsa_keys[0], KID, token_use=token_use, iss=login.tenant.issuer,
+        **claims)
+
+
+def test_cached_per_user(app, rsa_keys, login, endpoint):
+    access_token = token(rsa_keys, login)
+    with app.test_request_context('/'):
+        info = login.getUserInfo(access_token)
+        assert info['email'] == 'user@example.com'
+        info['email'] = 'changed'
+        assert login.getUserInfo(access_token)['email'] == 'user@example.com'
+        login.getUserInfo(token(rsa_keys, login, sub='other-user'))
+    assert len(endpoint.requests) == 2
+    assert endpoint.requests[0] == {
+        'Authorization': 'Bearer ' + access_token}
+
+
+def test_invalid_token_not_sent(app, rsa_keys, login, endpoint):
+    with app.test_request_context('/'):
+        with pytest.raises(JWTError):
+            login.getUserInfo(token(rsa_keys, login, token_use='id'))
+    assert endpoint.requests == []
+
+
+def test_revalidated_after_ttl(app, rsa_keys, login, endpoint):
+    app.config['COGNITO_USERINFO_TTL'] = 0
+    login = CognitoLogin(app)
+    login.jwks_cache._store(login.tenant.issuer, rsa_keys[1]['keys'])
+    results = []
+    login.metrics.connect(
+        lambda kind, name, value, labels: results.append(labels['result'])
+        if name == 'userinfo_cache' else None)
+    access_token = token(rsa_keys, login)
+    with app.test_request_context('/'):
+        assert login.getUserInfo(access_token)['version'] == 1
+        # not modified, the cached response is kept
+        assert login.getUserInfo(access_token)['version'] == 1
+        endpoint.etag = '"v2"'
+        assert login.getUserInfo(access_token)['version'] == 3
+    assert endpoint.requests[1]['If-None-Match'] == '"v1"'
+    assert results == ['miss', 'revalidated', 'miss']
+
+
+def test_failed_lookup(app, rsa_keys, login, endpoint):
+    endpoint.status_code = 401
+    with app.test_request_context('/'):
+        assert login.getUserInfo(token(rsa_keys, login)) is None
+
+
+def test_concurrent_lookups_share_the_request(app, rsa_keys, login, endpoint):
+    access_token = token(rsa_keys, login)
+    barrier = threading.Barrier(8)
+    infos = []
+
+    def worker():
+        with app.test_request_context('/'):
+            barrier.wait()
+            infos.append(login.getUserInfo(access_token))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert len(infos) == 8 and all(i['version'] == 1 for i in infos)
+    assert len(endpoint.requests) == 1
+
+
+def test_cache_bounds():
+    fetches = []
+
+    def fetch(etag):
+        fetches.append(etag)
+        return {'n': len(fetches)}, None
+
+    cache = UserInfoCache(size=2, ttl=300)
+    for key in 'abc':
+        cache.get(key, fetch, time.time() + 3600)
+    assert len(cache) == 2
+    assert cache.get('c', fetch, 0) == {'n': 3}
+    # evicted
+    assert cache.get('a', fetch, 0) == {'n': 4}
+    # not kept past the token expiration
+    cache.get('d', fetch, time.time() - 1)
+    cache.get('d', fetch, time.time() + 3600)
+    assert len(fetches) == 6
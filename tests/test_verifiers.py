@@ -0,0 +1,181 @@
+from flask_cognitologin.verifiers import (
+    VERIFIERS, JoseVerifier, verifierFromConfig)
+from flask_cognitologin.jwks import JWKSCache
+from flask_cognitologin import CognitoLogin
+from jose.exceptions import JWTError, ExpiredSignatureError
+from jose import jws
+import pytest
+import time
+
+from .conftest import makeToken, RSA_CLIENT_ID as CLIENT_ID
+
+KID = 'rsa-key-0'
+OTHER = 'rsa-key-1'
+
+pytestmark = pytest.mark.real_jwt
+
+
+@pytest.fixture(params=sorted(VERIFIERS))
+def verifier(request):
+    if request.param == 'pyjwt':
+        pytest.importorskip('jwt')
+    return VERIFIERS[request.param]()
+
+
+@pytest.fixture
+def decode(rsa_keys, verifier):
+    by_kid = verifier.parseKeys(rsa_keys[1]['keys'])
+
+    def decode(token, access_token=None, leeway=0):
+        assert verifier.header(token)['kid'] == KID
+        return verifier.decode(
+            token, by_kid[KID], audience=CLIENT_ID,
+            access_token=access_token, leeway=leeway)
+    return decode
+
+
+def sign(rsa_keys, claims, key=KID):
+    return jws.sign(
+        claims, rsa_keys[0][key], headers={'kid': KID}, algorithm='RS256')
+
+
+def test_access_token(rsa_keys, decode):
+    token = makeToken(rsa_keys[0], KID, token_use='access')
+    claims = decode(token)
+    assert claims['client_id'] == CLIENT_ID
+    assert claims['token_use'] == 'access'
+
+
+def test_id_token(rsa_keys, decode):
+    access_token = makeToken(rsa_keys[0], KID, token_use='access')
+    token = makeToken(rsa_keys[0], KID, access_token=access_token)
+    assert decode(token, access_token)['aud'] == CLIENT_ID
+    with pytest.raises(JWTError):
+        decode(token)
+    with pytest.raises(JWTError):
+        decode(token, makeToken(rsa_keys[0], KID, token_use='access', jti='x'))
+
+
+@pytest.mark.parametrize('claims', [
+    {'aud': 'other-client'},
+    {'aud': ['other-client', 1]},
+    {'nbf': int(time.time()) + 600},
+    {'exp': 'soon'},
+    {'sub': 42},
+])
+def test_bad_claims(rsa_keys, decode, claims):
+    with pytest.raises(JWTError):
+        decode(makeToken(rsa_keys[0], KID, **claims))
+
+
+def test_audience_list(rsa_keys, decode):
+    token = makeToken(rsa_keys[0], KID, aud=['other-client', CLIENT_ID])
+    assert decode(token)['sub'] == 'rsa-user'
+
+
+def test_expired(rsa_keys, decode):
+    token = makeToken(rsa_keys[0], KID, lifetime=-30)
+    with pytest.raises(ExpiredSignatureError):
+        decode(token)
+    assert decode(token, leeway=60)['sub'] == 'rsa-user'
+
+
+def test_bad_signature(rsa_keys, decode):
+    with pytest.raises(JWTError):
+        decode(sign(rsa_keys, {'sub': 'rsa-user'}, key=OTHER))
+    token = makeToken(rsa_keys[0], KID)
+    header, payload, signature = token.split('.')
+    other = makeToken(rsa_keys[0], KID, sub='someone-else').split('.')[1]
+    with pytest.raises(JWTError):
+        decode('.'.join([header, other, signature]))
+
+
+@pytest.mark.parametrize('token', [
+    'not-a-token', 'a.b', 'a.b.c', 'a.b.c.d', '..',
+])
+def test_malformed(rsa_keys, verifier, token):
+    key = verifier.parseKeys(rsa_keys[1]['keys'])[KID]
+    with pytest.raises(JWTError):
+        verifier.header(token)
+    with pytest.raises(JWTError):
+        verifier.decode(token, key, audience=CLIENT_ID)
+
+
+def test_other_algorithms(rsa_keys, decode):
+    token = jws.sign(
+        {'sub': 'rsa-user'}, 'secret', headers={'kid': KID},
+        algorithm='HS256')
+    with pytest.raises(JWTError):
+        decode(token)
+    # alg none, no signature
+    token = jws.sign(
+        {'sub': 'rsa-user'}, 'secret', headers={'kid': KID, 'alg': 'none'},
+        algorithm='HS256')
+    with pytest.raises(JWTError):
+        decode(token.rsplit('.', 1)[0] + '.')
+
+
+def test_not_an_object(rsa_keys, decode):
+    with pytest.raises(JWTError):
+        decode(sign(rsa_keys, b'[1, 2]'))
+
+
+def test_keys_parsed_once_per_verifier(rsa_keys, verifier):
+    cache = JWKSCache()
+    cache._store('https://issuer', rsa_keys[1]['keys'])
+    key = cache.getKey('https://issuer', KID, verifier=verifier)
+    assert key is cache.getKey('https://issuer', KID, verifier=verifier)
+    assert cache.getKey('https://issuer', 'unknown', verifier=verifier) \
+        is None
+    # a refreshed key set is parsed right away for the same verifiers
+    entry = cache._store('https://issuer', rsa_keys[1]['keys'])
+    assert verifier.name in entry.parsed
+
+
+def test_from_config():
+    assert isinstance(verifierFromConfig({}), JoseVerifier)
+    verifier = JoseVerifier()
+    assert verifierFromConfig({'COGNITO_VERIFIER': verifier}) is verifier
+    with pytest.raises(ValueError):
+        verifierFromConfig({'COGNITO_VERIFIER': 'unknown'})
+
+
+def test_unknown_verifier(app):
+    app.config['COGNITO_VERIFIER'] = 'unknown'
+    with pytest.raises(ValueError):
+        CognitoLogin(app)
+
+
+def test_extension_uses_verifier(app, rsa_keys):
+    app.config['COGNITO_VERIFIER'] = 'cryptography'
+    app.config['COGNITO_CLIENT_ID'] = CLIENT_ID
+    cl = CognitoLogin(app)
+    issuer = cl.tenant.issuer
+    cl.jwks_cache._store(issuer, rsa_keys[1]['keys'])
+    token = makeToken(rsa_keys[0], KID, token_use='access', iss=issuer)
+    with app.test_request_context('/'):
+        assert cl.verifyAccessToken(token)['sub'] == 'rsa-user'
+    assert 'cryptography' in cl.jwks_cache._entries[issuer].parsed
+
+
+@pytest.mark.parametrize('kid', [None, 42])
+def test_bearer_without_kid(app, rsa_keys, verifier, kid):
+    app.config['COGNITO_VERIFIER'] = verifier
+    app.config['COGNITO_CLIENT_ID'] = CLIENT_ID
+    cl = CognitoLogin(app)
+    issuer = cl.tenant.issuer
+    cl.jwks_cache._store(issuer, rsa_keys[1]['keys'])
+    headers = {} if kid is None else {'kid': kid}
+    token = jws.sign(
+        {'sub': 'rsa-user', 'token_use': 'access', 'iss': issuer,
+         'client_id': CLIENT_ID, 'exp': int(time.time()) + 60},
+        rsa_keys[0][KID], headers=headers, algorithm='RS256')
+
+    @app.route('/api')
+    @cl.requireToken()
+    def api():
+        return 'ok'
+
+    r = app.test_client().get(
+        '/api', headers={'Authorization': 'Bearer ' + token})
+    assert r.status_code == 401